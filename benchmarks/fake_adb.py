@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Stand-in for the adb executable, driven by environment variables:
+
+PYADB_FAKE_ROOT     directory used as the device filesystem
+PYADB_FAKE_LATENCY  seconds to sleep before answering (default 0)
+"""
+
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakedevice import FakeDevice  # noqa: E402
+
+
+def main(args):
+    latency = float(os.environ.get("PYADB_FAKE_LATENCY", "0"))
+    device = FakeDevice(os.environ.get("PYADB_FAKE_ROOT", os.getcwd()))
+    if latency:
+        time.sleep(latency)
+
+    if args[:1] == ["-s"]:
+        if args[1] != device.serial:
+            sys.stderr.write("error: device '%s' not found\n" % args[1])
+            return 1
+        args = args[2:]
+
+    out = getattr(sys.stdout, "buffer", sys.stdout)
+    cmd = args[0] if args else "help"
+
+    if cmd == "version":
+        out.write(b"Android Debug Bridge version 1.0.41\n")
+    elif cmd == "devices":
+        out.write(("List of devices attached\n%s\tdevice\n\n"
+                   % device.serial).encode('ascii'))
+    elif cmd == "get-state":
+        out.write(b"device\n")
+    elif cmd == "get-serialno":
+        out.write((device.serial + "\n").encode('ascii'))
+    elif cmd in ("shell", "exec-out"):
+        stdout, stderr, code = device.shell(" ".join(args[1:]))
+        out.write(stdout)
+        out.flush()
+        sys.stderr.write(stderr.decode('utf-8'))
+        return code
+    elif cmd == "exec-in":
+        stdin = getattr(sys.stdin, "buffer", sys.stdin).read()
+        stdout, stderr, code = device.shell(" ".join(args[1:]), stdin)
+        out.write(stdout + stderr)
+        return code
+    elif cmd == "pull":
+        size = os.path.getsize(device.path(args[1]))
+        started = time.time()
+        shutil.copyfile(device.path(args[1]), args[2])
+        out.write(("%s: 1 file pulled. (%d bytes in %.3fs)\n" % (
+            args[1], size, time.time() - started)).encode('utf-8'))
+    elif cmd == "push":
+        size = os.path.getsize(args[1])
+        started = time.time()
+        shutil.copyfile(args[1], device.path(args[2]))
+        out.write(("%s: 1 file pushed. (%d bytes in %.3fs)\n" % (
+            args[1], size, time.time() - started)).encode('utf-8'))
+    elif cmd in ("start-server", "kill-server", "wait-for-device"):
+        pass
+    else:
+        sys.stderr.write("adb: unknown command %s\n" % cmd)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
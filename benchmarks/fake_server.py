@@ -0,0 +1,317 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Fake adb server speaking enough of the host protocol for the benchmarks
+(and for trying pyadb without a phone):
+
+host:version, host:devices, host:track-devices, host:kill,
+host:connect:<address>, host:disconnect:<address>, host:list-forward,
+host-serial:<serial>:forward/killforward,
+host-serial:<serial>:get-state/get-serialno/features/wait-for-*,
+host:transport:<serial> followed by shell:, shell,v2,raw:, exec:,
+reverse:, tcp: and
+localabstract: (echo sockets) or sync: (STAT, LIST, RECV, SEND, QUIT).
+
+    server = FakeAdbServer(root="/tmp/device", latency=0.001)
+    server.start()
+    ADB.set_backend(SocketBackend(port=server.port))
+
+or from the command line, printing the port it listens on:
+
+    $ python benchmarks/fake_server.py --root /tmp/device
+"""
+
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from fakedevice import FakeDevice
+
+try:
+    import socketserver
+except ImportError:  # python 2
+    import SocketServer as socketserver
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def read_request(self):
+        return self.read(int(self.read(4), 16)).decode('utf-8')
+
+    def okay(self, payload=None):
+        if payload is None:
+            self.request.sendall(b"OKAY")
+            return
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        self.request.sendall(b"OKAY" + b"%04x" % len(payload) + payload)
+
+    def fail(self, message):
+        message = message.encode('utf-8')
+        self.request.sendall(b"FAIL" + b"%04x" % len(message) + message)
+
+    def handle(self):
+        try:
+            self.handle_host(self.read_request())
+        except (EOFError, socket.error):
+            pass
+
+    def handle_host(self, request):
+        server = self.server
+        device = server.device
+        if server.latency:
+            time.sleep(server.latency)
+
+        if request.startswith("host-serial:"):
+            serial, _, request = request[len("host-serial:"):].partition(":")
+            if serial != device.serial:
+                return self.fail("device '%s' not found" % serial)
+            request = "host:" + request
+
+        if request == "host:version":
+            return self.okay("0029")
+        if request == "host:devices":
+            return self.okay("%s\tdevice\n" % device.serial)
+        if request == "host:track-devices":
+            self.okay("%s\tdevice\n" % device.serial)
+            # keep the stream open until the client goes away
+            while self.request.recv(1):
+                pass
+            return
+        if request.startswith("host:connect:"):
+            return self.okay("connected to %s"
+                             % request[len("host:connect:"):])
+        if request.startswith("host:disconnect:"):
+            return self.okay("disconnected %s"
+                             % request[len("host:disconnect:"):])
+        if request == "host:list-forward":
+            return self.okay("".join("%s %s %s\n" % forward
+                                     for forward in server.forwards))
+        if request.startswith("host:forward:"):
+            local, _, remote = request[len("host:forward:"):].partition(";")
+            local = local.replace("norebind:", "")
+            if local == "tcp:0":
+                local = "tcp:%d" % (27000 + len(server.forwards))
+            server.forwards = [forward for forward in server.forwards
+                               if forward[1] != local]
+            server.forwards.append((device.serial, local, remote))
+            self.request.sendall(b"OKAY")
+            if request.startswith("host:forward:tcp:0;"):
+                return self.okay(local[len("tcp:"):])
+            return self.okay()
+        if request.startswith("host:killforward"):
+            local = request.partition("killforward")[2].lstrip(":")
+            server.forwards = [forward for forward in server.forwards
+                               if local not in ("-all", forward[1])]
+            # connect, then status
+            self.request.sendall(b"OKAY")
+            return self.okay()
+        if request == "host:kill":
+            return self.okay()
+        if request == "host:get-state":
+            return self.okay("device")
+        if request == "host:get-serialno":
+            return self.okay(device.serial)
+        if request == "host:features":
+            return self.okay("cmd,shell_v2,stat_v2")
+        if request.startswith("host:wait-for-"):
+            # accepted, then ready: the fake device is always online
+            self.okay()
+            return self.okay()
+        if request in ("host:transport-any",
+                       "host:transport:%s" % device.serial):
+            self.okay()
+            return self.handle_device(self.read_request())
+        if request.startswith("host:transport:"):
+            return self.fail("device '%s' not found"
+                             % request[len("host:transport:"):])
+        return self.fail("unknown host service %s" % request)
+
+    def handle_device(self, service):
+        device = self.server.device
+        if service.startswith("shell,v2,"):
+            self.okay()
+            return self.handle_shell_v2(service.partition(":")[2])
+        if service.startswith("shell:") or service.startswith("exec:"):
+            self.okay()
+            cmd = service.partition(":")[2]
+            stdin = b""
+            args = cmd.split()
+            if args[1:3] == ["install-write", "-S"]:
+                stdin = self.read(int(args[3]))
+            stdout, stderr, _ = device.shell(cmd, stdin)
+            self.request.sendall(stdout + stderr)
+            return
+        if service.startswith("tcp:") or \
+                service.startswith("localabstract:"):
+            # echo socket
+            self.okay()
+            while True:
+                data = self.request.recv(64 * 1024)
+                if not data:
+                    return
+                self.request.sendall(data)
+        if service == "reverse:list-forward":
+            return self.okay("".join("host %s %s\n" % reverse
+                                     for reverse in self.server.reverses))
+        if service.startswith("reverse:forward:"):
+            remote, _, local = service[len("reverse:forward:"):].partition(
+                ";")
+            self.server.reverses.append((remote.replace("norebind:", ""),
+                                         local))
+            self.request.sendall(b"OKAY")
+            return self.okay()
+        if service.startswith("reverse:killforward"):
+            remote = service.partition("killforward")[2].lstrip(":")
+            self.server.reverses = [
+                reverse for reverse in self.server.reverses
+                if remote not in ("-all", reverse[0])]
+            self.request.sendall(b"OKAY")
+            return self.okay()
+        if service == "sync:":
+            self.okay()
+            return self.handle_sync()
+        return self.fail("unknown device service %s" % service)
+
+    def handle_shell_v2(self, cmd):
+        # the command runs once the client closes its stdin
+        stdin = []
+        while True:
+            kind, length = struct.unpack("<BI", self.read(5))
+            data = self.read(length)
+            if kind == 0:
+                stdin.append(data)
+            elif kind == 4:
+                break
+        stdout, stderr, code = self.server.device.shell(cmd, b"".join(stdin))
+        for kind, data in ((1, stdout), (2, stderr)):
+            if data:
+                self.request.sendall(struct.pack("<BI", kind, len(data)) +
+                                     data)
+        self.request.sendall(struct.pack("<BIB", 3, 1, code & 0xff))
+
+    def handle_sync(self):
+        device = self.server.device
+        while True:
+            header = self.read(8)
+            kind, length = header[:4], struct.unpack("<I", header[4:])[0]
+            if kind == b"QUIT":
+                return
+            arg = self.read(length).decode('utf-8')
+
+            if kind == b"STAT":
+                try:
+                    st = os.stat(device.path(arg))
+                    reply = (st.st_mode, st.st_size, int(st.st_mtime))
+                except OSError:
+                    reply = (0, 0, 0)
+                self.request.sendall(b"STAT" + struct.pack("<III", *reply))
+
+            elif kind == b"LIST":
+                path = device.path(arg)
+                names = os.listdir(path) if os.path.isdir(path) else []
+                for name in names:
+                    st = os.lstat(os.path.join(path, name))
+                    raw = name.encode('utf-8')
+                    self.request.sendall(b"DENT" + struct.pack(
+                        "<IIII", st.st_mode, st.st_size, int(st.st_mtime),
+                        len(raw)) + raw)
+                self.request.sendall(b"DONE" + b"\0" * 16)
+
+            elif kind == b"RECV":
+                try:
+                    with open(device.path(arg), "rb") as data:
+                        while True:
+                            chunk = data.read(64 * 1024)
+                            if not chunk:
+                                break
+                            self.request.sendall(
+                                b"DATA" + struct.pack("<I", len(chunk)))
+                            self.request.sendall(chunk)
+                    self.request.sendall(b"DONE" + struct.pack("<I", 0))
+                except (IOError, OSError) as err:
+                    message = str(err).encode('utf-8')
+                    self.request.sendall(
+                        b"FAIL" + struct.pack("<I", len(message)) + message)
+
+            elif kind == b"SEND":
+                path = device.path(arg.rpartition(",")[0])
+                with open(path, "wb") as data:
+                    while True:
+                        header = self.read(8)
+                        kind = header[:4]
+                        length = struct.unpack("<I", header[4:])[0]
+                        if kind != b"DATA":
+                            break
+                        data.write(self.read(length))
+                os.utime(path, (length, length))
+                self.request.sendall(b"OKAY" + struct.pack("<I", 0))
+
+
+class FakeAdbServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Threaded fake adb server on 127.0.0.1, port 0 picks a free port
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, port=0, latency=0.0, serial="fake-0001"):
+        socketserver.TCPServer.__init__(self, ("127.0.0.1", port), _Handler)
+        self.device = FakeDevice(root, serial)
+        self.forwards = []
+        self.reverses = []
+        self.latency = latency
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Fake adb server")
+    parser.add_argument("--root", default=os.getcwd(),
+                        help="directory used as the device filesystem")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeAdbServer(args.root, args.port, args.latency)
+    # the port is the first line written, for callers using port 0
+    print(server.port)
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Scripted Android device shared by the fake adb binary and the fake adb
+server. Its filesystem is a local directory and its shell only knows a
+few commands, answered without spawning anything so the benchmarks
+measure pyadb rather than the fake.
+"""
+
+import os
+import shlex
+import shutil
+import struct
+import zipfile
+import zlib
+
+
+LINE = b"x" * 79 + b"\n"
+
+
+class FakeDevice(object):
+
+    def __init__(self, root, serial="fake-0001"):
+        self.root = root
+        self.serial = serial
+        self.bugreport_size = 1024 * 1024
+        self.screen_size = (360, 640)
+        self.frames = 0
+        self.properties = {
+            "ro.serialno": serial,
+            "ro.build.version.sdk": "30",
+            "ro.product.model": "pyadb fake",
+            }
+
+    def path(self, remote):
+        return os.path.join(self.root, remote.lstrip("/"))
+
+    def shell(self, cmd, stdin=b""):
+        """
+        Returns (stdout, stderr, exit code) of a device shell command:
+
+        echo <text>         -> text
+        payload <bytes>     -> that many bytes of 80 column text
+        cat <path>          -> file contents
+        getprop <name>      -> property value
+        pm install-create/install-write/install-commit/install-abandon
+                            -> install sessions, committed APKs are
+                               stored under data/app/<session>
+        bugreport           -> bugreport_size bytes of text
+        bugreportz -p       -> progress lines, then OK:<zip path>
+        rm -f <path>        -> removes the file
+        which <name>        -> /system/bin/<name> if the file exists there
+        find <path> [-type f] -exec stat -c <format> {} +
+                            -> %s %Y %a %f %n of every entry
+        screencap [-p]      -> RGBA frame of screen_size with a 16 byte
+                               header, or a PNG of it
+
+        Commands can be chained with "; " ($? is the status of the
+        previous one) and end with 2>&1.
+        """
+        if "; " in cmd:
+            stdout, stderr, status = b"", b"", 0
+            for part in cmd.split("; "):
+                out, err, status = self.shell(
+                        part.replace("$?", str(status)), stdin)
+                stdout += out
+                stderr += err
+            return stdout, stderr, status
+        if cmd.rstrip().endswith(" 2>&1"):
+            out, err, status = self.shell(cmd.rstrip()[:-len(" 2>&1")],
+                                          stdin)
+            return out + err, b"", status
+        name, _, arg = cmd.strip().partition(" ")
+        if name == "pm":
+            return self.pm(arg.split(), stdin)
+        if name == "echo":
+            return " ".join(shlex.split(arg)).encode('utf-8') + b"\n", b"", 0
+        if name == "payload":
+            size = int(arg)
+            return (LINE * (size // len(LINE) + 1))[:size], b"", 0
+        if name == "cat":
+            try:
+                with open(self.path(arg), "rb") as data:
+                    return data.read(), b"", 0
+            except (IOError, OSError):
+                return b"", ("cat: %s: No such file or directory\n"
+                             % arg).encode('utf-8'), 1
+        if name == "bugreport":
+            return (LINE * (self.bugreport_size // len(LINE) + 1))[
+                :self.bugreport_size], b"", 0
+        if cmd.strip() == "bugreportz -p":
+            return self.bugreportz(), b"", 0
+        if name == "rm":
+            path = self.path(arg.split()[-1].strip("'"))
+            if os.path.isfile(path):
+                os.remove(path)
+            return b"", b"", 0
+        if name == "getprop":
+            return (self.properties.get(arg, "") + "\n").encode('utf-8'), \
+                b"", 0
+        if name == "screencap":
+            return self.screencap("-p" in arg.split()), b"", 0
+        if name == "find":
+            top = shlex.split(arg)[0]
+            if not os.path.isdir(self.path(top)):
+                return b"", ("find: %s: No such file or directory\n"
+                             % top).encode('utf-8'), 1
+            return self.find(shlex.split(arg)), b"", 0
+        if name == "which":
+            if os.path.isfile(self.path("/system/bin/" + arg)):
+                return ("/system/bin/%s\n" % arg).encode('utf-8'), b"", 0
+            return b"", b"", 1
+        if name in ("true", ""):
+            return b"", b"", 0
+        return b"", ("sh: %s: not found\n" % name).encode('utf-8'), 127
+
+    def find(self, args):
+        top = args[0].rstrip("/") or "/"
+        files_only = args[1:3] == ["-type", "f"]
+        fields = args[args.index("-c") + 1].split()
+        lines = []
+        for directory, dirnames, filenames in os.walk(self.path(top)):
+            remote = top.rstrip("/") + directory[
+                    len(self.path(top).rstrip("/")):]
+            names = [(remote, os.lstat(directory))] if not files_only else []
+            for name in sorted(filenames):
+                names.append((remote + "/" + name,
+                              os.lstat(os.path.join(directory, name))))
+            for remote, st in names:
+                values = {"%s": str(st.st_size), "%Y": str(int(st.st_mtime)),
+                          "%a": "%o" % (st.st_mode & 0o7777),
+                          "%f": "%x" % st.st_mode, "%n": remote}
+                lines.append(" ".join(values[field] for field in fields))
+        return "".join(line + "\n" for line in lines).encode('utf-8')
+
+    def screencap(self, png):
+        width, height = self.screen_size
+        self.frames += 1
+        # every frame a different shade
+        pixels = bytes(bytearray([self.frames % 256, 0, 0, 255])) * (
+                width * height)
+        if not png:
+            return struct.pack("<IIII", width, height, 1, 0) + pixels
+
+        def chunk(kind, data):
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(
+                    ">I", zlib.crc32(kind + data) & 0xffffffff)
+        rows = b"".join(b"\0" + pixels[row * width * 4:(row + 1) * width * 4]
+                        for row in range(height))
+        return (b"\x89PNG\r\n\x1a\n" +
+                chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6,
+                                           0, 0, 0)) +
+                chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+    def pm(self, args, stdin):
+        sessions = self.path("/data/local/pm-sessions")
+        apps = self.path("/data/app")
+        if args[:1] == ["install-create"]:
+            if not os.path.isdir(sessions):
+                os.makedirs(sessions)
+            session = 1000 + len(os.listdir(sessions)) + (
+                    len(os.listdir(apps)) if os.path.isdir(apps) else 0)
+            while True:
+                try:
+                    os.mkdir(os.path.join(sessions, str(session)))
+                    break
+                except OSError:
+                    # taken by a concurrent install
+                    session += 1
+            return ("Success: created install session [%s]\n"
+                    % session).encode('ascii'), b"", 0
+        if args[:2] == ["install-write", "-S"] and len(args) >= 5:
+            size, session, name = int(args[2]), args[3], args[4].strip("'")
+            if len(stdin) != size:
+                return b"Failure [size mismatch]\n", b"", 1
+            with open(os.path.join(sessions, session, name), "wb") as apk:
+                apk.write(stdin)
+            return ("Success: streamed %d bytes\n" % size).encode('ascii'), \
+                b"", 0
+        if args[:1] in (["install-commit"], ["install-abandon"]):
+            path = os.path.join(sessions, args[1])
+            if not os.path.isdir(path):
+                return b"Failure [no such session]\n", b"", 1
+            if args[0] == "install-commit":
+                if not os.path.isdir(apps):
+                    os.makedirs(apps)
+                shutil.move(path, os.path.join(apps, args[1]))
+            else:
+                shutil.rmtree(path)
+            return b"Success\n", b"", 0
+        return b"", b"Error: unknown pm command\n", 1
+
+    def bugreportz(self):
+        remote = "/bugreports/bugreport-%s.zip" % self.serial
+        path = self.path(remote)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as report:
+            report.writestr("bugreport.txt",
+                            self.shell("bugreport")[0])
+        lines = ["BEGIN:%s" % remote]
+        lines += ["PROGRESS:%d/100" % done for done in (10, 50, 100)]
+        lines.append("OK:%s" % remote)
+        return ("\n".join(lines) + "\n").encode('utf-8')
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+pyadb benchmarks against a fake adb binary and a fake adb server, no
+phone needed.
+
+    $ python benchmarks/run.py
+    $ python benchmarks/run.py --latency 0.002 --payload 50000000 --json
+
+Measures calls per second of shell_command/get_state, get_devices
+latency, push/pull throughput and the memory peak of large outputs, for
+the adb binary backend and the socket backend.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+from pyadb import ADB, SocketBackend  # noqa: E402
+from pyadb.sync import SyncConnection  # noqa: E402
+
+
+FAKE_ADB = os.path.join(HERE, "fake_adb.py")
+FAKE_SERVER = os.path.join(HERE, "fake_server.py")
+SERIAL = "fake-0001"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def timed_calls(func, calls):
+    """
+    Calls func calls times, returns the list of durations in seconds
+    """
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def calls_summary(samples):
+    return {
+        "calls_per_second": len(samples) / sum(samples),
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        }
+
+
+def bench_calls(adb, calls):
+    return {
+        "shell_command": calls_summary(timed_calls(
+            lambda: adb.shell_command("echo benchmark"), calls)),
+        "get_state": calls_summary(timed_calls(adb.get_state, calls)),
+        "get_devices": calls_summary(timed_calls(adb.get_devices, calls)),
+        }
+
+
+def bench_transfer(adb, root, size, use_sync):
+    local = os.path.join(root, "local.bin")
+    with open(local, "wb") as data:
+        data.write(os.urandom(size))
+    pulled = os.path.join(root, "pulled.bin")
+
+    if use_sync:
+        with SyncConnection.for_device(adb) as sync:
+            started = time.perf_counter()
+            sync.push(local, "/remote.bin")
+            push_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            sync.pull("/remote.bin", pulled)
+            pull_seconds = time.perf_counter() - started
+    else:
+        started = time.perf_counter()
+        adb.push_local_file(local, "/remote.bin")
+        push_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        adb.get_remote_file("/remote.bin", pulled)
+        pull_seconds = time.perf_counter() - started
+
+    if os.path.getsize(pulled) != size:
+        raise RuntimeError("pulled file has the wrong size")
+    return {
+        "push_mb_per_second": size / push_seconds / 1e6,
+        "pull_mb_per_second": size / pull_seconds / 1e6,
+        }
+
+
+def memory_peak(func):
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - started
+        return {"peak_mb": tracemalloc.get_traced_memory()[1] / 1e6,
+                "seconds": seconds}
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(adb, payload):
+    cmd = "payload %d" % payload
+    return {
+        "run_cmd_c": memory_peak(lambda: adb.shell_command(cmd)),
+        "exec_out": memory_peak(lambda: adb.exec_out(cmd)),
+        "exec_out_to_file": memory_peak(
+            lambda: adb.exec_out(cmd, open(os.devnull, "wb"))),
+        }
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix="pyadb-bench-")
+    os.environ["PYADB_FAKE_ROOT"] = root
+    os.environ["PYADB_FAKE_LATENCY"] = str(args.latency)
+    # out of process, so it does not show up in the memory figures
+    server = subprocess.Popen(
+            [sys.executable, FAKE_SERVER, "--root", root,
+             "--latency", str(args.latency)],
+            stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+
+    ADB.set_adb_path(FAKE_ADB)
+    adb = ADB()
+    adb.get_devices()
+    adb.set_target_device(SERIAL)
+
+    backends = {
+        "binary": None,
+        "socket": SocketBackend(port=port),
+        }
+    results = {}
+    try:
+        for name in args.backend:
+            ADB.set_backend(backends[name])
+            results[name] = {
+                "calls": bench_calls(adb, args.calls),
+                "transfer": bench_transfer(adb, root, args.transfer,
+                                           name == "socket"),
+                "memory": bench_memory(adb, args.payload),
+                }
+    finally:
+        ADB.set_backend(None)
+        server.kill()
+        server.wait()
+        shutil.rmtree(root)
+    return results
+
+
+def print_results(results):
+    for backend, result in sorted(results.items()):
+        print("[%s]" % backend)
+        for name, stats in sorted(result["calls"].items()):
+            print("  %-16s %9.1f calls/s  p50 %7.2f ms  p99 %7.2f ms" % (
+                name, stats["calls_per_second"], stats["p50_ms"],
+                stats["p99_ms"]))
+        print("  push             %9.1f MB/s" %
+              result["transfer"]["push_mb_per_second"])
+        print("  pull             %9.1f MB/s" %
+              result["transfer"]["pull_mb_per_second"])
+        for name, stats in sorted(result["memory"].items()):
+            print("  %-16s %9.1f MB peak  %7.2f s" % (
+                name, stats["peak_mb"], stats["seconds"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        "\n")[0])
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added by the fakes to every request")
+    parser.add_argument("--calls", type=int, default=50,
+                        help="calls per command benchmark")
+    parser.add_argument("--payload", type=int, default=10 * 1000 * 1000,
+                        help="bytes of output for the memory benchmark")
+    parser.add_argument("--transfer", type=int, default=20 * 1000 * 1000,
+                        help="bytes of the pushed/pulled file")
+    parser.add_argument("--backend", action="append",
+                        choices=["binary", "socket"],
+                        help="backend to benchmark (default: both)")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args()
+    args.backend = args.backend or ["binary", "socket"]
+
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -50,11 +50,12 @@ import random
 import string
 from os import getcwd
 from os import mkdir
-from os.path import basename
 from sys import stdin, exit
 
 try:
     from pyadb import ADB
+    from pyadb.archive import pull_archive
+    from pyadb.tree import pull_tree
 except ImportError as e:
     print("[f] Required module missing. %s" % e.args[0])
     exit(-1)
@@ -80,25 +81,22 @@ def get_whatsapp_root(adb, supath):
         else:
             return False, e.args
 
-    tarname = '/sdcard/whatsapp_' + ''.join(
+    tarname = 'whatsapp_' + ''.join(
             random.choice(string.ascii_letters) for _ in range(10)) + '.tar'
-    print("\n[+] Creating remote tar file: %s" % tarname)
+    print("\n[+] Streaming remote tar of /data/data/com.whatsapp "
+          "through %s" % supath)
 
-    cmd = "%s -c 'tar -c /data/data/com.whatsapp -f %s'" % (supath, tarname)
-    print("\t- Command: %s" % cmd)
-    adb.shell_command(cmd)
-
-    print("\n[+] Retrieving remote file: %s" % tarname)
-    adb.get_remote_file(tarname, destination + '/' + basename(tarname))
-
-    print("[+] Removing remote file: %s" % tarname)
-    cmd = 'su -c \'rm %s\'' % tarname
-    adb.shell_command(cmd)
+    # no tar file is staged on the device
+    try:
+        transfer = pull_archive(adb, "/data/data/com.whatsapp",
+                                destination + tarname, su=supath)
+    except ADB.AdbException as err:
+        return False, err.args
+    print("\t- %s" % transfer.summary())
 
     print(
             "\n[+] Remote Whatsapp files from device memory are now "
-            "locally accessible at \"%s%s\"\n" % (
-                destination, basename(tarname)))
+            "locally accessible at \"%s%s\"\n" % (destination, tarname))
 
     get_whatsapp_nonroot(adb)
     return True, ""
@@ -109,7 +107,8 @@ def get_sdcard_iter(adb, rpath=None, lpath=None):
     When 'tar' binary is not available, this method get the whole content of
     the remote WhatsApp directory from the sdcard
 
-    This does NOT return an iter object, despite its name.
+    Only files changed since the last run are retrieved (see
+    pyadb.tree.pull_tree).
     """
 
     if lpath is None:
@@ -122,58 +121,18 @@ def get_sdcard_iter(adb, rpath=None, lpath=None):
     else:
         rdir = rpath
 
-    res = adb.shell_command("ls -1 \"%s\"" % rdir)
-    if res == "ls: %s: No such file or directory" % rdir:
-        return False, "WhatsApp directory does not exists!"
-
-    try:
-        res = res.split('\n')
-    except AttributeError:
-        return False, "Directory empty"
-
-    for item in res:
+    result = pull_tree(adb, rdir, lpath,
+                       progress=lambda path, transfer: print(
+                           "\t- Retrieved remote file: %s" % (rdir + path)))
+    if not result.transferred and not result.unchanged:
+        return False, "WhatsApp directory does not exists or is empty!"
 
-        if item is None:
-            continue
-        item = item.strip()
-        if item == "":
-            continue
-
-        ftype, _ = adb.shell_command("ls -ld \"%s\"" % (rdir + item))[:1]
-        # if it is a directory
-        if ftype == "d":
-            try:
-                mkdir(lpath + item)
-            except Exception:
-                # ToDo: Limit scope of this except-clause.
-                pass
-            get_sdcard_iter(adb, rdir + item + '/', lpath + item + '/')
-        else:  # item is a file
-            print("\t- Retrieving remote file: %s" % (rdir + item))
-            adb.get_remote_file(rdir + item, lpath + item)
+    for path, err in result.errors.items():
+        print("\t- Error retrieving %s: %s" % (rdir + path, err))
 
     return True, ""
 
 
-def create_sdcard_tar(adb, tarpath):
-    """
-    Returns the remote path of the tar file containing the whole WhatsApp
-    directory from the SDcard
-    """
-    tarname = '/sdcard/whatsapp_' + ''.join(
-            random.choice(string.ascii_letters) for _ in range(10)) + '.tar'
-    print("\n[+] Creating remote tar file: %s" % tarname)
-    cmd = "%s -c /sdcard/WhatsApp -f %s" % (tarpath, tarname)
-    print("\t+ Command: %s" % cmd)
-    output, error = adb.shell_command(cmd)
-    # Ignore error!
-    output, error = adb.shell_command("ls %s" % tarname)
-    if error.startswith("ls: %s: No such file or directory" % tarname):
-        return None
-    else:
-        return tarname
-
-
 def get_destination_path():
     """
     Creates and returns the path provided by the user
@@ -215,22 +174,21 @@ def get_whatsapp_nonroot(adb):
         tarpath = None
 
     if tarpath is not None:
-        wapath = create_sdcard_tar(adb, tarpath)
-
-        if wapath is not None:
-            print("\n[+] Remote tar file created: %s" % wapath)
-            destination = get_destination_path()
-            if destination is not None:
-                print("\n[+] Retrieving remote file: %s..." % wapath)
-                adb.get_remote_file(wapath, destination + basename(wapath))
-                adb.shell_command("rm %s" % wapath)
+        destination = get_destination_path()
+        if destination is not None:
+            tarname = 'whatsapp_' + ''.join(
+                    random.choice(string.ascii_letters)
+                    for _ in range(10)) + '.tar.gz'
+            print("\n[+] Streaming remote tar of /sdcard/WhatsApp...")
+            try:
+                pull_archive(adb, "/sdcard/WhatsApp", destination + tarname,
+                             compress=True)
                 print(
                         "\n[+] WhatsApp SDcard folder is now available "
-                        "in tar file: %s\n" % (
-                                destination + basename(wapath)))
+                        "in tar file: %s\n" % (destination + tarname))
                 return
-            else:
-                adb.shell_command("rm %s" % wapath)
+            except ADB.AdbException as err:
+                print("\t- Error: %s" % err)
 
     # get the remote WhatsApp folder from the SDcard (the iterative way)
     path = get_destination_path()
@@ -333,32 +291,30 @@ def main():
 
     print("\n[+] Using \"%s\" as target device" % devices[dev])
 
-    # check if 'su' binary is available
+    # check if 'su' binary is available and whether it gives root access,
+    # both probes in a single adb call
     print("[+] Looking for 'su' binary: ", end=' ')
 
     try:
-        supath = adb.find_binary("su")
+        which, rootid = adb.shell_batch(["which su", "su -c id"])
     except ADB.AdbException as err:
-        if str(err) != "'su' was not found":
-            print("Error: %s" % err)
-            exit(-6)
-        supath = None
+        print("Error: %s" % err)
+        exit(-6)
+
+    supath = which.lines()[0] if which.ok and which.lines() else None
 
     if supath is not None:
         # 'su' binary has been found
+        print(supath)
 
         print("[+] Checking if 'su' binary can give root access:")
-        try:
-            rootid = adb.shell_command('%s -c id' % supath)
-            if 'root' in rootid.replace('(', ')').split(')'):
-                # it can provide root privileges
-                print("\t- Yes")
-                get_whatsapp_root(adb, supath)
-            else:
-                print("\t- No: %s" % rootid)
-                get_whatsapp_nonroot(adb)
-        except adb.AdbException as err:
-            print("\t- No: %s" % err)
+        if rootid.ok and 'root' in rootid.stdout.replace(
+                '(', ')').split(')'):
+            # it can provide root privileges
+            print("\t- Yes")
+            get_whatsapp_root(adb, supath)
+        else:
+            print("\t- No: %s" % (rootid.stderr.strip() or rootid.stdout))
             get_whatsapp_nonroot(adb)
     else:
         print("Not found.")
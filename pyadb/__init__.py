@@ -1 +1,27 @@
+import sys
+
 from .adb import *
+from .transport import AdbServer, SocketBackend
+from .shell import (ShellProcess, ShellResult, ShellSession, open_shell,
+                    run_batch, run_shell)
+from .logcat import (LogcatStream, LogFilter, LogIndex, LogRecord,
+                     parse_binary, parse_threadtime)
+from .sync import SyncConnection, SyncEntry, SyncStat, TransferResult
+from .fanout import DeviceResult, FanOut
+from .tracker import DeviceTracker
+from .pool import DevicePool, Endpoint
+from .tree import (PullTreeResult, RemoteFile, RemoteTree, list_tree,
+                   pull_tree, remote_tree)
+from .archive import extract_archive, open_archive, pull_archive
+from .install import ApkSet, install_fleet, install_session
+from .bugreport import capture_bugreport, capture_many
+from .forward import Forward, ForwardManager, Relay
+from .screencap import Frame, ScreenCapture, screencap
+from .cache import ResultCache
+from .scheduler import BULK, INTERACTIVE, NORMAL, Scheduler
+from .metrics import (CommandRecord, HistogramSummary, Instrumentation,
+                      StatsdHook)
+
+if sys.version_info >= (3, 5):
+    # coroutines (async def) are a syntax error on python 2
+    from .aio import AsyncADB, AsyncAdbServer
@@ -4,10 +4,421 @@
 # Project Site: http://github.com/sch3m4/pyadb
 
 
+import copy
+import heapq
+import itertools
 import logging
 import os
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import types
+
+from .metrics import Instrumentation
+
+
+# size of the reads done when streaming command output
+COPY_CHUNK_SIZE = 256 * 1024
+
+
+class CommandStream(object):
+    """
+    Output of a running command, read as it is produced.
+
+    Wraps either the stdout pipe of an adb process or a socket opened by
+    a backend. Closing the stream terminates the command. A stream opened
+    inside a Deadline block is stopped at the deadline, reading it then
+    raises ADB.Timeout.
+    """
+
+    def __init__(self, stream, proc=None, conn=None, error=None,
+                 record=None, instrumentation=None):
+        self._stream = stream
+        self._proc = proc
+        self._conn = conn
+        self._error = error
+        self._record = record
+        self._instrumentation = instrumentation
+        self._release = None
+        self._deadline = None
+        self._unwatch = None
+        self.bytes_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def watch(self, deadline):
+        """
+        Stops the command when deadline passes or is cancelled
+        """
+        self._deadline = deadline
+        self._unwatch = deadline.on_expiry(self._stop)
+
+    def _stop(self):
+        # the reader sees the end of the output
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+        if self._conn is not None:
+            self._conn.close()
+
+    def _check_deadline(self):
+        if self._deadline is not None and self._deadline.fired:
+            raise self._deadline.exception(
+                    "Command output (%d bytes read)" % self.bytes_read)
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        if not data or size is None or size < 0:
+            # a read to EOF ends early when the command is stopped
+            try:
+                self._check_deadline()
+            except ADB.Timeout as err:
+                err.output = data
+                raise
+        return data
+
+    def readinto(self, buf):
+        count = self._stream.readinto(buf)
+        self.bytes_read += count or 0
+        if not count:
+            self._check_deadline()
+        return count
+
+    def readline(self, size=-1):
+        line = self._stream.readline(size)
+        self.bytes_read += len(line)
+        if not line:
+            self._check_deadline()
+        return line
+
+    def read1(self, size=-1):
+        if not hasattr(self._stream, "read1"):
+            return self.read(size)
+        data = self._stream.read1(size)
+        self.bytes_read += len(data)
+        if not data:
+            self._check_deadline()
+        return data
+
+    def write(self, data):
+        """
+        Writes data to the input of the command: the stdin of the adb
+        process, or the device service socket
+        """
+        try:
+            if self._conn is not None:
+                self._conn.send(data)
+            else:
+                self._proc.stdin.write(data)
+        except (IOError, OSError, ValueError) as err:
+            self._check_deadline()
+            raise ADB.InternalError("Cannot write to command: %s" % err)
+
+    def close_stdin(self):
+        """
+        Ends the input of an adb process. Device services opened over a
+        socket cannot be half closed, their input ends with the data the
+        command expects.
+        """
+        if self._proc is not None and self._proc.stdin:
+            try:
+                self._proc.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    def read_view(self, chunk_size=COPY_CHUNK_SIZE):
+        """
+        Reads until EOF and returns a memoryview on the output. Chunks are
+        read in place (no intermediate bytes objects) and joined once.
+        """
+        chunks = []
+        while True:
+            chunk = bytearray(chunk_size)
+            try:
+                count = self.readinto(chunk)
+            except ADB.Timeout as err:
+                err.output = memoryview(b"".join(chunks))
+                raise
+            if not count:
+                break
+            if count < chunk_size:
+                del chunk[count:]
+            chunks.append(chunk)
+        if len(chunks) == 1:
+            return memoryview(chunks[0])
+        return memoryview(b"".join(chunks))
+
+    def copy_to(self, output, chunk_size=COPY_CHUNK_SIZE, progress=None):
+        """
+        Writes everything read to a binary file object or a file
+        descriptor as it arrives, returns the number of bytes copied.
+        progress is called as progress(copied, None) after each chunk.
+        """
+        if isinstance(output, int):
+            write = lambda data: os.write(output, data)
+        else:
+            write = output.write
+
+        total = 0
+        while True:
+            chunk = self.read1(chunk_size)
+            if not chunk:
+                break
+            view = memoryview(chunk)
+            while view:
+                # raw files and descriptors may write partially
+                written = write(view)
+                if written is None:
+                    break
+                view = view[written:]
+            total += len(chunk)
+            if progress is not None:
+                progress(total, None)
+        return total
+
+    @property
+    def returncode(self):
+        if self._proc is None:
+            return None
+        return self._proc.poll()
+
+    def error(self):
+        """
+        Returns what the adb process wrote to stderr so far
+        """
+        if self._error is None or self._error.closed:
+            return ""
+        self._error.seek(0)
+        return self._error.read().decode('utf-8', 'replace')
+
+    def close(self):
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        try:
+            self._stream.close()
+        except (IOError, OSError):
+            pass
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.kill()
+            self._proc.wait()
+            if self._proc.stdin:
+                self._proc.stdin.close()
+        if self._conn is not None:
+            self._conn.close()
+        if self._record is not None:
+            self._record.bytes_in = self.bytes_read
+            if self._proc is not None:
+                self._record.exit_status = self._proc.returncode
+            self._instrumentation.finish(self._record)
+            self._record = None
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+
+class _Watchdog(object):
+    """
+    Single background thread firing the deadlines that pass
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._order = itertools.count()
+        self._thread = None
+
+    def watch(self, deadline):
+        with self._cond:
+            heapq.heappush(self._heap, (deadline.expires, next(self._order),
+                                        deadline))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="pyadb-watchdog")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                expires, _, deadline = self._heap[0]
+                delay = expires - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            deadline._fire()
+
+
+class Deadline(object):
+    """
+    Time limit and cancellation token for the commands run by a thread.
+
+    with Deadline(30) as deadline:
+        adb.wait_for_device()
+        adb.shell_command("logcat -d")
+
+    Every command started inside the block (adb processes, adb server
+    sockets, streams) is killed when the deadline passes, or when
+    deadline.cancel() is called from any thread, and the call raises
+    ADB.Timeout (ADB.Cancelled) carrying the output read so far.
+    Deadlines nest, the inner block is bound by the outer one too.
+    timeout None makes a deadline that only ends by cancel().
+    """
+
+    _local = threading.local()
+    _watchdog = _Watchdog()
+
+    def __init__(self, timeout=None):
+        self.expires = time.time() + timeout if timeout is not None \
+            else None
+        self.cancelled = False
+        self._fired = False
+        self._parent = None
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._keys = itertools.count()
+        self._watched = False
+
+    def __repr__(self):
+        return "Deadline(remaining=%r, cancelled=%r)" % (self.remaining(),
+                                                         self.cancelled)
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the innermost deadline of the calling thread, None if
+        there is none
+        """
+        return getattr(cls._local, "deadline", None)
+
+    def __enter__(self):
+        self._parent = Deadline.current()
+        Deadline._local.deadline = self
+        return self
+
+    def __exit__(self, *exc_info):
+        Deadline._local.deadline = self._parent
+
+    def remaining(self):
+        """
+        Returns the seconds left (0 once passed), None without time limit
+        """
+        remaining = None
+        if self.expires is not None:
+            remaining = max(0.0, self.expires - time.time())
+        if self._parent is not None:
+            other = self._parent.remaining()
+            if other is not None and (remaining is None or other < remaining):
+                remaining = other
+        return remaining
+
+    @property
+    def is_cancelled(self):
+        return self.cancelled or (self._parent is not None and
+                                  self._parent.is_cancelled)
+
+    @property
+    def expired(self):
+        """
+        True once the deadline passed or was cancelled
+        """
+        return self.is_cancelled or self.remaining() == 0.0
+
+    @property
+    def fired(self):
+        """
+        True once the commands of the deadline were killed
+        """
+        return self._fired or (self._parent is not None and
+                               self._parent.fired)
+
+    def exception(self, what, output=None, error=None):
+        """
+        Returns the ADB.Timeout or ADB.Cancelled to raise for what
+        """
+        if self.is_cancelled:
+            return ADB.Cancelled("%s cancelled" % what, output, error)
+        return ADB.Timeout("%s timed out" % what, output, error)
+
+    def check(self, what):
+        """
+        Raises ADB.Timeout or ADB.Cancelled if the deadline is over
+        """
+        if self.expired:
+            raise self.exception(what)
+
+    def cancel(self):
+        """
+        Cancels the commands running in the block, and the ones to come
+        """
+        self.cancelled = True
+        self._fire()
+
+    def _fire(self):
+        with self._lock:
+            self._fired = True
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                ADB.LOGGER.exception("Cannot stop command at deadline")
+
+    def on_expiry(self, callback):
+        """
+        Calls callback() once when the deadline (or an outer one) passes
+        or is cancelled, right away if it already did. Returns a function
+        unregistering it, to call when the command ended.
+        """
+        if self.fired:
+            callback()
+            return lambda: None
+        with self._lock:
+            key = next(self._keys)
+            self._callbacks[key] = callback
+            if self.expires is not None and not self._watched:
+                self._watched = True
+                Deadline._watchdog.watch(self)
+        parent = None
+        if self._parent is not None:
+            parent = self._parent.on_expiry(callback)
+
+        def unregister():
+            with self._lock:
+                self._callbacks.pop(key, None)
+            if parent is not None:
+                parent()
+        return unregister
+
+
+class hybridmethod(object):
+    """
+    classmethod that binds to the instance when called on one, so class
+    attributes act as defaults that instances can override
+    """
+
+    def __init__(self, func):
+        self.__func__ = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, objtype=None):
+        return types.MethodType(self.__func__,
+                                objtype if obj is None else obj)
 
 
 class ADB:
@@ -15,8 +426,26 @@ class ADB:
 
     LOGGER = logging.getLogger("pyadb")
 
+    # hooks receiving a pyadb.metrics.CommandRecord per command
+    instrumentation = Instrumentation()
+
+    # The settings below are class wide defaults. Methods are hybrid:
+    # called on the class (ADB.set_backend(...)) they change the default,
+    # called on an instance they only change that instance, so one
+    # process can drive several adb binaries and servers at once.
     _adb_path = None
     _devices = None
+    # optional object running commands instead of the adb binary
+    # (see pyadb.transport.SocketBackend)
+    _backend = None
+    # optional pyadb.tracker.DeviceTracker answering get_devices()
+    _tracker = None
+    # optional pyadb.cache.ResultCache of idempotent command results
+    _cache = None
+    # optional pyadb.scheduler.Scheduler limiting concurrent commands
+    _scheduler = None
+    # seconds after which commands run outside any Deadline are stopped
+    _timeout = None
 
     # reboot modes
     REBOOT_RECOVERY = 1
@@ -41,18 +470,45 @@ class ADB:
         """" Unexpected internal error in pyadb. """
         pass
 
+    class ServerError(InternalError):
+        """ The adb server answered FAIL to a request. """
+        pass
+
+    class Timeout(AdbException):
+        """ Operation did not complete in time. """
+
+        def __init__(self, message, output=None, error=None):
+            Exception.__init__(self, message)
+            # what the command wrote before it was stopped
+            self.output = output
+            self.error = error
+
+    class Cancelled(Timeout):
+        """ Operation cancelled through its Deadline. """
+        pass
+
     def pyadb_version(self):
         return self.PYADB_VERSION
 
-    def __init__(self, adb_path=None):
+    def __init__(self, adb_path=None, backend=None):
         if adb_path:
-            if self._adb_path and self._adb_path != adb_path:
-                raise self.BadCall(
-                        "Only one adp path can be set for all instances. "
-                        "Use set_adp_path to change for all instance.")
-            ADB._adb_path = adb_path
+            self._adb_path = adb_path
+            if ADB._adb_path is None:
+                # the first path given also becomes the default
+                ADB._adb_path = adb_path
+        if backend is not None:
+            self._backend = backend
         self._target = None
 
+    def for_device(self, serial):
+        """
+        Returns a new ADB object with the settings of this one (adb path,
+        backend, tracker, cache, instrumentation) targeting serial
+        """
+        adb = copy.copy(self)
+        adb._target = serial
+        return adb
+
     def _parse_output(self, outstr):
         ret = None
 
@@ -73,7 +529,9 @@ class ADB:
         "kill-server",
         "start-server",
         "version",
-        "help"
+        "help",
+        "connect",
+        "disconnect"
         )
 
     @classmethod
@@ -83,7 +541,7 @@ class ADB:
                 in cls.COMMANDS_WITHOUT_TARGETS):
             raise cls.BadCall("Must set target device first")
 
-    @classmethod
+    @hybridmethod
     def _build_command_c(cls, cmd, target=None):
         # The _c version can be called from a classmethod.
         cls._check_target(cmd, target)
@@ -101,7 +559,7 @@ class ADB:
         target_param_part = ["-s", target] if target else []
         cmd_part = [cmd] if not isinstance(cmd, list) else cmd
 
-        full_cmd = [ADB._adb_path] + target_param_part + cmd_part
+        full_cmd = [cls._adb_path] + target_param_part + cmd_part
 
         if sys.platform.startswith('win'):
             return " ".join(full_cmd)
@@ -112,10 +570,95 @@ class ADB:
         self._build_command_c(cmd, target=self._target)
 
     @classmethod
+    def _split_output(cls, output):
+        """
+        Decodes raw command output into a list of non-empty stripped lines
+        """
+        output = output.decode('utf-8')
+        if len(output) == 0:
+            return None
+        return [x.strip() for x in output.split('\n')
+                if len(x.strip()) > 0]
+
+    @hybridmethod
     def run_cmd_c(cls, cmd, target=None):
         """
         Runs a command by using adb tool ($ adb <cmd>)
-        """
+
+        Inside a Deadline block, or with a default timeout set, the
+        command is killed when time runs out and ADB.Timeout is raised
+        with the output read so far.
+        """
+        deadline = Deadline.current()
+        if deadline is None and cls._timeout is not None:
+            with Deadline(cls._timeout):
+                return cls.run_cmd_c(cmd, target)
+        if deadline is not None:
+            deadline.check(cls._describe(cmd))
+
+        cache = cls._cache
+        if cache is not None:
+            server = cls._server_id()
+            cache.notify(cmd, target, server)
+            if cache.ttl(cmd) is not None:
+                result = cache.get(cmd, target, server)
+                if result is not None:
+                    return result
+
+        scheduler = cls._scheduler
+        ticket = scheduler.acquire(cmd, target) if scheduler else None
+        try:
+            record = cls.instrumentation.start(cmd, target)
+            try:
+                result = cls._run_cmd_c(cmd, target, record)
+                if deadline is not None and deadline.fired:
+                    raise deadline.exception(cls._describe(cmd), *result)
+            except ADB.Timeout as err:
+                cls.instrumentation.finish(record, err)
+                if deadline is None or not deadline.fired:
+                    raise
+                output = err.output
+                if isinstance(output, bytes):
+                    # read from the adb server socket
+                    output = cls._split_output(output)
+                raise deadline.exception(cls._describe(cmd), output,
+                                         err.error)
+            except Exception as err:
+                cls.instrumentation.finish(record, err)
+                if deadline is not None and deadline.fired:
+                    # the socket or process was closed under the command
+                    raise deadline.exception(cls._describe(cmd))
+                raise
+            cls.instrumentation.finish(record)
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket)
+
+        if cache is not None:
+            cache.put(cmd, target, result, server)
+        return result
+
+    @hybridmethod
+    def _run_cmd_c(cls, cmd, target, record):
+        backend = cls._backend
+        if backend is not None:
+            cls._check_target(cmd, target)
+            cls.LOGGER.info("Executing command on %r: %s", backend, cmd)
+            if record is not None and hasattr(backend,
+                                              "pop_connect_time"):
+                backend.pop_connect_time()
+            result = backend.run(cmd, target)
+            if result is not None:
+                output, error = result
+                if record is not None:
+                    record.backend = type(backend).__name__
+                    record.bytes_in = len(output) + len(error)
+                    record.bytes_out = len(" ".join(
+                        str(arg) for arg in record.command))
+                    if hasattr(backend, "pop_connect_time"):
+                        record.spawn_time = backend.pop_connect_time()
+                return cls._split_output(output), error
+
         if cls._adb_path is None:
             raise cls.BadCall("ADB path not set")
 
@@ -125,23 +668,33 @@ class ADB:
         cls.LOGGER.info("Executing command: %s", cmd_list)
 
         try:
+            started = time.time()
             adb_proc = subprocess.Popen(
                     cmd_list,
                     stdin=subprocess.PIPE,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
                     shell=False)
-            (output, error) = adb_proc.communicate()
-            # return_code = adb_proc.returncode
-            output = output.decode('utf-8')
+            spawn_time = time.time() - started
+            deadline = Deadline.current()
+            unwatch = None
+            if deadline is not None:
+                unwatch = deadline.on_expiry(adb_proc.kill)
+            try:
+                (output, error) = adb_proc.communicate()
+            finally:
+                if unwatch is not None:
+                    unwatch()
+            if record is not None:
+                record.backend = "adb"
+                record.spawn_time = spawn_time
+                record.bytes_in = len(output) + len(error)
+                record.bytes_out = len(" ".join(
+                    str(arg) for arg in record.command))
+                record.exit_status = adb_proc.returncode
+            output = cls._split_output(output)
             error = error.decode('utf-8')
 
-            if len(output) == 0:
-                output = None
-            else:
-                output = [x.strip() for x in output.split('\n')
-                          if len(x.strip()) > 0]
-
         except Exception as err:
             cls.LOGGER.exception("Unexpected exception")
             raise cls.InternalError(str(err))
@@ -151,7 +704,104 @@ class ADB:
     def run_cmd(self, cmd):
         return self.run_cmd_c(cmd, self._target)
 
-    @classmethod
+    @hybridmethod
+    def _server_id(cls):
+        """
+        Tells apart the adb servers commands go to: the backend, or the
+        adb binary (talking to its default server)
+        """
+        if cls._backend is not None:
+            return repr(cls._backend)
+        return cls._adb_path
+
+    @staticmethod
+    def _describe(cmd):
+        if isinstance(cmd, list):
+            cmd = " ".join(str(arg) for arg in cmd)
+        return "adb %s" % cmd
+
+    @hybridmethod
+    def open_cmd_c(cls, cmd, target=None):
+        """
+        Starts a command and returns a CommandStream reading its output as
+        it is produced, instead of waiting for the command to finish
+
+        Only a Deadline block (not the default timeout) stops streams.
+        """
+        deadline = Deadline.current()
+        if deadline is not None:
+            deadline.check(cls._describe(cmd))
+        scheduler = cls._scheduler
+        ticket = scheduler.acquire(cmd, target) if scheduler else None
+        record = cls.instrumentation.start(cmd, target)
+        try:
+            stream = cls._open_cmd_c(cmd, target, record)
+        except Exception as err:
+            cls.instrumentation.finish(record, err)
+            if ticket is not None:
+                scheduler.release(ticket)
+            raise
+        # the record is finished, and the slot released, when the stream
+        # is closed
+        stream._record = record
+        stream._instrumentation = cls.instrumentation
+        if ticket is not None:
+            stream._release = lambda: scheduler.release(ticket)
+        if deadline is not None:
+            stream.watch(deadline)
+        return stream
+
+    @hybridmethod
+    def _open_cmd_c(cls, cmd, target, record):
+        backend = cls._backend
+        if backend is not None and hasattr(backend, "open"):
+            cls._check_target(cmd, target)
+            cls.LOGGER.info("Streaming command on %r: %s", backend, cmd)
+            if record is not None and hasattr(backend,
+                                              "pop_connect_time"):
+                backend.pop_connect_time()
+            stream = backend.open(cmd, target)
+            if stream is not None:
+                if record is not None:
+                    record.backend = type(backend).__name__
+                    record.bytes_out = len(" ".join(
+                        str(arg) for arg in record.command))
+                    if hasattr(backend, "pop_connect_time"):
+                        record.spawn_time = backend.pop_connect_time()
+                return stream
+
+        if cls._adb_path is None:
+            raise cls.BadCall("ADB path not set")
+
+        cmd_list = cls._build_command_c(cmd, target)
+
+        cls.LOGGER.info("Streaming command: %s", cmd_list)
+
+        try:
+            # stderr goes to a file so it can never fill up a pipe
+            error = tempfile.TemporaryFile()
+            started = time.time()
+            adb_proc = subprocess.Popen(
+                    cmd_list,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=error,
+                    shell=False)
+        except Exception as err:
+            cls.LOGGER.exception("Unexpected exception")
+            raise cls.InternalError(str(err))
+        if record is not None:
+            record.backend = "adb"
+            record.spawn_time = time.time() - started
+            record.bytes_out = len(" ".join(
+                str(arg) for arg in record.command))
+
+        return CommandStream(adb_proc.stdout, proc=adb_proc, error=error)
+
+    def open_cmd(self, cmd):
+        return self.open_cmd_c(cmd, self._target)
+
+    @hybridmethod
     def get_version(cls):
         """
         Returns ADB tool version
@@ -161,7 +811,7 @@ class ADB:
         if output is None or len(output) < 1:
             cls.LOGGER.warning(
                     "No version found. Check adb is on path %s.",
-                    ADB._adb_path)
+                    cls._adb_path)
             return None
 
         try:
@@ -172,30 +822,110 @@ class ADB:
                     "Unexpected output %s caused %s", output, err)
             raise cls.InternalError(output)
 
-    @classmethod
+    @hybridmethod
     def check_path(cls):
         """
         Intuitive way to verify the ADB path
         """
         return bool(cls.get_version())
 
-    @classmethod
+    @hybridmethod
     def set_adb_path(cls, adb_path):
         """
-        Sets ADB tool absolute path
+        Sets ADB tool absolute path, the default of every instance when
+        called on the class
         """
         if not os.path.isfile(adb_path):
             raise cls.BadCall("File not found.")
         cls._adb_path = adb_path
 
-    @classmethod
+    @hybridmethod
     def get_adb_path(cls):
         """
         Returns ADB tool path
         """
         return cls._adb_path
 
-    @classmethod
+    @hybridmethod
+    def set_backend(cls, backend):
+        """
+        Sets the object used to run commands, None means the adb binary.
+        Commands the backend cannot handle still go through the adb binary.
+
+        ADB.set_backend(SocketBackend())          # default of all instances
+        adb.set_backend(SocketBackend(port=5038))  # this instance only
+        """
+        cls._backend = backend
+
+    @hybridmethod
+    def get_backend(cls):
+        """
+        Returns the backend in use (None for the adb binary)
+        """
+        return cls._backend
+
+    @hybridmethod
+    def set_device_tracker(cls, tracker):
+        """
+        Makes get_devices() and set_target_device() use a running
+        pyadb.tracker.DeviceTracker instead of calling adb devices.
+        None goes back to calling adb.
+        """
+        cls._tracker = tracker
+
+    @hybridmethod
+    def get_device_tracker(cls):
+        return cls._tracker
+
+    @hybridmethod
+    def set_result_cache(cls, cache):
+        """
+        Sets the pyadb.cache.ResultCache answering idempotent commands
+        (version, get-serialno, getprop, which...), None disables caching
+
+        ADB.set_result_cache(ResultCache())
+        """
+        cls._cache = cache
+
+    @hybridmethod
+    def get_result_cache(cls):
+        """
+        Returns the result cache, None if results are not cached
+        """
+        return cls._cache
+
+    @hybridmethod
+    def set_timeout(cls, timeout):
+        """
+        Sets the seconds after which a command run outside any Deadline
+        block is killed (raising ADB.Timeout), None waits for ever
+
+        Streams (open_cmd_c) are only bound by Deadline blocks.
+        """
+        cls._timeout = timeout
+
+    @hybridmethod
+    def get_timeout(cls):
+        return cls._timeout
+
+    @hybridmethod
+    def set_scheduler(cls, scheduler):
+        """
+        Sets the pyadb.scheduler.Scheduler every command waits on for a
+        slot, None runs commands as they come
+
+        ADB.set_scheduler(Scheduler(max_per_device=2))
+        """
+        cls._scheduler = scheduler
+
+    @hybridmethod
+    def get_scheduler(cls):
+        """
+        Returns the command scheduler, None if commands are not scheduled
+        """
+        return cls._scheduler
+
+    @hybridmethod
     def start_server(cls):
         """
         Starts ADB server
@@ -204,7 +934,7 @@ class ADB:
         """
         return cls.run_cmd_c('start-server')[0]
 
-    @classmethod
+    @hybridmethod
     def kill_server(cls):
         """
         Kills ADB server
@@ -214,7 +944,7 @@ class ADB:
         """
         return cls._output_if_no_error(cls.run_cmd_c('kill-server'))
 
-    @classmethod
+    @hybridmethod
     def restart_server(cls):
         """
         Restarts ADB server
@@ -236,7 +966,7 @@ class ADB:
         """
         return self._output_if_no_error(self.run_cmd('wait-for-device'))
 
-    @classmethod
+    @hybridmethod
     def get_help(cls):
         """
         Returns ADB help
@@ -244,24 +974,33 @@ class ADB:
         """
         return cls._output_if_no_error(cls.run_cmd_c('help'))
 
-    @classmethod
+    @hybridmethod
     def get_devices(cls):
         """
         Returns a list of connected devices
         adb devices
         mode serial/usb
+
+        Read from the device tracker when one is set (no adb call).
         """
-        cls._devices = None
+        tracker = cls._tracker
+        if tracker is not None and tracker.is_running:
+            devices = cls._devices = tracker.serials()
+            return devices
+
         output = cls._output_if_no_error(cls.run_cmd_c("devices"))
         try:
-            cls._devices = [x.split()[0] for x in output[1:]]
+            devices = [x.split()[0] for x in output[1:]]
 
         except Exception as err:
             # ToDo: Limit this except-clause to the specific exception.
             cls.LOGGER.exception(
                     "Exception being translated to PermissionsError")
+            cls._devices = None
             raise cls.PermissionsError(str(err))
-        return cls._devices
+        # replaced at once, other threads see either list
+        cls._devices = devices
+        return devices
 
     def set_target_device(self, device):
         """
@@ -269,9 +1008,16 @@ class ADB:
         """
         if device is None:
             raise self.BadCall('Must provide device')
-        if not self._devices:
+        tracker = self._tracker
+        if tracker is not None and tracker.is_running:
+            if tracker.state(device) is None:
+                raise self.BadCall('Unknown device')
+            self._target = device
+            return
+        devices = self._devices
+        if not devices:
             raise self.BadCall('Must call get_devices() first.')
-        if device not in self._devices:
+        if device not in devices:
             raise self.BadCall('Unknown device')
 
         self._target = device
@@ -344,6 +1090,21 @@ class ADB:
         """
         return self._output_if_no_error(self.run_cmd(['push', local, remote]))
 
+    def exec_out(self, cmd, output=None):
+        """
+        Executes a shell command without PTY and returns its raw output
+        adb exec-out <cmd>
+
+        Binary safe: the output is neither decoded nor split. Without output
+        a memoryview on the bytes is returned, otherwise they are written to
+        output (binary file object or file descriptor) as they arrive and
+        the number of bytes is returned.
+        """
+        with self.open_cmd(['exec-out', cmd]) as stream:
+            if output is None:
+                return stream.read_view()
+            return stream.copy_to(output)
+
     def shell_command(self, cmd):
         """
         Executes a shell command
@@ -353,6 +1114,36 @@ class ADB:
         """
         return self.run_cmd(['shell', cmd])
 
+    def run_shell(self, cmd, stdin=None):
+        """
+        Executes a shell command, feeding it stdin (bytes) if given
+
+        Returns a pyadb.shell.ShellResult with its stdout, stderr and exit
+        code, from a single adb call.
+        """
+        from .shell import run_shell
+        return run_shell(self, cmd, stdin)
+
+    def open_shell(self, cmd, stdin=True):
+        """
+        Starts a shell command and returns a pyadb.shell.ShellProcess
+        yielding its stdout and stderr as they arrive. Set stdin to False
+        if nothing will be written to it.
+        """
+        from .shell import open_shell
+        return open_shell(self, cmd, stdin)
+
+    def shell_batch(self, cmds):
+        """
+        Executes several shell commands in a single adb call (a few for
+        large batches, see pyadb.shell.run_batch)
+
+        Returns a list of pyadb.shell.ShellResult with the stdout, stderr
+        and exit code of each command.
+        """
+        from .shell import run_batch
+        return run_batch(self, cmds)
+
     def listen_usb(self):
         """
         Restarts the adbd daemon listening on USB
@@ -371,6 +1162,9 @@ class ADB:
         """
         Return all information from the device that should be included in a
         bug report adb bugreport
+
+        The whole report is kept in memory, use pyadb.bugreport to write it
+        to disk as it is produced.
         """
         return self._output_if_no_error(self.run_cmd("bugreport"))
 
@@ -385,6 +1179,9 @@ class ADB:
         """
         View device log
         adb logcat <filter>
+
+        Waits for logcat to exit, use pyadb.logcat.LogcatStream to follow a
+        live log.
         """
         return self._output_if_no_error(self.run_cmd(['logcat', lcfilter]))
 
@@ -435,6 +1232,9 @@ class ADB:
         """
         Forward socket connections
         adb forward <local> <remote>
+
+        See pyadb.forward to list, reuse and remove forwards, reverse
+        forwards and connecting to device sockets without a forward.
         """
         if local is None or remote is None:
             return None
@@ -449,12 +1249,11 @@ class ADB:
         if package is None:
             return None
 
-        cmd = 'uninstall '
+        cmd = ['uninstall']
         if keepdata:
-            cmd += '-k '
-        cmd += package
-        return self._output_if_no_error(
-                self.run_cmd(cmd.split()))
+            cmd.append('-k')
+        cmd.append(package)
+        return self._output_if_no_error(self.run_cmd(cmd))
 
     def install(self, fwdlock=False, reinstall=False, sdcard=False,
                 pkgapp=None):
@@ -464,21 +1263,24 @@ class ADB:
         -l -> forward-lock the app
         -r -> reinstall the app, keeping its data
         -s -> install on sdcard instead of internal storage
+
+        See pyadb.install for split APKs and installing on many devices.
         """
 
         if pkgapp is None:
             return None
 
-        cmd = "install "
+        cmd = ['install']
         if fwdlock:
-            cmd += "-l "
+            cmd.append('-l')
         if reinstall:
-            cmd += "-r "
+            cmd.append('-r')
         if sdcard:
-            cmd += "-s "
+            cmd.append('-s')
 
-        cmd += pkgapp
-        return self._output_if_no_error(self.run_cmd(cmd.split()))
+        # a single argument, the path may contain spaces
+        cmd.append(pkgapp)
+        return self._output_if_no_error(self.run_cmd(cmd))
 
     def find_binary(self, name=None):
         """
@@ -487,10 +1289,11 @@ class ADB:
 
         output, error = self.run_cmd(['shell', 'which', name])
 
-        if output is None:  # not found
-            raise self.BadCall("'%s' was not found" % name)
-        elif output[0] == "which: not found":
+        if "which: not found" in (error or "") or (
+                output and output[0].endswith("which: not found")):
             # 'which' binary not available
             raise self.InternalError("which binary not found")
+        elif output is None:  # not found
+            raise self.BadCall("'%s' was not found" % name)
 
         return output
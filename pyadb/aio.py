@@ -0,0 +1,636 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+asyncio counterpart of the ADB class.
+
+AsyncADB exposes the same methods as ADB as coroutines. Commands run
+through asyncio subprocesses, or through asyncio streams to the adb
+server for the commands the socket protocol covers, so a single event
+loop can keep thousands of device operations in flight without a thread
+per call.
+"""
+
+import asyncio
+
+from .adb import ADB
+from .transport import LOGCAT_SERVICE, SocketBackend, encode_request
+
+
+class AsyncAdbServer(object):
+    """
+    asyncio client for the adb server host protocol
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def __repr__(self):
+        return "AsyncAdbServer(%r, %r)" % (self.host, self.port)
+
+    async def connect(self):
+        try:
+            return await asyncio.open_connection(self.host, self.port)
+        except OSError as err:
+            raise ADB.InternalError(
+                    "Cannot connect to adb server at %s:%s: %s"
+                    % (self.host, self.port, err))
+
+    @staticmethod
+    async def _read_length_prefixed(reader):
+        length = await reader.readexactly(4)
+        return await reader.readexactly(int(length, 16))
+
+    async def _send_request(self, reader, writer, service):
+        writer.write(encode_request(service))
+        await writer.drain()
+        await self._read_status(reader)
+
+    async def _read_status(self, reader):
+        status = await reader.readexactly(4)
+        if status == b"FAIL":
+            message = await self._read_length_prefixed(reader)
+            raise ADB.ServerError(message.decode('utf-8', 'replace'))
+        if status != b"OKAY":
+            raise ADB.InternalError(
+                    "Unexpected status from adb server: %r" % status)
+
+    async def host_request(self, service):
+        """
+        Sends a host request and returns its length-prefixed reply
+        """
+        reader, writer = await self.connect()
+        try:
+            await self._send_request(reader, writer, service)
+            reply = await self._read_length_prefixed(reader)
+            return reply.decode('utf-8', 'replace')
+        except asyncio.IncompleteReadError:
+            raise ADB.InternalError("Connection closed by adb server")
+        finally:
+            writer.close()
+
+    async def host_command(self, service, statuses=1):
+        """
+        Sends a host request whose reply is made of OKAY/FAIL statuses only
+        """
+        reader, writer = await self.connect()
+        try:
+            await self._send_request(reader, writer, service)
+            for _ in range(statuses - 1):
+                await self._read_status(reader)
+        except asyncio.IncompleteReadError:
+            raise ADB.InternalError("Connection closed by adb server")
+        finally:
+            writer.close()
+
+    async def open_service(self, serial, service):
+        """
+        Opens a device service and returns its (reader, writer)
+        """
+        reader, writer = await self.connect()
+        try:
+            if serial is None:
+                await self._send_request(reader, writer, "host:transport-any")
+            else:
+                await self._send_request(reader, writer,
+                                         "host:transport:%s" % serial)
+            await self._send_request(reader, writer, service)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            raise ADB.InternalError("Connection closed by adb server")
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def device_output(self, serial, service):
+        """
+        Opens a device service and returns everything it writes
+        """
+        reader, writer = await self.open_service(serial, service)
+        try:
+            return await reader.read()
+        finally:
+            writer.close()
+
+
+class AsyncADB(object):
+    """
+    ADB with coroutine methods.
+
+    adb = AsyncADB("/usr/bin/adb")
+    devices = await adb.get_devices()
+    adb.set_target_device(devices[0])
+    output, error = await adb.shell_command("ls /sdcard")
+
+    When server is given (an AdbServer, or taken from the SocketBackend set
+    on ADB) the commands supported by the socket protocol skip the adb
+    binary.
+
+    With a timeout (seconds, default ADB.get_timeout()) commands taking
+    longer are killed and raise ADB.Timeout. Cancelling the task running
+    a command kills it too.
+    """
+
+    REBOOT_RECOVERY = ADB.REBOOT_RECOVERY
+    REBOOT_BOOTLOADER = ADB.REBOOT_BOOTLOADER
+    DEFAULT_TCP_PORT = ADB.DEFAULT_TCP_PORT
+    DEFAULT_TCP_HOST = ADB.DEFAULT_TCP_HOST
+
+    AdbException = ADB.AdbException
+    BadCall = ADB.BadCall
+    PermissionsError = ADB.PermissionsError
+    InternalError = ADB.InternalError
+    Timeout = ADB.Timeout
+    Cancelled = ADB.Cancelled
+
+    def __init__(self, adb_path=None, server=None, timeout=None):
+        self._adb_path = adb_path or ADB.get_adb_path()
+        self._timeout = timeout if timeout is not None else \
+            ADB.get_timeout()
+        if server is None and isinstance(ADB.get_backend(), SocketBackend):
+            server = ADB.get_backend().server
+        self._server = None
+        if server is not None:
+            self._server = AsyncAdbServer(server.host, server.port)
+        self._target = None
+        self._devices = None
+        self._socket_handlers = {
+            "version": self._socket_version,
+            "devices": self._socket_devices,
+            "get-state": self._socket_get_state,
+            "get-serialno": self._socket_get_serialno,
+            "wait-for-device": self._socket_wait_for_device,
+            "shell": self._socket_shell,
+            "logcat": self._socket_logcat,
+            }
+
+    def pyadb_version(self):
+        return ADB.PYADB_VERSION
+
+    def set_adb_path(self, adb_path):
+        self._adb_path = adb_path
+
+    def get_adb_path(self):
+        return self._adb_path
+
+    def set_timeout(self, timeout):
+        self._timeout = timeout
+
+    def get_timeout(self):
+        return self._timeout
+
+    def _build_command(self, cmd):
+        ADB._check_target(cmd, self._target)
+        target_param_part = ["-s", self._target] if self._target else []
+        cmd_part = [cmd] if not isinstance(cmd, list) else cmd
+        return [self._adb_path] + target_param_part + [
+                str(arg) for arg in cmd_part]
+
+    async def run_cmd(self, cmd):
+        """
+        Runs a command, returns (output, error) like ADB.run_cmd
+        """
+        if self._server is not None:
+            try:
+                # the connection is closed when the coroutine is cancelled
+                result = await asyncio.wait_for(self._run_socket(cmd),
+                                                self._timeout)
+            except asyncio.TimeoutError:
+                raise self.Timeout("%s timed out" % ADB._describe(cmd))
+            if result is not None:
+                return result
+
+        if self._adb_path is None:
+            raise self.BadCall("ADB path not set")
+
+        cmd_list = self._build_command(cmd)
+
+        ADB.LOGGER.info("Executing command: %s", cmd_list)
+
+        try:
+            adb_proc = await asyncio.create_subprocess_exec(
+                    *cmd_list,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+        except Exception as err:
+            ADB.LOGGER.exception("Unexpected exception")
+            raise self.InternalError(str(err))
+
+        try:
+            output, error = await asyncio.wait_for(adb_proc.communicate(),
+                                                   self._timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            try:
+                adb_proc.kill()
+            except ProcessLookupError:
+                pass
+            await adb_proc.wait()
+            if isinstance(err, asyncio.CancelledError):
+                raise
+            raise self.Timeout("%s timed out" % ADB._describe(cmd))
+        except Exception as err:
+            ADB.LOGGER.exception("Unexpected exception")
+            raise self.InternalError(str(err))
+
+        return ADB._split_output(output), error.decode('utf-8')
+
+    async def _run_socket(self, cmd):
+        cmd = cmd.split() if not isinstance(cmd, list) else cmd
+        handler = self._socket_handlers.get(cmd[0])
+        if handler is None:
+            return None
+        ADB._check_target(cmd, self._target)
+
+        try:
+            output = await handler(*[str(arg) for arg in cmd[1:]])
+        except ADB.ServerError as err:
+            return None, "error: %s\n" % err
+
+        if not isinstance(output, bytes):
+            output = output.encode('utf-8')
+        return ADB._split_output(output), ""
+
+    async def _socket_version(self):
+        version = int(await self._server.host_request("host:version"), 16)
+        return "Android Debug Bridge version 1.0.%d\n" % version
+
+    async def _socket_devices(self):
+        return "List of devices attached\n%s\n" % (
+                await self._server.host_request("host:devices"))
+
+    async def _socket_get_state(self):
+        return await self._server.host_request(
+                "host-serial:%s:get-state" % self._target)
+
+    async def _socket_get_serialno(self):
+        return await self._server.host_request(
+                "host-serial:%s:get-serialno" % self._target)
+
+    async def _socket_wait_for_device(self):
+        if self._target is None:
+            await self._server.host_command("host:wait-for-any-device",
+                                            statuses=2)
+        else:
+            await self._server.host_command(
+                    "host-serial:%s:wait-for-any-device" % self._target,
+                    statuses=2)
+        return b""
+
+    async def _socket_shell(self, *args):
+        return await self._server.device_output(
+                self._target, "shell:%s" % " ".join(args))
+
+    async def _socket_logcat(self, *args):
+        return await self._server.device_output(
+                self._target, LOGCAT_SERVICE % " ".join(args))
+
+    async def _run_output(self, cmd):
+        return ADB._output_if_no_error(await self.run_cmd(cmd))
+
+    async def get_version(self):
+        """
+        Returns ADB tool version
+        adb version
+        """
+        output = await self._run_output("version")
+        if output is None or len(output) < 1:
+            ADB.LOGGER.warning(
+                    "No version found. Check adb is on path %s.",
+                    self._adb_path)
+            return None
+
+        try:
+            return output[0].split()[-1:][0]
+        except Exception as err:
+            ADB.LOGGER.exception(
+                    "Unexpected output %s caused %s", output, err)
+            raise self.InternalError(output)
+
+    async def check_path(self):
+        """
+        Intuitive way to verify the ADB path
+        """
+        return bool(await self.get_version())
+
+    async def start_server(self):
+        """
+        Starts ADB server
+        adb start-server
+        """
+        return (await self.run_cmd('start-server'))[0]
+
+    async def kill_server(self):
+        """
+        Kills ADB server
+        adb kill-server
+        """
+        return await self._run_output('kill-server')
+
+    async def restart_server(self):
+        """
+        Restarts ADB server
+        """
+        await self.kill_server()
+        return await self.start_server()
+
+    async def restore_file(self, file_name):
+        """
+        Restore device contents from the <file> backup archive
+        adb restore <file>
+        """
+        return await self._run_output(['restore', file_name])
+
+    async def wait_for_device(self):
+        """
+        Blocks until device is online
+        adb wait-for-device
+        """
+        return await self._run_output('wait-for-device')
+
+    async def get_help(self):
+        """
+        Returns ADB help
+        adb help
+        """
+        return await self._run_output('help')
+
+    async def get_devices(self):
+        """
+        Returns a list of connected devices
+        adb devices
+        """
+        self._devices = None
+        output = await self._run_output("devices")
+        try:
+            self._devices = [x.split()[0] for x in output[1:]]
+        except Exception as err:
+            ADB.LOGGER.exception(
+                    "Exception being translated to PermissionsError")
+            raise self.PermissionsError(str(err))
+        return self._devices
+
+    def set_target_device(self, device):
+        """
+        Select the device to work with
+        """
+        if device is None:
+            raise self.BadCall('Must provide device')
+        if not self._devices:
+            raise self.BadCall('Must call get_devices() first.')
+        if device not in self._devices:
+            raise self.BadCall('Unknown device')
+
+        self._target = device
+
+    def get_target_device(self):
+        """
+        Returns the selected device to work with
+        """
+        return self._target
+
+    async def get_state(self):
+        """
+        Get ADB state
+        adb get-state
+        """
+        return await self._run_output('get-state')
+
+    async def get_serialno(self):
+        """
+        Get serialno from target device
+        adb get-serialno
+        """
+        return await self._run_output('get-serialno')
+
+    async def reboot_device(self, mode):
+        """
+        Reboot the target device
+        adb reboot recovery/bootloader
+        """
+        if mode not in (self.REBOOT_RECOVERY, self.REBOOT_BOOTLOADER):
+            raise self.BadCall(
+                    "mode must be REBOOT_RECOVERY/REBOOT_BOOTLOADER")
+        return await self._run_output(
+                ["reboot",
+                 "recovery" if mode == self.REBOOT_RECOVERY
+                 else "bootloader"])
+
+    async def set_adb_root(self):
+        """
+        restarts the adbd daemon with root permissions
+        adb root
+        """
+        return await self._run_output('root')
+
+    async def set_system_rw(self):
+        """
+        Mounts /system as rw
+        adb remount
+        """
+        return await self._run_output("remount")
+
+    async def get_remote_file(self, remote, local):
+        """
+        Pulls a remote file
+        adb pull remote local
+        """
+        output, error = await self.run_cmd(['pull', remote, local])
+
+        if error is not None and "bytes in" in error:
+            return error
+
+        return output
+
+    async def push_local_file(self, local, remote):
+        """
+        Push a local file
+        adb push local remote
+        """
+        return await self._run_output(['push', local, remote])
+
+    async def shell_command(self, cmd):
+        """
+        Executes a shell command
+        adb shell <cmd>
+
+        Returns output and error as tuple.
+        """
+        return await self.run_cmd(['shell', cmd])
+
+    async def listen_usb(self):
+        """
+        Restarts the adbd daemon listening on USB
+        adb usb
+        """
+        return await self._run_output("usb")
+
+    async def listen_tcp(self, port=DEFAULT_TCP_PORT):
+        """
+        Restarts the adbd daemon listening on the specified port
+        adb tcpip <port>
+        """
+        return await self._run_output(['tcpip', port])
+
+    async def get_bugreport(self):
+        """
+        Return all information from the device that should be included in a
+        bug report
+        adb bugreport
+        """
+        return await self._run_output("bugreport")
+
+    async def get_jdwp(self):
+        """
+        List PIDs of processes hosting a JDWP transport
+        adb jdwp
+        """
+        return await self._run_output("jdwp")
+
+    async def get_logcat(self, lcfilter=""):
+        """
+        View device log
+        adb logcat <filter>
+        """
+        return await self._run_output(['logcat', lcfilter])
+
+    async def iter_logcat(self, lcfilter="", dump=False):
+        """
+        Yields logcat lines as they arrive
+        adb logcat [-d] <filter>
+        """
+        args = ['logcat'] + (['-d'] if dump else []) + lcfilter.split()
+        if self._server is not None:
+            reader, writer = await self._server.open_service(
+                    self._target, LOGCAT_SERVICE % " ".join(args[1:]))
+            proc = None
+        else:
+            if self._adb_path is None:
+                raise self.BadCall("ADB path not set")
+            proc = await asyncio.create_subprocess_exec(
+                    *self._build_command(args),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL)
+            reader = proc.stdout
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                yield line.rstrip(b"\r\n").decode('utf-8', 'replace')
+        finally:
+            if proc is None:
+                writer.close()
+            else:
+                if proc.returncode is None:
+                    proc.kill()
+                await proc.wait()
+
+    async def run_emulator(self, cmd=""):
+        """
+        Run emulator console command
+        """
+        return await self._run_output(['emu', cmd])
+
+    async def connect_remote(self, host=DEFAULT_TCP_HOST,
+                             port=DEFAULT_TCP_PORT):
+        """
+        Connect to a device via TCP/IP
+        adb connect host:port
+        """
+        return await self._run_output(['connect', "%s:%s" % (host, port)])
+
+    async def disconnect_remote(self, host=DEFAULT_TCP_HOST,
+                                port=DEFAULT_TCP_PORT):
+        """
+        Disconnect from a TCP/IP device
+        adb disconnect host:port
+        """
+        return await self._run_output(
+                ['disconnect', "%s:%s" % (host, port)])
+
+    async def ppp_over_usb(self, tty=None, params=""):
+        """
+        Run PPP over USB
+        adb ppp <tty> <params>
+        """
+        if tty is None:
+            return None
+
+        cmd = ["ppp", tty]
+        if params != "":
+            cmd += params.split()
+
+        return await self._run_output(cmd)
+
+    async def sync_directory(self, directory=""):
+        """
+        Copy host->device only if changed (-l means list but don't copy)
+        adb sync <dir>
+        """
+        return await self._run_output(['sync', directory])
+
+    async def forward_socket(self, local=None, remote=None):
+        """
+        Forward socket connections
+        adb forward <local> <remote>
+        """
+        if local is None or remote is None:
+            return None
+        return await self._run_output(['forward', local, remote])
+
+    async def uninstall(self, package=None, keepdata=False):
+        """
+        Remove this app package from the device
+        adb uninstall [-k] package
+        """
+        if package is None:
+            return None
+
+        cmd = ['uninstall']
+        if keepdata:
+            cmd.append('-k')
+        cmd.append(package)
+        return await self._run_output(cmd)
+
+    async def install(self, fwdlock=False, reinstall=False, sdcard=False,
+                      pkgapp=None):
+        """
+        Push this package file to the device and install it
+        adb install [-l] [-r] [-s] <file>
+        -l -> forward-lock the app
+        -r -> reinstall the app, keeping its data
+        -s -> install on sdcard instead of internal storage
+        """
+        if pkgapp is None:
+            return None
+
+        cmd = ['install']
+        if fwdlock:
+            cmd.append('-l')
+        if reinstall:
+            cmd.append('-r')
+        if sdcard:
+            cmd.append('-s')
+        cmd.append(pkgapp)
+        return await self._run_output(cmd)
+
+    async def find_binary(self, name=None):
+        """
+        Look for a binary file on the device
+        """
+        output, error = await self.run_cmd(['shell', 'which', name])
+
+        if "which: not found" in (error or "") or (
+                output and output[0].endswith("which: not found")):
+            # 'which' binary not available
+            raise self.InternalError("which binary not found")
+        elif output is None:  # not found
+            raise self.BadCall("'%s' was not found" % name)
+
+        return output
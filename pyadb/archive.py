@@ -0,0 +1,127 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Remote archives streamed over "adb exec-out".
+
+Instead of creating a tar file on the device, pulling it and deleting
+it, tar writes the archive to its stdout and the bytes are written to a
+local file, or unpacked with tarfile, as they arrive. Nothing is staged
+on the device and memory use is bounded by the copy chunk size.
+
+    pull_archive(adb, "/sdcard/WhatsApp", "whatsapp.tar.gz", compress=True)
+    extract_archive(adb, "/data/data/com.whatsapp", "backup", su="su")
+"""
+
+import os
+import posixpath
+import tarfile
+import time
+
+from .adb import ADB
+from .shell import quote
+from .sync import TransferResult
+
+
+def tar_command(remote, compress=False, su=None):
+    """
+    Returns the device command writing a tar of remote to stdout. The
+    archive members are named after the last component of remote.
+    """
+    remote = remote.rstrip('/') or '/'
+    parent, name = posixpath.split(remote)
+    # nothing at all is written when remote does not exist
+    cmd = "test -e %s && tar -c%sf - -C %s %s" % (
+            quote(remote), "z" if compress else "", quote(parent or '/'),
+            quote(name or '.'))
+    if su is not None:
+        cmd = "%s -c %s" % (su, quote(cmd))
+    # stderr would be mixed into the archive
+    return cmd + " 2>/dev/null"
+
+
+def open_archive(adb, remote, compress=False, su=None):
+    """
+    Returns a CommandStream reading the tar (gzip when compress) of the
+    remote path. su is the su binary to run tar through, if any.
+    """
+    return adb.open_cmd(['exec-out', tar_command(remote, compress, su)])
+
+
+def pull_archive(adb, remote, local, compress=False, su=None):
+    """
+    Writes the tar of the remote path into the local file, returns a
+    TransferResult
+    """
+    started = time.time()
+    try:
+        with open(local, "wb") as output:
+            with open_archive(adb, remote, compress, su) as stream:
+                size = stream.copy_to(output)
+    except Exception:
+        if os.path.isfile(local):
+            os.remove(local)
+        raise
+    if not size:
+        os.remove(local)
+        raise ADB.InternalError("No archive received for %s" % remote)
+    return TransferResult(remote, local, size, time.time() - started)
+
+
+def _inside(destination, path):
+    # os.path.commonpath is python 3.5+
+    return path == destination or path.startswith(
+            destination.rstrip(os.sep) + os.sep)
+
+
+def _check_member(member, destination):
+    path = os.path.realpath(os.path.join(destination, member.name))
+    if not _inside(destination, path):
+        raise ADB.InternalError("Archive member outside of %s: %s" % (
+                destination, member.name))
+    if member.issym():
+        target = os.path.join(os.path.dirname(path), member.linkname)
+    elif member.islnk():
+        target = os.path.join(destination, member.linkname)
+    else:
+        target = None
+    if target is not None and (
+            os.path.isabs(member.linkname)
+            or not _inside(destination, os.path.realpath(target))):
+        raise ADB.InternalError("Archive link outside of %s: %s" % (
+                destination, member.name))
+    if member.isdev():
+        raise ADB.InternalError("Device file in archive: %s" % member.name)
+
+
+def extract_archive(adb, remote, destination, compress=False, su=None):
+    """
+    Unpacks the tar of the remote path into destination while it is
+    received, returns the list of extracted member names.
+
+    Members that would land outside destination (absolute paths, "..",
+    links pointing out) and device files are refused.
+    """
+    destination = os.path.realpath(destination)
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+
+    names = []
+    with open_archive(adb, remote, compress, su) as stream:
+        try:
+            with tarfile.open(fileobj=stream,
+                              mode="r|gz" if compress else "r|") as archive:
+                for member in archive:
+                    _check_member(member, destination)
+                    if hasattr(tarfile, "data_filter"):
+                        archive.extract(member, destination, filter="data")
+                    else:
+                        archive.extract(member, destination)
+                    names.append(member.name)
+        except tarfile.TarError as err:
+            raise ADB.InternalError("Cannot extract %s: %s" % (remote, err))
+    if not names:
+        raise ADB.InternalError("No archive received for %s" % remote)
+    return names
@@ -0,0 +1,156 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Bug reports written to disk as they are produced.
+
+Android 7+ devices build a zipped report with "bugreportz -p", which
+prints progress lines and the path of the zip:
+
+    BEGIN:<path>
+    PROGRESS:<done>/<total>
+    OK:<path>  |  FAIL:<message>
+
+The zip is then pulled over the sync protocol and removed from the
+device. Older devices only have "bugreport", whose text output is
+copied to the local file chunk by chunk. Either way memory use is
+bounded by the copy chunk size, not by the size of the report.
+
+    capture_bugreport(adb, "report.zip", progress=print)
+    for result in capture_many(ADB.get_devices(), "reports"):
+        print(result)
+"""
+
+import os
+import time
+
+from .adb import ADB
+from .fanout import FanOut
+from .shell import quote
+from .sync import SyncConnection, TransferResult, replace_file
+from .transport import get_server
+
+
+GENERATING = "generating"
+PULLING = "pulling"
+STREAMING = "streaming"
+
+
+def _generate_zip(adb, progress):
+    """
+    Runs bugreportz on the device, returns the remote path of the zip,
+    None if the device has no bugreportz
+    """
+    path = None
+    with adb.open_cmd(['shell', 'bugreportz -p']) as stream:
+        for line in stream:
+            line = line.decode('utf-8', 'replace').strip()
+            kind, _, value = line.partition(":")
+            if kind == "PROGRESS":
+                done, _, total = value.partition("/")
+                if progress is not None:
+                    try:
+                        progress(GENERATING, int(done), int(total))
+                    except ValueError:
+                        pass
+            elif kind in ("BEGIN", "OK"):
+                path = value
+                if kind == "OK":
+                    return path
+            elif kind == "FAIL":
+                raise ADB.InternalError("bugreportz failed: %s" % value)
+            elif path is None:
+                # "bugreportz: not found", or another shell error
+                ADB.LOGGER.info("No bugreportz on the device: %s", line)
+                return None
+    if path is None:
+        return None
+    raise ADB.InternalError("bugreportz ended before finishing %s" % path)
+
+
+def _stream_text(adb, local, progress):
+    callback = None
+    if progress is not None:
+        callback = lambda done, total: progress(STREAMING, done, total)
+    with open(local, "wb") as output:
+        with adb.open_cmd(['exec-out', 'bugreport']) as stream:
+            return stream.copy_to(output, progress=callback)
+
+
+def capture_bugreport(adb, local, zipped=None, progress=None):
+    """
+    Writes a bug report of the target device of adb to the local file,
+    returns a TransferResult.
+
+    zipped selects bugreportz (True) or the plain text report (False),
+    None uses bugreportz when the device has it. progress is called as
+    progress(stage, done, total) with stage GENERATING (bugreportz
+    progress units), PULLING or STREAMING (bytes, total None while
+    streaming).
+    """
+    started = time.time()
+    try:
+        remote = None
+        if zipped or zipped is None:
+            remote = _generate_zip(adb, progress)
+            if remote is None and zipped:
+                raise ADB.InternalError("The device has no bugreportz")
+
+        if remote is None:
+            size = _stream_text(adb, local, progress)
+            if not size:
+                raise ADB.InternalError("Empty bug report")
+            return TransferResult("bugreport", local, size,
+                                  time.time() - started)
+
+        callback = None
+        if progress is not None:
+            callback = lambda done, total: progress(PULLING, done, total)
+        try:
+            with SyncConnection(get_server(adb),
+                                adb.get_target_device()) as sync:
+                transfer = sync.pull(remote, local, callback)
+        finally:
+            adb.shell_command("rm -f %s" % quote(remote))
+        return TransferResult(remote, local, transfer.size,
+                              time.time() - started)
+    except Exception:
+        if os.path.isfile(local):
+            os.remove(local)
+        raise
+
+
+def capture_many(devices, directory, zipped=None, max_workers=4,
+                 timeout=None, progress=None, adb_class=ADB):
+    """
+    Captures bug reports from many devices in parallel into directory,
+    one "<serial>-<timestamp>.zip" (or ".txt") file per device. Yields a
+    pyadb.fanout.DeviceResult per device, its value the TransferResult.
+    progress is called as progress(serial, stage, done, total).
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+
+    def capture(adb):
+        serial = adb.get_target_device()
+        name = "%s-%s" % (serial.replace(":", "_").replace("/", "_"), stamp)
+        callback = None
+        if progress is not None:
+            callback = lambda stage, done, total: progress(serial, stage,
+                                                           done, total)
+        local = os.path.join(directory, name + ".zip")
+        result = capture_bugreport(adb, local, zipped, callback)
+        if result.source == "bugreport":
+            # plain text report
+            text = os.path.join(directory, name + ".txt")
+            replace_file(local, text)
+            result.destination = text
+        return result
+
+    fanout = FanOut(max_workers=max_workers, timeout=timeout,
+                    adb_class=adb_class)
+    for result in fanout.run(devices, capture):
+        yield result
@@ -0,0 +1,181 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Opt-in cache of idempotent command results.
+
+Answers such as the adb version, the serial number, getprop values or the
+location of a binary do not change between calls, but each call costs an
+adb round trip (a process spawn with the adb binary). Once a ResultCache
+is set, run_cmd_c answers those commands from memory:
+
+    cache = ResultCache(maxsize=512)
+    ADB.set_result_cache(cache)
+    adb.shell_command("getprop ro.build.version.sdk")  # miss, runs adb
+    adb.shell_command("getprop ro.build.version.sdk")  # hit
+    cache.stats()
+
+Entries are kept per device and adb server, expire after the TTL of the
+rule matching the command and are evicted least recently used first.
+Commands changing the device state (reboot, root, remount, install,
+uninstall) drop the entries of that device.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache(object):
+    """
+    Size bounded LRU of (output, error) results with per-command TTLs.
+
+    ttls maps command prefixes ("shell getprop") to seconds; a command is
+    cached when the words it starts with match a prefix, the longest
+    prefix winning. invalidating lists the commands dropping the entries
+    of their device: first words ("install") or prefixes ("shell pm
+    install-commit").
+    """
+
+    DEFAULT_TTLS = {
+        "version": 300.0,
+        "get-serialno": 300.0,
+        "shell getprop": 30.0,
+        "shell which": 300.0,
+        }
+
+    INVALIDATING = frozenset(("reboot", "root", "unroot", "remount",
+                              "install", "install-multiple", "uninstall",
+                              "shell pm install", "shell pm install-commit",
+                              "shell pm uninstall"))
+
+    def __init__(self, maxsize=256, ttls=None, invalidating=INVALIDATING):
+        self.maxsize = maxsize
+        self._ttls = dict(self.DEFAULT_TTLS if ttls is None else ttls)
+        self.invalidating = frozenset(invalidating)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _words(cmd):
+        cmd = cmd if isinstance(cmd, list) else [cmd]
+        return tuple(" ".join(str(arg) for arg in cmd).split())
+
+    def ttl(self, cmd):
+        """
+        Returns the TTL of a command, None if it is not cached
+        """
+        words = self._words(cmd)
+        best = None
+        for prefix, ttl in self._ttls.items():
+            prefix = tuple(prefix.split())
+            if words[:len(prefix)] == prefix and (
+                    best is None or len(prefix) > len(best[0])):
+                best = (prefix, ttl)
+        return best[1] if best is not None else None
+
+    def set_ttl(self, prefix, ttl):
+        """
+        Caches the commands starting with prefix for ttl seconds, None
+        stops caching them
+        """
+        with self._lock:
+            if ttl is None:
+                self._ttls.pop(prefix, None)
+            else:
+                self._ttls[prefix] = ttl
+
+    def get(self, cmd, serial, server=None):
+        """
+        Returns the cached (output, error) or None. server identifies the
+        adb server answering (ADB instances talking to different servers
+        may see the same serial).
+        """
+        key = (server, serial, self._words(cmd))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # most recently used last (no move_to_end on python 2)
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+        output, error = entry[1]
+        return (list(output) if output is not None else None), error
+
+    def put(self, cmd, serial, result, server=None):
+        """
+        Stores a successful result of a cacheable command
+        """
+        ttl = self.ttl(cmd)
+        if ttl is None or result[1]:
+            return
+        output = result[0]
+        key = (server, serial, self._words(cmd))
+        with self._lock:
+            # most recently used last
+            self._entries.pop(key, None)
+            self._entries[key] = (
+                    time.time() + ttl,
+                    (tuple(output) if output is not None else None,
+                     result[1]))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def notify(self, cmd, serial, server=None):
+        """
+        Called before a command runs, drops the entries of serial when the
+        command changes the device state
+        """
+        words = self._words(cmd)
+        for prefix in self.invalidating:
+            prefix = tuple(prefix.split())
+            if words[:len(prefix)] == prefix:
+                self.invalidate(serial, server)
+                return
+
+    def invalidate(self, serial=None, server=None):
+        """
+        Drops the entries of a device (of a single adb server if given),
+        or all of them without serial
+        """
+        with self._lock:
+            if serial is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries
+                            if key[1] == serial and
+                            (server is None or key[0] == server)]:
+                    del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns the hit/miss/eviction/invalidation counters and the size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+                }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+            self.evictions = self.invalidations = 0
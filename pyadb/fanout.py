@@ -0,0 +1,148 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Run the same operation on many devices in parallel.
+
+    fanout = FanOut(max_workers=32, timeout=60)
+    for result in fanout.run(adb.get_devices(), "shell_command", "id"):
+        print(result.serial, result.value, result.error)
+
+Each device gets its own ADB object targeting it, so operations never
+share the target of the caller's ADB instance. Pass an ADB object as
+adb_class to run with its settings instead of the class defaults.
+"""
+
+import time
+from concurrent import futures
+
+from .adb import ADB, Deadline
+
+
+class DeviceResult(object):
+    """
+    Outcome of an operation on one device: value on success, error (the
+    exception raised) on failure
+    """
+
+    def __init__(self, serial, value=None, error=None, seconds=0.0):
+        self.serial = serial
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+    def __repr__(self):
+        if self.error is not None:
+            return "DeviceResult(%r, error=%r)" % (self.serial, self.error)
+        return "DeviceResult(%r, value=%r)" % (self.serial, self.value)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def device_adb(serial, adb_class=ADB):
+    """
+    Returns an ADB object targeting serial. adb_class is an ADB class, or
+    an ADB object whose settings (adb path, backend...) are copied.
+    """
+    if isinstance(adb_class, ADB):
+        return adb_class.for_device(serial)
+    adb = adb_class()
+    adb._target = serial
+    return adb
+
+
+class FanOut(object):
+    """
+    Runs an operation across devices with at most max_workers in flight.
+
+    operation is either the name of an ADB method ("shell_command",
+    "push_local_file", "install", "reboot_device", ...) or a callable
+    called as operation(adb, *args, **kwargs), adb targeting the device.
+
+    When an operation takes longer than timeout seconds its device is
+    reported with an ADB.Timeout error and the fan-out moves on without
+    waiting for it, while the adb commands it was running are killed.
+    """
+
+    def __init__(self, max_workers=8, timeout=None, adb_class=ADB):
+        if max_workers < 1:
+            raise ADB.BadCall("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._adb_class = adb_class
+
+    def _call(self, serial, operation, args, kwargs, started):
+        started[serial] = time.time()
+        adb = device_adb(serial, self._adb_class)
+        # commands still running at the timeout are killed, freeing the
+        # worker
+        with Deadline(self.timeout):
+            if callable(operation):
+                return operation(adb, *args, **kwargs)
+            return getattr(adb, operation)(*args, **kwargs)
+
+    def run(self, devices, operation, *args, **kwargs):
+        """
+        Yields a DeviceResult per device as soon as its operation finishes
+        """
+        if not callable(operation) and not hasattr(self._adb_class,
+                                                   operation):
+            raise ADB.BadCall("Unknown operation %r" % operation)
+
+        started = {}
+        executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            pending = {}
+            for serial in devices:
+                future = executor.submit(self._call, serial, operation, args,
+                                         kwargs, started)
+                pending[future] = serial
+
+            while pending:
+                done, _ = futures.wait(
+                        pending, timeout=self._poll_interval(started),
+                        return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    serial = pending.pop(future)
+                    seconds = time.time() - started.get(serial, time.time())
+                    error = future.exception()
+                    if error is not None:
+                        yield DeviceResult(serial, error=error,
+                                           seconds=seconds)
+                    else:
+                        yield DeviceResult(serial, value=future.result(),
+                                           seconds=seconds)
+
+                if self.timeout is None:
+                    continue
+                now = time.time()
+                for future, serial in list(pending.items()):
+                    if serial in started and \
+                            now - started[serial] >= self.timeout:
+                        del pending[future]
+                        future.cancel()
+                        yield DeviceResult(
+                                serial,
+                                error=ADB.Timeout(
+                                    "%r timed out after %ss" % (
+                                        operation, self.timeout)),
+                                seconds=now - started[serial])
+        finally:
+            # do not wait for operations that timed out
+            executor.shutdown(wait=False)
+
+    def _poll_interval(self, started):
+        if self.timeout is None:
+            return None
+        return min(self.timeout, 0.1)
+
+    def map(self, devices, operation, *args, **kwargs):
+        """
+        Runs the operation on all devices and returns {serial: DeviceResult}
+        """
+        return dict((result.serial, result) for result in
+                    self.run(devices, operation, *args, **kwargs))
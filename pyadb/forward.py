@@ -0,0 +1,349 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Port forwards, reverse forwards and direct device connections.
+
+ForwardManager lists, creates (without duplicates) and removes the
+forwards of the adb server:
+
+    host-serial:<serial>:forward[:norebind]:<local>;<remote>
+    host-serial:<serial>:list-forward / killforward:<local>
+    host:transport:<serial> + reverse:forward:<remote>;<local>,
+    reverse:list-forward, reverse:killforward:<remote>
+
+Relay skips forwards altogether: every connect() asks the adb server to
+open the device socket (tcp:<port>, localabstract:<name>, ...) on the
+device transport and hands back that connection, so no local port is
+listened on and no adb process is spawned per connection.
+"""
+
+import threading
+import time
+
+from .adb import ADB
+from .transport import AdbConnection, get_server
+
+
+class Forward(object):
+    """
+    A forward (local on the host to remote on the device) or, when
+    reverse is True, a reverse forward (remote on the device to local on
+    the host)
+    """
+
+    __slots__ = ("serial", "local", "remote", "reverse")
+
+    def __init__(self, serial, local, remote, reverse=False):
+        self.serial = serial
+        self.local = local
+        self.remote = remote
+        self.reverse = reverse
+
+    def __repr__(self):
+        return "Forward(%r, %r, %r%s)" % (
+                self.serial, self.local, self.remote,
+                ", reverse=True" if self.reverse else "")
+
+    def __eq__(self, other):
+        return isinstance(other, Forward) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        return (self.serial, self.local, self.remote, self.reverse)
+
+    @property
+    def port(self):
+        """
+        Host port of a tcp: forward, None otherwise
+        """
+        spec = self.remote if self.reverse else self.local
+        if spec.startswith("tcp:"):
+            return int(spec[len("tcp:"):])
+        return None
+
+
+def _parse_list(payload, serial=None, reverse=False):
+    forwards = []
+    for line in payload.decode('utf-8', 'replace').splitlines():
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        if reverse:
+            # the device lists "<transport> <remote> <local>"
+            forwards.append(Forward(serial, fields[2], fields[1], True))
+        else:
+            forwards.append(Forward(fields[0], fields[1], fields[2]))
+    return forwards
+
+
+class ForwardManager(object):
+    """
+    Forwards and reverse forwards of the devices, read from and applied
+    to the adb server.
+
+    forwards = ForwardManager()
+    forward = forwards.forward(serial, "tcp:0", "tcp:8080")
+    forward.port           # host port picked by the adb server
+    forwards.forward(serial, "tcp:0", "tcp:8080")  # same forward, reused
+
+    Known forwards are cached, refresh() reloads them from the server
+    (forwards made by other clients, devices gone, ...).
+    """
+
+    def __init__(self, server=None, adb=None):
+        self.server = server or get_server(adb)
+        self._lock = threading.Lock()
+        self._forwards = None
+        self._reverses = {}
+
+    def _host_request(self, service, statuses, reply=False):
+        with self.server.connect() as conn:
+            conn.send_request(service)
+            for _ in range(statuses - 1):
+                conn.read_status()
+            if reply:
+                return conn.read_length_prefixed()
+        return None
+
+    def _reverse_request(self, serial, service, statuses, reply=False):
+        with self.server.open_transport(serial) as conn:
+            conn.send_request(service)
+            for _ in range(statuses - 1):
+                conn.read_status()
+            if reply:
+                return conn.read_length_prefixed()
+        return None
+
+    def refresh(self, serial=None):
+        """
+        Reloads the forwards (and the reverse forwards of serial, if
+        given) from the adb server
+        """
+        forwards = _parse_list(self._host_request("host:list-forward", 1,
+                                                  reply=True))
+        with self._lock:
+            self._forwards = forwards
+        if serial is not None:
+            payload = self._reverse_request(serial, "reverse:list-forward",
+                                            1, reply=True)
+            with self._lock:
+                self._reverses[serial] = _parse_list(payload, serial, True)
+
+    def list(self, serial=None):
+        """
+        Returns the forwards, of serial only if given
+        """
+        if self._forwards is None:
+            self.refresh()
+        with self._lock:
+            return [forward for forward in self._forwards
+                    if serial is None or forward.serial == serial]
+
+    def list_reverse(self, serial):
+        """
+        Returns the reverse forwards of serial
+        """
+        if serial not in self._reverses:
+            self.refresh(serial)
+        with self._lock:
+            return list(self._reverses[serial])
+
+    def find(self, serial, remote, local=None):
+        """
+        Returns the known forward of serial to remote (from local when
+        given), None if there is none
+        """
+        for forward in self.list(serial):
+            if forward.remote == remote and local in (None, forward.local):
+                return forward
+        return None
+
+    def forward(self, serial, local, remote, norebind=False):
+        """
+        Forwards local (tcp:<port>, tcp:0 for any free port,
+        localabstract:<name>, ...) to remote on the device, returns the
+        Forward. An existing forward of the same device to the same
+        remote is reused instead of creating a new one.
+        """
+        existing = self.find(serial, remote,
+                             None if local == "tcp:0" else local)
+        if existing is not None:
+            return existing
+
+        service = "host-serial:%s:forward:%s%s;%s" % (
+                serial, "norebind:" if norebind else "", local, remote)
+        with self.server.connect() as conn:
+            conn.send_request(service)
+            conn.read_status()
+            if local == "tcp:0":
+                local = "tcp:%s" % conn.read_length_prefixed().decode(
+                        'ascii').strip()
+        forward = Forward(serial, local, remote)
+        with self._lock:
+            # a rebind replaces the previous target of local, host ports
+            # being shared by all the devices
+            self._forwards = [
+                    other for other in self._forwards
+                    if other.local != local] \
+                if self._forwards is not None else []
+            self._forwards.append(forward)
+        return forward
+
+    def remove(self, forward):
+        """
+        Removes a forward (or reverse forward)
+        """
+        if forward.reverse:
+            self._reverse_request(forward.serial,
+                                  "reverse:killforward:%s" % forward.remote,
+                                  2)
+            with self._lock:
+                self._reverses[forward.serial] = [
+                        other for other in self._reverses.get(
+                            forward.serial, []) if other != forward]
+            return
+        self._host_request("host-serial:%s:killforward:%s" % (
+                forward.serial, forward.local), 2)
+        with self._lock:
+            if self._forwards is not None:
+                self._forwards = [other for other in self._forwards
+                                  if other != forward]
+
+    def remove_all(self, serial):
+        """
+        Removes every forward and reverse forward of serial
+        """
+        self._host_request("host-serial:%s:killforward-all" % serial, 2)
+        self._reverse_request(serial, "reverse:killforward-all", 2)
+        with self._lock:
+            if self._forwards is not None:
+                self._forwards = [other for other in self._forwards
+                                  if other.serial != serial]
+            self._reverses[serial] = []
+
+    def reverse(self, serial, remote, local, norebind=False):
+        """
+        Makes remote on the device (tcp:<port>, localabstract:<name>)
+        connect to local on the host, returns the Forward. An existing
+        identical reverse forward is reused.
+        """
+        for existing in self.list_reverse(serial):
+            if existing.remote == remote and existing.local == local:
+                return existing
+        self._reverse_request(serial, "reverse:forward:%s%s;%s" % (
+                "norebind:" if norebind else "", remote, local), 2)
+        forward = Forward(serial, local, remote, True)
+        with self._lock:
+            self._reverses[serial] = [
+                    other for other in self._reverses.get(serial, [])
+                    if other.remote != remote] + [forward]
+        return forward
+
+
+class RelayConnection(AdbConnection):
+    """
+    Connection to a device socket, counting the bytes moved for its Relay
+    """
+
+    def __init__(self, sock, relay):
+        AdbConnection.__init__(self, sock)
+        self._relay = relay
+
+    def send(self, data):
+        AdbConnection.send(self, data)
+        self._relay._count(sent=len(data))
+
+    sendall = send
+
+    def recv(self, size=AdbConnection.CHUNK_SIZE):
+        data = AdbConnection.recv(self, size)
+        self._relay._count(received=len(data))
+        return data
+
+    def close(self):
+        if self.socket is not None:
+            self._relay._count(closed=1)
+        AdbConnection.close(self)
+
+
+class Relay(object):
+    """
+    Opens connections to a socket of a device through the adb server
+    transport, without any forward or listening port.
+
+    relay = Relay(serial, "localabstract:chrome_devtools_remote")
+    with relay.connect() as conn:
+        conn.send(b"GET /json HTTP/1.0\\r\\n\\r\\n")
+        print(conn.read_all())
+    relay.stats()
+
+    remote is an adb socket spec: tcp:<port>, localabstract:<name>,
+    localreserved:<name>, localfilesystem:<path> or dev:<path>.
+    """
+
+    def __init__(self, serial, remote, server=None, adb=None):
+        self.serial = serial
+        self.remote = remote
+        self.server = server or get_server(adb)
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.active = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.started = time.time()
+
+    def __repr__(self):
+        return "Relay(%r, %r)" % (self.serial, self.remote)
+
+    def _count(self, sent=0, received=0, closed=0):
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.active -= closed
+
+    def connect(self):
+        """
+        Returns a RelayConnection to the device socket
+        """
+        conn = self.server.open_transport(self.serial)
+        try:
+            conn.send_request(self.remote)
+        except Exception:
+            conn.close()
+            with self._lock:
+                self.failures += 1
+            raise
+        sock, conn._sock = conn.socket, None
+        # only drops the deadline watch, the socket now belongs to the
+        # RelayConnection
+        conn.close()
+        with self._lock:
+            self.connections += 1
+            self.active += 1
+        return RelayConnection(sock, self)
+
+    def stats(self):
+        """
+        Returns the connection and byte counters, with throughput in bytes
+        per second since the relay was created
+        """
+        with self._lock:
+            seconds = max(time.time() - self.started, 1e-9)
+            return {
+                "connections": self.connections,
+                "active": self.active,
+                "failures": self.failures,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "sent_per_second": self.bytes_sent / seconds,
+                "received_per_second": self.bytes_received / seconds,
+                }
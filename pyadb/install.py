@@ -0,0 +1,215 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+APK installation through package manager sessions.
+
+Like "adb install-multiple", the APKs are written straight into an
+install session on the device, so no copy is staged under
+/data/local/tmp:
+
+    pm install-create -S <total size> [options]  -> session id
+    pm install-write -S <size> <session> <name> -  (APK bytes on stdin)
+    pm install-commit <session>
+
+A split APK set (base.apk + config splits) is installed in one session.
+install_fleet installs the same set on many devices in parallel, the
+files being mapped in memory once and shared by every transfer.
+"""
+
+import mmap
+import os
+import re
+import threading
+
+from .adb import ADB, COPY_CHUNK_SIZE
+from .fanout import FanOut
+from .shell import quote
+
+
+SESSION_RE = re.compile(r"\[(\d+)\]")
+
+
+class ApkSet(object):
+    """
+    Read-only memory maps of the APK files to install, shared by all the
+    devices they are installed on
+
+    with ApkSet(["base.apk", "split_config.arm64_v8a.apk"]) as apks:
+        install_session(adb, apks)
+    """
+
+    def __init__(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = list(paths)
+        if not self.paths:
+            raise ADB.BadCall("No APK to install")
+        self._files = []
+        self.apks = []
+        self.closed = False
+        # transfers using the maps, the last one unmaps a closed set
+        self._users = 0
+        self._lock = threading.Lock()
+        for index, path in enumerate(self.paths):
+            with open(path, "rb") as apk:
+                size = os.fstat(apk.fileno()).st_size
+                if size:
+                    data = mmap.mmap(apk.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                    self._files.append(data)
+                else:
+                    data = b""
+            name = "%d_%s" % (index, os.path.basename(path))
+            self.apks.append((name, memoryview(data)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def size(self):
+        return sum(len(data) for _, data in self.apks)
+
+    def acquire(self):
+        """
+        Registers a transfer using the maps
+        """
+        with self._lock:
+            if self.closed:
+                raise ADB.BadCall("APK set already closed")
+            self._users += 1
+
+    def release(self):
+        """
+        Ends a transfer, unmaps the files if the set was closed meanwhile
+        """
+        with self._lock:
+            self._users -= 1
+            unmap = self.closed and not self._users
+        if unmap:
+            try:
+                self._unmap()
+            except BufferError as err:
+                # a view outlived its transfer (kept by a traceback...)
+                ADB.LOGGER.warning("APK maps still in use, left to the "
+                                   "garbage collector: %s", err)
+
+    def close(self):
+        """
+        Unmaps the files, or lets the last running transfer do it (a
+        transfer that timed out in install_fleet may still be writing).
+        Raises BufferError if views of the maps are still held elsewhere.
+        """
+        with self._lock:
+            self.closed = True
+            if self._users:
+                return
+        self._unmap()
+
+    def _unmap(self):
+        for _, data in self.apks:
+            data.release()
+        self.apks = []
+        while self._files:
+            self._files[-1].close()
+            self._files.pop()
+
+
+def _check_success(output, what):
+    if "Success" not in output:
+        raise ADB.InternalError("%s failed: %s" % (
+                what, output.strip() or "no output"))
+    return output.strip()
+
+
+def _exec_in(adb, cmd, data):
+    """
+    Runs cmd on the target device with data on its stdin, returns its
+    output
+    adb exec-in <cmd>
+    """
+    with adb.open_cmd(['exec-in', cmd]) as stream:
+        try:
+            for offset in range(0, len(data), COPY_CHUNK_SIZE):
+                chunk = data[offset:offset + COPY_CHUNK_SIZE]
+                try:
+                    stream.write(chunk)
+                finally:
+                    if isinstance(chunk, memoryview):
+                        # not kept alive by a traceback, so the map
+                        # can be closed
+                        chunk.release()
+        except ADB.InternalError:
+            # the device side gave up, its output says why
+            pass
+        stream.close_stdin()
+        output = stream.read()
+        error = stream.error()
+    return output.decode('utf-8', 'replace') + error
+
+
+def _pm(adb, args):
+    output, error = adb.shell_command("pm " + args)
+    return "\n".join((output or []) + ([error] if error else []))
+
+
+def install_session(adb, apks, options=()):
+    """
+    Installs one APK, or a split APK set, on the target device of adb in
+    a single install session. apks is a path, a list of paths or an
+    ApkSet; options are extra "pm install-create" flags ("-r", "-g",
+    "-d", ...). Returns the output of the commit ("Success").
+    """
+    if not isinstance(apks, ApkSet):
+        with ApkSet(apks) as apks:
+            return install_session(adb, apks, options)
+    apks.acquire()
+    try:
+        return _install(adb, apks, options)
+    finally:
+        apks.release()
+
+
+def _install(adb, apks, options):
+    create = " ".join(["install-create", "-S", str(apks.size)] +
+                      [quote(option) for option in options])
+    output = _check_success(_pm(adb, create), "install-create")
+    match = SESSION_RE.search(output)
+    if match is None:
+        raise ADB.InternalError("No install session id in %r" % output)
+    session = match.group(1)
+
+    try:
+        for name, data in apks.apks:
+            _check_success(
+                _exec_in(adb, "pm install-write -S %d %s %s -" % (
+                    len(data), session, quote(name)), data),
+                "install-write of %s" % name)
+        return _check_success(_pm(adb, "install-commit %s" % session),
+                              "install-commit")
+    except Exception:
+        try:
+            _pm(adb, "install-abandon %s" % session)
+        except ADB.AdbException:
+            pass
+        raise
+
+
+def install_fleet(devices, apks, options=(), max_workers=8, timeout=None,
+                  adb_class=ADB):
+    """
+    Installs the same APK set on many devices in parallel, yielding a
+    pyadb.fanout.DeviceResult per device as they finish. The APK files
+    are read once and shared by all the transfers.
+    """
+    with ApkSet(apks) as apk_set:
+        fanout = FanOut(max_workers=max_workers, timeout=timeout,
+                        adb_class=adb_class)
+        for result in fanout.run(devices, install_session, apk_set,
+                                 options):
+            yield result
@@ -0,0 +1,374 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Streaming access to the device log.
+
+ADB.get_logcat waits for logcat to exit and returns the whole log at
+once. LogcatStream yields lines while logcat is running instead: nothing
+is read from adb until the consumer asks for the next line, so a slow
+consumer pushes back on adb (and the device) rather than growing a buffer.
+
+Lines in the threadtime format ("-v threadtime", the default of recent
+logcat versions) and the binary format of "logcat -B" decode into
+LogRecord objects. LogFilter compiles a filter once and LogIndex keeps
+records indexed by tag, pid and level for repeated queries over a
+captured window.
+"""
+
+import array
+import collections
+import re
+import struct
+import time
+
+from .adb import ADB
+
+
+# logcat priorities, as in android/log.h
+PRIORITIES = {"V": 2, "D": 3, "I": 4, "W": 5, "E": 6, "F": 7, "S": 8}
+LEVELS = dict((priority, level) for level, priority in PRIORITIES.items())
+
+
+class LogRecord(object):
+    """
+    One log entry, time in seconds since the epoch
+    """
+
+    __slots__ = ("time", "pid", "tid", "level", "tag", "message")
+
+    def __init__(self, time, pid, tid, level, tag, message):
+        self.time = time
+        self.pid = pid
+        self.tid = tid
+        self.level = level
+        self.tag = tag
+        self.message = message
+
+    def __repr__(self):
+        return "LogRecord(%.3f, pid=%d, tid=%d, %s/%s: %r)" % (
+                self.time, self.pid, self.tid, self.level, self.tag,
+                self.message)
+
+    @property
+    def priority(self):
+        return PRIORITIES.get(self.level, 0)
+
+
+class _ThreadtimeParser(object):
+    """
+    Parses "MM-DD HH:MM:SS.mmm  PID  TID L TAG     : message" lines. The
+    log has no year, the current one is assumed. Converted timestamps are
+    cached per second, consecutive lines mostly share it.
+    """
+
+    def __init__(self, year=None):
+        self.year = year or time.localtime().tm_year
+        self._seconds = {}
+
+    def __call__(self, line):
+        fields = line.split(None, 5)
+        if len(fields) < 6 or len(fields[0]) != 5 or len(fields[1]) < 8:
+            return None
+        date, clock, pid, tid, level, rest = fields
+        tag, sep, message = rest.partition(": ")
+        if not sep:
+            # empty message, the line ends with the colon
+            tag, sep, message = rest.partition(":")
+        try:
+            second = self._seconds.get((date, clock[:8]))
+            if second is None:
+                if len(self._seconds) > 4096:
+                    self._seconds.clear()
+                second = time.mktime(time.strptime(
+                        "%d-%s %s" % (self.year, date, clock[:8]),
+                        "%Y-%m-%d %H:%M:%S"))
+                self._seconds[(date, clock[:8])] = second
+            fraction = float(clock[8:]) if len(clock) > 8 else 0.0
+            return LogRecord(second + fraction, int(pid), int(tid), level,
+                             tag.rstrip(), message)
+        except ValueError:
+            return None
+
+
+def parse_threadtime(lines, year=None):
+    """
+    Yields a LogRecord per threadtime line, skipping the lines that are
+    not log entries ("--------- beginning of main", ...)
+    """
+    parser = _ThreadtimeParser(year)
+    for line in lines:
+        record = parser(line)
+        if record is not None:
+            yield record
+
+
+# struct logger_entry: len, hdr_size, pid, tid, sec, nsec (then lid, uid)
+_ENTRY_START = struct.Struct("<HH")
+_ENTRY_FIELDS = struct.Struct("<iIiI")
+_V1_HEADER_SIZE = 20
+
+
+def parse_binary(stream):
+    """
+    Yields a LogRecord per entry of a "logcat -B" stream (a file object
+    or CommandStream). Entries of the binary event buffers have no text
+    tag and message and are skipped.
+    """
+    while True:
+        start = stream.read(_ENTRY_START.size)
+        if len(start) < _ENTRY_START.size:
+            return
+        length, header_size = _ENTRY_START.unpack(start)
+        if header_size == 0:
+            header_size = _V1_HEADER_SIZE
+        header = stream.read(header_size - _ENTRY_START.size)
+        payload = stream.read(length)
+        if len(header) < _ENTRY_FIELDS.size or len(payload) < length:
+            return
+        pid, tid, sec, nsec = _ENTRY_FIELDS.unpack_from(header)
+        # payload: priority byte, tag, NUL, message, NUL
+        tag_end = payload.find(b"\0", 1)
+        if not length or tag_end < 0:
+            continue
+        level = LEVELS.get(bytearray(payload[:1])[0])
+        if level is None:
+            continue
+        yield LogRecord(
+                sec + nsec / 1e9, pid, tid, level,
+                payload[1:tag_end].decode('utf-8', 'replace'),
+                payload[tag_end + 1:].rstrip(b"\0\n").decode(
+                    'utf-8', 'replace'))
+
+
+class LogFilter(object):
+    """
+    Filter compiled once and applied to many records.
+
+    spec uses the logcat filterspec syntax ("ActivityManager:I *:S"),
+    the default level being V. pids is a collection of pids, pattern a
+    regular expression searched in the message. Only given criteria are
+    checked.
+
+    crashes = LogFilter("AndroidRuntime:E DEBUG:F *:S", pattern="FATAL")
+    matching = [record for record in records if crashes(record)]
+    """
+
+    def __init__(self, spec="", pids=None, pattern=None):
+        self._tags = {}
+        self._default = PRIORITIES["V"]
+        for item in spec.split():
+            tag, _, level = item.rpartition(":")
+            if not tag:
+                tag, level = level, "V"
+            priority = PRIORITIES.get(level.upper())
+            if priority is None:
+                raise ADB.BadCall("Bad level in filter spec: %s" % item)
+            if tag == "*":
+                self._default = priority
+            else:
+                self._tags[tag] = priority
+        self._pids = frozenset(pids) if pids is not None else None
+        self._pattern = re.compile(pattern) if pattern else None
+
+    def __call__(self, record):
+        if record.priority < self._tags.get(record.tag, self._default):
+            return False
+        if self._pids is not None and record.pid not in self._pids:
+            return False
+        if self._pattern is not None and \
+                self._pattern.search(record.message) is None:
+            return False
+        return True
+
+
+class LogIndex(object):
+    """
+    Window of records with positions indexed by tag, pid and level.
+
+    index = LogIndex(parse_threadtime(adb_lines))
+    index.query(tag="ActivityManager", level="W")
+    index.query(pid=1234, since=time.time() - 60)
+
+    Index postings are arrays of positions, queries intersect the
+    shortest ones first, then apply the remaining checks.
+    """
+
+    def __init__(self, records=()):
+        self.records = []
+        self._tags = {}
+        self._pids = {}
+        self._levels = {}
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def _post(index, key, position):
+        positions = index.get(key)
+        if positions is None:
+            positions = index[key] = array.array('L')
+        positions.append(position)
+
+    def add(self, record):
+        position = len(self.records)
+        self.records.append(record)
+        self._post(self._tags, record.tag, position)
+        self._post(self._pids, record.pid, position)
+        self._post(self._levels, record.level, position)
+
+    def tags(self):
+        """
+        Returns {tag: number of records}
+        """
+        return dict((tag, len(positions))
+                    for tag, positions in self._tags.items())
+
+    def pids(self):
+        """
+        Returns {pid: number of records}
+        """
+        return dict((pid, len(positions))
+                    for pid, positions in self._pids.items())
+
+    def query(self, tag=None, pid=None, level=None, since=None, until=None,
+              where=None):
+        """
+        Returns the records matching every given criterion, in order.
+        level is the minimum level ("W" returns W, E and F records),
+        since/until bound the time, where is a callable such as a
+        LogFilter.
+        """
+        postings = []
+        if tag is not None:
+            postings.append(self._tags.get(tag, ()))
+        if pid is not None:
+            postings.append(self._pids.get(pid, ()))
+        if level is not None:
+            minimum = PRIORITIES.get(level.upper())
+            if minimum is None:
+                raise ADB.BadCall("Unknown level %s" % level)
+            levels = [positions for key, positions in self._levels.items()
+                      if PRIORITIES.get(key, 0) >= minimum]
+            postings.append(sorted(
+                    position for positions in levels
+                    for position in positions))
+
+        if postings:
+            postings.sort(key=len)
+            positions = postings[0]
+            for other in postings[1:]:
+                other = set(other)
+                positions = [position for position in positions
+                             if position in other]
+        else:
+            positions = range(len(self.records))
+
+        records = self.records
+        result = []
+        for position in positions:
+            record = records[position]
+            if since is not None and record.time < since:
+                continue
+            if until is not None and record.time > until:
+                continue
+            if where is not None and not where(record):
+                continue
+            result.append(record)
+        return result
+
+
+class LogcatStream(object):
+    """
+    Iterator over the lines of a running logcat.
+
+    with LogcatStream(adb, "-v threadtime", history=1000) as log:
+        for line in log:
+            ...
+        last_lines = log.recent()
+
+    lcfilter is passed to logcat as in ADB.get_logcat. When dump is True
+    logcat exits after printing the current log (logcat -d). history keeps
+    the last N lines in a ring buffer available through recent().
+
+    records() yields LogRecord objects instead of lines. With binary the
+    log is read in the "logcat -B" format through exec-out (no text
+    parsing at all) and only records() can be used.
+    """
+
+    # longest line returned at once, longer lines are split
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, adb, lcfilter="", dump=False, history=0,
+                 binary=False):
+        self._adb = adb
+        self._args = ['logcat']
+        if dump:
+            self._args.append('-d')
+        if lcfilter:
+            self._args += lcfilter.split()
+        self.binary = binary
+        if binary:
+            # the binary format does not survive a pty
+            self._args = ['exec-out', " ".join(self._args + ['-B'])]
+        self._history = collections.deque(maxlen=history) if history else None
+        self._stream = None
+        self.lines_read = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        if self._stream is None:
+            self._stream = self._adb.open_cmd(self._args)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __iter__(self):
+        if self.binary:
+            raise ADB.BadCall("Binary LogcatStream only provides records()")
+        self.open()
+        while self._stream is not None:
+            line = self._stream.readline(self.MAX_LINE)
+            if not line:
+                break
+            line = line.rstrip(b"\r\n").decode('utf-8', 'replace')
+            self.lines_read += 1
+            if self._history is not None:
+                self._history.append(line)
+            yield line
+
+    def recent(self):
+        """
+        Returns the last lines read (up to history)
+        """
+        if self._history is None:
+            raise ADB.BadCall("LogcatStream created without history")
+        return list(self._history)
+
+    def records(self, where=None):
+        """
+        Yields the LogRecord of each entry, only those for which
+        where(record) is true if given (see LogFilter)
+        """
+        if self.binary:
+            self.open()
+            records = parse_binary(self._stream)
+        else:
+            records = parse_threadtime(self)
+        for record in records:
+            if self.binary:
+                self.lines_read += 1
+            if where is None or where(record):
+                yield record
@@ -0,0 +1,278 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Per-command instrumentation.
+
+Every command run through ADB.run_cmd_c/open_cmd_c produces a
+CommandRecord (wall time, spawn/connect time, bytes, exit status, error
+class, device serial and the ADB method that issued it) which is handed
+to the hooks registered on ADB.instrumentation:
+
+    summary = HistogramSummary()
+    ADB.instrumentation.add_hook(summary)
+    ADB.instrumentation.add_hook(StatsdHook("127.0.0.1", 8125))
+    ...
+    print(summary.summary())
+    print(summary.prometheus())
+
+When no hook is registered nothing is recorded.
+"""
+
+import bisect
+import socket
+import sys
+import threading
+import time
+
+
+class CommandRecord(object):
+    """
+    Measurements of one command
+    """
+
+    __slots__ = ("method", "command", "serial", "backend", "started",
+                 "wall_time", "spawn_time", "bytes_in", "bytes_out",
+                 "exit_status", "error")
+
+    def __init__(self, method, command, serial, backend=None):
+        self.method = method
+        self.command = command
+        self.serial = serial
+        self.backend = backend
+        self.started = time.time()
+        self.wall_time = None
+        self.spawn_time = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.exit_status = None
+        self.error = None
+
+    def __repr__(self):
+        return "CommandRecord(%r, serial=%r, wall_time=%r, error=%r)" % (
+                self.method, self.serial, self.wall_time, self.error)
+
+
+class Instrumentation(object):
+    """
+    Registry of hooks called with each finished CommandRecord
+    """
+
+    # frames skipped when looking for the ADB method issuing a command
+    INTERNAL = frozenset(("run_cmd", "run_cmd_c", "_run_cmd_c", "open_cmd",
+                          "open_cmd_c", "_output_if_no_error"))
+
+    def __init__(self):
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self._hooks)
+
+    def add_hook(self, hook):
+        """
+        hook is called as hook(record) from the thread that ran the command
+        """
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def start(self, cmd, serial, backend=None):
+        """
+        Returns a new CommandRecord, or None when there are no hooks
+        """
+        if not self._hooks:
+            return None
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_name in self.INTERNAL:
+            frame = frame.f_back
+        method = frame.f_code.co_name if frame is not None else None
+        command = cmd if isinstance(cmd, list) else [cmd]
+        return CommandRecord(method, command, serial, backend)
+
+    def finish(self, record, error=None):
+        if record is None:
+            return
+        record.wall_time = time.time() - record.started
+        if error is not None:
+            record.error = type(error).__name__
+        for hook in self._hooks:
+            try:
+                hook(record)
+            except Exception:
+                # never let a metrics exporter break a command
+                pass
+
+
+class Histogram(object):
+    """
+    Cumulative bucket histogram, Prometheus style
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """
+        Upper bound of the bucket holding the given quantile
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                return self.max
+        return self.max
+
+
+def _label_value(value):
+    """
+    Escapes a Prometheus label value
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+            "\n", "\\n")
+
+
+class HistogramSummary(object):
+    """
+    Hook aggregating wall time histograms, error and byte counters per
+    (method, serial)
+    """
+
+    def __init__(self, buckets=Histogram.DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def __call__(self, record):
+        key = (record.method, record.serial)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "histogram": Histogram(self._buckets),
+                    "errors": 0, "bytes_in": 0, "bytes_out": 0,
+                    }
+            series["histogram"].observe(record.wall_time)
+            series["bytes_in"] += record.bytes_in
+            series["bytes_out"] += record.bytes_out
+            if record.error is not None:
+                series["errors"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def summary(self):
+        """
+        Returns {(method, serial): {count, errors, mean, p50, p95, p99,
+        max, bytes_in, bytes_out}}, times in seconds
+        """
+        result = {}
+        with self._lock:
+            for key, series in self._series.items():
+                histogram = series["histogram"]
+                result[key] = {
+                    "count": histogram.count,
+                    "errors": series["errors"],
+                    "mean": histogram.total / histogram.count,
+                    "p50": histogram.quantile(0.50),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                    "max": histogram.max,
+                    "bytes_in": series["bytes_in"],
+                    "bytes_out": series["bytes_out"],
+                    }
+        return result
+
+    def prometheus(self, name="pyadb_command"):
+        """
+        Returns the series in the Prometheus text exposition format
+        """
+        seconds = ["# TYPE %s_seconds histogram" % name]
+        counters = dict(
+                (counter, ["# TYPE %s_%s_total counter" % (name, counter)])
+                for counter in ("errors", "bytes_in", "bytes_out"))
+        with self._lock:
+            items = sorted(self._series.items(),
+                           key=lambda item: tuple(str(k) for k in item[0]))
+            for (method, serial), series in items:
+                labels = 'method="%s",serial="%s"' % (
+                        _label_value(method), _label_value(serial or ""))
+                histogram = series["histogram"]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",),
+                                        histogram.counts):
+                    cumulative += count
+                    seconds.append('%s_seconds_bucket{%s,le="%s"} %d' % (
+                            name, labels, bound, cumulative))
+                seconds.append("%s_seconds_sum{%s} %f" % (
+                        name, labels, histogram.total))
+                seconds.append("%s_seconds_count{%s} %d" % (
+                        name, labels, histogram.count))
+                for counter, lines in counters.items():
+                    lines.append("%s_%s_total{%s} %d" % (
+                            name, counter, labels, series[counter]))
+        lines = seconds
+        for counter in sorted(counters):
+            lines += counters[counter]
+        return "\n".join(lines) + "\n"
+
+
+class StatsdHook(object):
+    """
+    Hook sending each record to a StatsD server over UDP:
+
+    <prefix>.<method>.time:<ms>|ms
+    <prefix>.<method>.errors:1|c (on error)
+    <prefix>.<method>.bytes_in:<n>|c
+
+    With tags=True the serial is sent as a DogStatsD tag.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="pyadb",
+                 tags=False):
+        self._address = (host, port)
+        self._prefix = prefix
+        self._tags = tags
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, record):
+        name = "%s.%s" % (self._prefix, record.method)
+        suffix = ""
+        if self._tags and record.serial:
+            suffix = "|#serial:%s" % record.serial
+        metrics = ["%s.time:%d|ms%s" % (name, record.wall_time * 1000,
+                                        suffix),
+                   "%s.bytes_in:%d|c%s" % (name, record.bytes_in, suffix)]
+        if record.error is not None:
+            metrics.append("%s.errors:1|c%s" % (name, suffix))
+        try:
+            self._sock.sendto("\n".join(metrics).encode('utf-8'),
+                              self._address)
+        except socket.error:
+            pass
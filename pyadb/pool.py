@@ -0,0 +1,378 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Pool of devices attached over TCP/IP ("adb connect host:port").
+
+Network devices drop off the adb server whenever the network hiccups. A
+DevicePool keeps a list of endpoints, checks them periodically from a
+background thread and reconnects the ones that went away, waiting an
+exponentially growing, jittered delay between attempts so a few hundred
+devices lost at once do not all reconnect at the same moment.
+
+    pool = DevicePool(check_interval=15)
+    pool.add("192.168.1.20")
+    pool.add("192.168.1.21", 5556)
+    with pool:
+        adb = pool.get("192.168.1.20:5555")   # only if healthy
+        pool.call("192.168.1.21:5556", "shell_command", "id")
+        for result in pool.map("get_serialno"):
+            print(result)
+"""
+
+import random
+import threading
+import time
+from concurrent import futures
+
+from .adb import ADB, Deadline
+from .fanout import FanOut, device_adb
+
+
+class Endpoint(object):
+    """
+    A network device of the pool and what is known about its health
+    """
+
+    UNKNOWN = "unknown"
+    HEALTHY = "healthy"
+    UNHEALTHY = "unhealthy"
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.serial = "%s:%d" % (host, port)
+        self.state = self.UNKNOWN
+        self.failures = 0
+        self.next_check = 0.0
+        self.last_check = None
+        self.last_error = None
+        self.checking = False
+
+    def __repr__(self):
+        return "Endpoint(%r, state=%r, failures=%d)" % (
+                self.serial, self.state, self.failures)
+
+    @property
+    def healthy(self):
+        return self.state == self.HEALTHY
+
+
+def get_state_check(adb):
+    """
+    Default health check: the adb server sees the device online
+    """
+    output = adb.get_state()
+    return bool(output) and output[0] == "device"
+
+
+class DevicePool(object):
+    """
+    Keeps network devices connected and routes calls to the healthy ones.
+
+    Every check_interval seconds each healthy endpoint is checked with
+    health_check(adb) (by default "adb get-state", answered by the adb
+    server without reaching the device). An endpoint failing its check,
+    or reported with report_failure(), becomes unhealthy and is
+    reconnected after backoff_base * 2 ** (failures - 1) seconds, capped
+    at backoff_max and shortened by up to jitter (a fraction) at random.
+    At most max_reconnects reconnections run at the same time, and a
+    check (with its reconnection) taking more than check_timeout seconds
+    is killed and counts as a failure.
+
+    Callbacks get (serial, old_state, new_state) and run on the worker
+    threads.
+    """
+
+    def __init__(self, check_interval=10.0, backoff_base=1.0,
+                 backoff_max=60.0, jitter=0.5, health_check=get_state_check,
+                 max_workers=16, max_reconnects=8, check_timeout=10.0,
+                 adb_class=ADB):
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.health_check = health_check
+        self.max_workers = max_workers
+        self.max_reconnects = max_reconnects
+        self._adb_class = adb_class
+        self._endpoints = {}
+        self._callbacks = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add(self, host, port=ADB.DEFAULT_TCP_PORT):
+        """
+        Adds a device to the pool, it is connected on the next check.
+        Returns its serial (host:port).
+        """
+        endpoint = Endpoint(host, int(port))
+        with self._lock:
+            self._endpoints.setdefault(endpoint.serial, endpoint)
+        self._wakeup.set()
+        return endpoint.serial
+
+    def remove(self, serial, disconnect=True):
+        """
+        Removes a device from the pool, disconnecting it from the adb
+        server unless disconnect is False
+        """
+        with self._lock:
+            endpoint = self._endpoints.pop(serial, None)
+        if endpoint is not None and disconnect:
+            try:
+                device_adb(None, self._adb_class).disconnect_remote(
+                        endpoint.host, endpoint.port)
+            except ADB.AdbException as err:
+                ADB.LOGGER.warning("Cannot disconnect %s: %s", serial, err)
+
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def endpoints(self):
+        """
+        Returns the list of Endpoint objects
+        """
+        with self._lock:
+            return list(self._endpoints.values())
+
+    def healthy(self):
+        """
+        Returns the serials of the healthy devices
+        """
+        with self._lock:
+            return [serial for serial, endpoint in self._endpoints.items()
+                    if endpoint.healthy]
+
+    def state(self, serial):
+        with self._lock:
+            endpoint = self._endpoints.get(serial)
+        return endpoint.state if endpoint is not None else None
+
+    def get(self, serial):
+        """
+        Returns an ADB object targeting serial, raises ADB.InternalError
+        if the device is not healthy
+        """
+        with self._lock:
+            endpoint = self._endpoints.get(serial)
+        if endpoint is None:
+            raise ADB.BadCall("Device %s is not in the pool" % serial)
+        if not endpoint.healthy:
+            raise ADB.InternalError("Device %s is %s" % (serial,
+                                                         endpoint.state))
+        return device_adb(serial, self._adb_class)
+
+    def pick(self):
+        """
+        Returns an ADB object targeting a healthy device, round robin
+        """
+        serials = sorted(self.healthy())
+        if not serials:
+            raise ADB.InternalError("No healthy device in the pool")
+        with self._lock:
+            self._next = (self._next + 1) % len(serials)
+            serial = serials[self._next]
+        return device_adb(serial, self._adb_class)
+
+    def call(self, serial, operation, *args, **kwargs):
+        """
+        Runs operation (an ADB method name or a callable called as
+        operation(adb, *args, **kwargs)) on a healthy device. On
+        ADB.InternalError the device is reported as failed.
+        """
+        adb = self.get(serial)
+        try:
+            if callable(operation):
+                return operation(adb, *args, **kwargs)
+            return getattr(adb, operation)(*args, **kwargs)
+        except ADB.InternalError as err:
+            self.report_failure(serial, err)
+            raise
+
+    def map(self, operation, *args, **kwargs):
+        """
+        Runs operation on every healthy device in parallel, yielding a
+        pyadb.fanout.DeviceResult per device
+        """
+        fanout = FanOut(max_workers=self.max_workers,
+                        adb_class=self._adb_class)
+        for result in fanout.run(self.healthy(), operation, *args, **kwargs):
+            if isinstance(result.error, ADB.InternalError):
+                self.report_failure(result.serial, result.error)
+            yield result
+
+    def report_failure(self, serial, error=None):
+        """
+        Marks a device as unhealthy, it is reconnected with backoff
+        """
+        with self._lock:
+            endpoint = self._endpoints.get(serial)
+            if endpoint is None or not endpoint.healthy:
+                return
+        self._set_state(endpoint, Endpoint.UNHEALTHY, error)
+        self._wakeup.set()
+
+    def backoff(self, failures):
+        """
+        Returns the jittered delay before reconnect attempt number
+        failures
+        """
+        delay = min(self.backoff_max,
+                    self.backoff_base * 2 ** max(0, failures - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def start(self):
+        """
+        Starts checking the devices in a background thread
+        """
+        if self.is_running:
+            return
+        self._stop.clear()
+        self._executor = futures.ThreadPoolExecutor(
+                max_workers=self.max_workers)
+        self._thread = threading.Thread(target=self._run,
+                                        name="pyadb-device-pool")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def check(self, force=False):
+        """
+        Checks (and reconnects) the endpoints that are due, or all of them
+        when force is True, and waits for the results. Returns the list of
+        serials checked.
+        """
+        executor = self._executor
+        if executor is None:
+            with futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers) as executor:
+                return self._check(executor, force)
+        return self._check(executor, force)
+
+    def _check(self, executor, force, wait=True):
+        now = time.time()
+        due = []
+        reconnects = 0
+        with self._lock:
+            for endpoint in sorted(self._endpoints.values(),
+                                   key=lambda endpoint: endpoint.next_check):
+                if endpoint.checking:
+                    continue
+                if not force and endpoint.next_check > now:
+                    continue
+                if not endpoint.healthy:
+                    if reconnects >= self.max_reconnects:
+                        continue
+                    reconnects += 1
+                endpoint.checking = True
+                # not due again before the check is over
+                endpoint.next_check = now + (
+                        self.check_timeout or self.check_interval)
+                due.append(endpoint)
+        submitted = [executor.submit(self._probe, endpoint)
+                     for endpoint in due]
+        if wait:
+            futures.wait(submitted)
+        return [endpoint.serial for endpoint in due]
+
+    def _probe(self, endpoint):
+        try:
+            with Deadline(self.check_timeout):
+                if not endpoint.healthy:
+                    self._connect(endpoint)
+                if not self.health_check(device_adb(endpoint.serial,
+                                                    self._adb_class)):
+                    raise ADB.InternalError("Device %s is not online"
+                                            % endpoint.serial)
+        except Exception as err:
+            self._set_state(endpoint, Endpoint.UNHEALTHY, err)
+        else:
+            self._set_state(endpoint, Endpoint.HEALTHY)
+        finally:
+            endpoint.checking = False
+
+    def _connect(self, endpoint):
+        output = device_adb(None, self._adb_class).connect_remote(
+                endpoint.host, endpoint.port)
+        message = " ".join(output or [])
+        if "connected to" not in message:
+            raise ADB.InternalError("Cannot connect to %s: %s" % (
+                    endpoint.serial, message or "no answer"))
+
+    def _set_state(self, endpoint, state, error=None):
+        now = time.time()
+        with self._lock:
+            old = endpoint.state
+            endpoint.state = state
+            endpoint.last_check = now
+            endpoint.last_error = error
+            if state == Endpoint.HEALTHY:
+                endpoint.failures = 0
+                # spread the checks of devices added together
+                endpoint.next_check = now + self.check_interval * (
+                        0.9 + 0.2 * random.random())
+            else:
+                endpoint.failures += 1
+                endpoint.next_check = now + self.backoff(endpoint.failures)
+            callbacks = list(self._callbacks)
+
+        if error is not None:
+            ADB.LOGGER.info("Device %s %s: %s", endpoint.serial, state, error)
+        if old == state:
+            return
+        for callback in callbacks:
+            try:
+                callback(endpoint.serial, old, state)
+            except Exception:
+                ADB.LOGGER.exception("Device pool callback failed")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                # a slow device must not hold back the checks of the others
+                self._check(self._executor, False, wait=False)
+            except Exception:
+                ADB.LOGGER.exception("Device pool check failed")
+            with self._lock:
+                pending = [endpoint.next_check
+                           for endpoint in self._endpoints.values()]
+            delay = min(pending) - time.time() if pending else \
+                self.check_interval
+            self._wakeup.wait(max(0.05, min(delay, self.check_interval)))
@@ -0,0 +1,427 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Admission control for the commands of ADB.run_cmd_c/open_cmd_c.
+
+Once a Scheduler is set, every command waits for a slot before it
+starts. Slots are limited per device and per host (the machine or USB
+hub the device hangs from), and a device always keeps slots only
+interactive commands can use, so a bulk pull or bug report never delays
+a health check behind it:
+
+    scheduler = Scheduler(max_per_device=2, max_per_host=8)
+    ADB.set_scheduler(scheduler)
+
+    with scheduler.context(INTERACTIVE, timeout=2.0):
+        adb.get_state()      # dropped with ADB.Timeout if still queued
+                             # after 2 seconds
+
+    scheduler.stats()        # queue depth, waits, drops per priority
+
+Commands get the priority of classify(cmd) (pull/push/install/bugreport
+are BULK, get-state/version/... INTERACTIVE, the rest NORMAL; shell and
+exec-out commands by the programs they run, so tar or bugreportz are BULK
+and logcat never takes a slot) unless a context() says otherwise. Waiting commands are served by priority and,
+within a priority, round robin across callers (the thread name, or the
+caller given to context()), so one busy caller cannot monopolize a
+device.
+"""
+
+import collections
+import contextlib
+import posixpath
+import re
+import threading
+import time
+
+from .adb import ADB, Deadline
+from .metrics import Histogram
+
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal",
+                  BULK: "bulk"}
+
+BULK_COMMANDS = frozenset([
+    "pull", "push", "install", "install-multiple", "uninstall", "bugreport",
+    "backup", "restore", "sync", "exec-in", "sideload",
+    ])
+INTERACTIVE_COMMANDS = frozenset([
+    "version", "devices", "get-state", "get-serialno", "get-devpath",
+    "connect", "disconnect",
+    ])
+# commands that may run for ever, they never take a slot
+UNSCHEDULED_COMMANDS = frozenset(["logcat", "wait-for-device", "jdwp",
+                                  "start-server", "kill-server"])
+
+# programs run by "shell" or "exec-out"
+SHELL_COMMANDS = frozenset(["shell", "exec-out"])
+SHELL_BULK_COMMANDS = frozenset(["bugreport", "bugreportz", "tar", "dd",
+                                 "screenrecord"])
+SHELL_UNSCHEDULED_COMMANDS = frozenset(["logcat"])
+
+_SHELL_SEPARATOR = re.compile(r"&&|\|\||[;|&\n]")
+
+
+def _classify_shell(line):
+    priority = NORMAL
+    for part in _SHELL_SEPARATOR.split(line):
+        words = part.split()
+        if not words:
+            continue
+        name = posixpath.basename(words[0].strip("'\"("))
+        if name in SHELL_UNSCHEDULED_COMMANDS:
+            return None
+        if name in SHELL_BULK_COMMANDS:
+            priority = BULK
+    return priority
+
+
+def classify(cmd):
+    """
+    Returns the priority of a command line, None if it is not scheduled
+    """
+    args = cmd.split() if not isinstance(cmd, list) else cmd
+    name = str(args[0]) if args else ""
+    if name in SHELL_COMMANDS and len(args) > 1:
+        return _classify_shell(" ".join(str(arg) for arg in args[1:]))
+    if name in UNSCHEDULED_COMMANDS:
+        return None
+    if name in BULK_COMMANDS:
+        return BULK
+    if name in INTERACTIVE_COMMANDS:
+        return INTERACTIVE
+    return NORMAL
+
+
+def default_host(serial):
+    """
+    Host of a device: the address of a network device ("10.0.0.5:5555"),
+    "local" for the others
+    """
+    if serial is None:
+        return None
+    host, sep, port = serial.rpartition(":")
+    if sep and port.isdigit():
+        return host
+    return "local"
+
+
+class Ticket(object):
+    """
+    A command waiting for, or holding, a slot
+    """
+
+    __slots__ = ("command", "priority", "caller", "serial", "host",
+                 "deadline", "enqueued", "started", "released")
+
+    def __init__(self, command, priority, caller, serial, host, deadline):
+        self.command = command
+        self.priority = priority
+        self.caller = caller
+        self.serial = serial
+        self.host = host
+        self.deadline = deadline
+        self.enqueued = time.time()
+        self.started = None
+        self.released = False
+
+    def __repr__(self):
+        return "Ticket(%r, %s, serial=%r, caller=%r)" % (
+                self.command, PRIORITY_NAMES[self.priority], self.serial,
+                self.caller)
+
+
+class Scheduler(object):
+    """
+    Priority queues with per-device and per-host concurrency limits.
+
+    A device runs up to max_per_device commands at once, of which
+    reserved_interactive are kept for INTERACTIVE commands and at most
+    max_bulk_per_device are BULK. A host (see default_host, or the given
+    host_of(serial) callable) runs up to max_per_host commands. Commands
+    without a target device are not limited.
+
+    A command still queued at its deadline is dropped with ADB.Timeout
+    rather than run late.
+    """
+
+    def __init__(self, max_per_device=2, reserved_interactive=1,
+                 max_bulk_per_device=1, max_per_host=8, host_of=default_host,
+                 classify=classify, buckets=Histogram.DEFAULT_BUCKETS):
+        self.max_per_device = max_per_device
+        self.reserved_interactive = min(reserved_interactive,
+                                        max_per_device - 1)
+        self.max_bulk_per_device = max_bulk_per_device
+        self.max_per_host = max_per_host
+        self.host_of = host_of
+        self.classify = classify
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        # per priority: caller -> deque of tickets, in round robin order
+        self._queues = dict((priority, collections.OrderedDict())
+                            for priority in PRIORITY_NAMES)
+        self._devices = collections.Counter()
+        self._bulk = collections.Counter()
+        self._hosts = collections.Counter()
+        self._running = collections.Counter()
+        self._granted = collections.Counter()
+        self._dropped = collections.Counter()
+        self._waits = dict((priority, Histogram(buckets))
+                           for priority in PRIORITY_NAMES)
+
+    @contextlib.contextmanager
+    def context(self, priority=None, timeout=None, deadline=None,
+                caller=None):
+        """
+        Commands of this thread inside the block run with the given
+        priority (instead of their classification), are dropped if not
+        started within timeout seconds (or by the absolute deadline), and
+        are queued as caller
+        """
+        previous = getattr(self._local, "context", None)
+        self._local.context = (priority, timeout, deadline, caller)
+        try:
+            yield self
+        finally:
+            self._local.context = previous
+
+    def _allowed(self, ticket):
+        if ticket.serial is not None:
+            limit = self.max_per_device
+            if ticket.priority != INTERACTIVE:
+                limit -= self.reserved_interactive
+            if self._devices[ticket.serial] >= limit:
+                return False
+            if ticket.priority == BULK and \
+                    self._bulk[ticket.serial] >= self.max_bulk_per_device:
+                return False
+        if ticket.host is not None and \
+                self._hosts[ticket.host] >= self.max_per_host:
+            return False
+        return True
+
+    def _dispatch(self):
+        """
+        Starts the queued tickets that fit, by priority and round robin
+        across callers. Called with the lock held.
+        """
+        now = time.time()
+        granted = False
+        progress = True
+        while progress:
+            progress = False
+            for priority in sorted(self._queues):
+                queues = self._queues[priority]
+                for caller in list(queues):
+                    tickets = queues[caller]
+                    ticket = tickets[0]
+                    if ticket.deadline is not None and \
+                            ticket.deadline <= now:
+                        # stale, its waiter drops it
+                        continue
+                    if not self._allowed(ticket):
+                        continue
+                    tickets.popleft()
+                    if tickets:
+                        # served, to the back of the round
+                        queues[caller] = queues.pop(caller)
+                    else:
+                        del queues[caller]
+                    self._start(ticket, now)
+                    granted = progress = True
+        if granted:
+            self._cond.notify_all()
+
+    def _start(self, ticket, now):
+        ticket.started = now
+        if ticket.serial is not None:
+            self._devices[ticket.serial] += 1
+            if ticket.priority == BULK:
+                self._bulk[ticket.serial] += 1
+        if ticket.host is not None:
+            self._hosts[ticket.host] += 1
+        self._running[ticket.priority] += 1
+        self._granted[ticket.priority] += 1
+        self._waits[ticket.priority].observe(now - ticket.enqueued)
+
+    def _remove(self, ticket):
+        queues = self._queues[ticket.priority]
+        tickets = queues.get(ticket.caller)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queues[ticket.caller]
+
+    def acquire(self, cmd, target=None):
+        """
+        Waits for a slot for cmd on target, returns its Ticket (None when
+        the command is not scheduled). Raises ADB.Timeout when the
+        deadline passes first.
+        """
+        priority, timeout, deadline, caller = getattr(
+                self._local, "context", None) or (None, None, None, None)
+        if priority is None:
+            priority = self.classify(cmd)
+            if priority is None:
+                return None
+        if timeout is not None:
+            timeout_deadline = time.time() + timeout
+            deadline = timeout_deadline if deadline is None else min(
+                    deadline, timeout_deadline)
+        current = Deadline.current()
+        if current is not None:
+            current.check("Waiting for %s" % (target or "a slot"))
+            remaining = current.remaining()
+            if remaining is not None:
+                deadline = time.time() + remaining if deadline is None \
+                    else min(deadline, time.time() + remaining)
+        if caller is None:
+            caller = threading.current_thread().name
+        ticket = Ticket(cmd, priority, caller, target, self.host_of(target),
+                        deadline)
+
+        unwatch = None
+        if current is not None:
+            # wakes the waiters when the deadline is cancelled
+            unwatch = current.on_expiry(self._wake)
+        try:
+            return self._wait(ticket, current)
+        finally:
+            if unwatch is not None:
+                unwatch()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _wait(self, ticket, current):
+        cmd, target, priority, caller, deadline = (
+                ticket.command, ticket.serial, ticket.priority, ticket.caller,
+                ticket.deadline)
+        with self._cond:
+            self._queues[priority].setdefault(caller,
+                                              collections.deque()).append(
+                                                  ticket)
+            self._dispatch()
+            while ticket.started is None:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._remove(ticket)
+                        self._dropped[priority] += 1
+                        raise ADB.Timeout(
+                                "%s dropped after waiting %.3fs for %s"
+                                % (cmd, time.time() - ticket.enqueued,
+                                   target or "a slot"))
+                if current is not None and current.is_cancelled:
+                    self._remove(ticket)
+                    self._dropped[priority] += 1
+                    raise current.exception("Waiting for %s"
+                                            % (target or "a slot"))
+                self._cond.wait(remaining)
+        return ticket
+
+    def release(self, ticket):
+        """
+        Gives back the slot of a Ticket returned by acquire()
+        """
+        if ticket is None:
+            return
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.serial is not None:
+                self._devices[ticket.serial] -= 1
+                if ticket.priority == BULK:
+                    self._bulk[ticket.serial] -= 1
+            if ticket.host is not None:
+                self._hosts[ticket.host] -= 1
+            self._running[ticket.priority] -= 1
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, cmd, target=None):
+        """
+        Holds a slot for cmd on target for the duration of the block
+        """
+        ticket = self.acquire(cmd, target)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def queue_depth(self):
+        """
+        Returns {priority name: number of commands waiting}
+        """
+        with self._cond:
+            return dict((PRIORITY_NAMES[priority],
+                         sum(len(tickets) for tickets in queues.values()))
+                        for priority, queues in self._queues.items())
+
+    def stats(self):
+        """
+        Returns {priority name: {queued, running, granted, dropped,
+        wait_mean, wait_p50, wait_p95, wait_p99, wait_max}}, times in
+        seconds
+        """
+        depth = self.queue_depth()
+        result = {}
+        with self._cond:
+            for priority, name in PRIORITY_NAMES.items():
+                waits = self._waits[priority]
+                result[name] = {
+                    "queued": depth[name],
+                    "running": self._running[priority],
+                    "granted": self._granted[priority],
+                    "dropped": self._dropped[priority],
+                    "wait_mean": (waits.total / waits.count
+                                  if waits.count else None),
+                    "wait_p50": waits.quantile(0.50),
+                    "wait_p95": waits.quantile(0.95),
+                    "wait_p99": waits.quantile(0.99),
+                    "wait_max": waits.max,
+                    }
+        return result
+
+    def prometheus(self, name="pyadb_scheduler"):
+        """
+        Returns the queue metrics in the Prometheus text exposition format
+        """
+        depth = self.queue_depth()
+        lines = ["# TYPE %s_queued gauge" % name]
+        lines += ['%s_queued{priority="%s"} %d' % (name, priority, count)
+                  for priority, count in sorted(depth.items())]
+        with self._cond:
+            for metric, counter, kind in (
+                    ("running", self._running, "gauge"),
+                    ("granted_total", self._granted, "counter"),
+                    ("dropped_total", self._dropped, "counter")):
+                lines.append("# TYPE %s_%s %s" % (name, metric, kind))
+                for priority, label in sorted(PRIORITY_NAMES.items()):
+                    lines.append('%s_%s{priority="%s"} %d' % (
+                            name, metric, label, counter[priority]))
+            lines.append("# TYPE %s_wait_seconds histogram" % name)
+            for priority, label in sorted(PRIORITY_NAMES.items()):
+                waits = self._waits[priority]
+                cumulative = 0
+                for bound, count in zip(waits.buckets + ("+Inf",),
+                                        waits.counts):
+                    cumulative += count
+                    lines.append('%s_wait_seconds_bucket{priority="%s",'
+                                 'le="%s"} %d' % (name, label, bound,
+                                                  cumulative))
+                lines.append('%s_wait_seconds_sum{priority="%s"} %f' % (
+                        name, label, waits.total))
+                lines.append('%s_wait_seconds_count{priority="%s"} %d' % (
+                        name, label, waits.count))
+        return "\n".join(lines) + "\n"
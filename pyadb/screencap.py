@@ -0,0 +1,320 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Screen captures read into reusable buffers.
+
+"adb exec-out screencap" writes the frame without going through a pty
+(so binary data survives). Without -p the output is raw pixels after a
+little-endian header:
+
+    width, height, format (uint32 each) [, colorspace (uint32, Android 8+)]
+
+and with -p a PNG file. Frames are read straight into preallocated
+bytearrays with readinto() and handed out as memoryviews, so capturing
+does not allocate a new multi-megabyte object per frame:
+
+    capture = ScreenCapture(adb)
+    frame = capture.capture()
+    pixels = frame.array()              # height x width x bytes per pixel
+    image = numpy.asarray(pixels)       # no copy
+
+    for frame in capture.frames(fps=5, max_frames=100):
+        ...
+    capture.stats()
+"""
+
+import struct
+import threading
+import time
+
+from .adb import ADB
+
+
+# android PixelFormat values and their bytes per pixel
+RGBA_8888 = 1
+RGBX_8888 = 2
+RGB_888 = 3
+RGB_565 = 4
+BGRA_8888 = 5
+PNG = "png"
+
+BYTES_PER_PIXEL = {RGBA_8888: 4, RGBX_8888: 4, RGB_888: 3, RGB_565: 2,
+                   BGRA_8888: 4}
+
+_RAW_HEADER = struct.Struct("<III")
+_COLORSPACE = struct.Struct("<I")
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_SIZE = struct.Struct(">II")
+# first guess for the size of a PNG frame, grown as needed
+_PNG_BUFFER_SIZE = 1024 * 1024
+
+
+class Frame(object):
+    """
+    A captured frame. data is a memoryview on the pixels (or on the PNG
+    file when format is PNG) inside a buffer of the ScreenCapture, it is
+    overwritten once the buffer is reused: copy it (bytes(frame.data))
+    to keep it longer.
+    """
+
+    __slots__ = ("width", "height", "format", "colorspace", "data", "time",
+                 "sequence")
+
+    def __init__(self, width, height, format, colorspace, data, time,
+                 sequence):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.colorspace = colorspace
+        self.data = data
+        self.time = time
+        self.sequence = sequence
+
+    def __repr__(self):
+        return "Frame(%dx%d, format=%r, %d bytes)" % (
+                self.width, self.height, self.format, len(self.data))
+
+    @property
+    def bytes_per_pixel(self):
+        return BYTES_PER_PIXEL.get(self.format)
+
+    def array(self):
+        """
+        Returns the pixels as a height x width x bytes per pixel
+        memoryview, usable by numpy.asarray() without copying
+        """
+        if self.format == PNG:
+            raise ADB.BadCall("PNG frames have no pixel array")
+        return self.data.cast('B', (self.height, self.width,
+                                    self.bytes_per_pixel))
+
+
+def _read_into(stream, view):
+    """
+    Reads into view until it is full or the stream ends, returns the
+    number of bytes read
+    """
+    total = 0
+    while total < len(view):
+        count = stream.readinto(view[total:])
+        if not count:
+            break
+        total += count
+    return total
+
+
+class ScreenCapture(object):
+    """
+    Captures the screen of the target device of adb into a ring of
+    buffers buffers (at least 3 for frames()). A frame stays valid until
+    buffers - 1 more frames are captured.
+
+    png selects "screencap -p" (smaller transfers, slower on the device)
+    over raw pixels, display selects the display id (screencap -d).
+    """
+
+    def __init__(self, adb, png=False, display=None, buffers=3):
+        self._adb = adb
+        self.png = png
+        self._cmd = "screencap"
+        if png:
+            self._cmd += " -p"
+        if display is not None:
+            self._cmd += " -d %s" % display
+        self._buffers = [bytearray(0) for _ in range(max(buffers, 1))]
+        self._next = 0
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.started = None
+        self.capture_time = 0.0
+
+    def _buffer(self, index, size):
+        """
+        Returns buffer index, replaced by a new one when smaller than size.
+        A bytearray with views on it cannot be resized, so it is never
+        resized in place.
+        """
+        if len(self._buffers[index]) < size:
+            self._buffers[index] = bytearray(size)
+        return self._buffers[index]
+
+    def _read_raw(self, stream, index):
+        header = stream.read(_RAW_HEADER.size)
+        if len(header) < _RAW_HEADER.size:
+            raise ADB.InternalError("No frame from screencap: %s"
+                                    % (stream.error().strip() or
+                                       "empty output"))
+        width, height, pixel_format = _RAW_HEADER.unpack(header)
+        bpp = BYTES_PER_PIXEL.get(pixel_format)
+        if bpp is None:
+            raise ADB.InternalError("Unknown pixel format %d" % pixel_format)
+        size = width * height * bpp
+        # room for the colorspace word of Android 8+, read with the pixels
+        buf = self._buffer(index, size + _COLORSPACE.size)
+        view = memoryview(buf)[:size + _COLORSPACE.size]
+        count = _read_into(stream, view)
+        if stream.read(1):
+            raise ADB.InternalError("screencap sent more than a frame")
+        if count == size + _COLORSPACE.size:
+            colorspace = _COLORSPACE.unpack_from(view)[0]
+            data = view[_COLORSPACE.size:]
+        elif count == size:
+            colorspace = None
+            data = view[:size]
+        else:
+            raise ADB.InternalError("Truncated frame (%d of %d bytes)"
+                                    % (count, size))
+        return width, height, pixel_format, colorspace, data
+
+    def _read_png(self, stream, index):
+        buf = self._buffer(index, _PNG_BUFFER_SIZE)
+        count = _read_into(stream, memoryview(buf))
+        while count == len(buf):
+            # full, move to a bigger buffer
+            bigger = bytearray(len(buf) * 2)
+            bigger[:count] = buf
+            self._buffers[index] = buf = bigger
+            count += _read_into(stream, memoryview(buf)[count:])
+        data = memoryview(buf)[:count]
+        if data[:len(_PNG_SIGNATURE)] != _PNG_SIGNATURE or count < 24:
+            raise ADB.InternalError("No PNG from screencap: %s"
+                                    % (stream.error().strip() or
+                                       "bad output"))
+        # IHDR is the first chunk, width and height start at offset 16
+        width, height = _PNG_SIZE.unpack_from(data, 16)
+        return width, height, PNG, None, data
+
+    def _capture(self, index):
+        started = time.time()
+        with self._adb.open_cmd(['exec-out', self._cmd]) as stream:
+            if self.png:
+                fields = self._read_png(stream, index)
+            else:
+                fields = self._read_raw(stream, index)
+        now = time.time()
+        with self._lock:
+            self._sequence += 1
+            self.captured += 1
+            self.capture_time += now - started
+            if self.started is None:
+                self.started = started
+            sequence = self._sequence
+        return Frame(*(fields + (now, sequence)))
+
+    def _count(self, delivered=0, dropped=0):
+        with self._lock:
+            self.delivered += delivered
+            self.dropped += dropped
+
+    def capture(self):
+        """
+        Captures a frame into the next buffer of the ring
+        """
+        with self._lock:
+            index = self._next
+            self._next = (self._next + 1) % len(self._buffers)
+        frame = self._capture(index)
+        self._count(delivered=1)
+        return frame
+
+    def frames(self, fps=None, max_frames=None):
+        """
+        Yields frames captured continuously by a background thread, at
+        most fps per second when given. When the consumer is slower than
+        the capture only the newest frame is kept, the older ones are
+        dropped. A frame stays valid until the next one is requested.
+        """
+        if len(self._buffers) < 3:
+            raise ADB.BadCall("Continuous capture needs at least 3 buffers")
+        interval = 1.0 / fps if fps else 0.0
+        condition = threading.Condition()
+        state = {"latest": None, "error": None, "stop": False}
+        # buffers neither being filled, waiting nor held by the consumer
+        free = list(range(len(self._buffers)))
+
+        def run():
+            deadline = time.time()
+            while True:
+                with condition:
+                    while not free and not state["stop"]:
+                        condition.wait()
+                    if state["stop"]:
+                        return
+                    index = free.pop()
+                try:
+                    frame = self._capture(index)
+                except Exception as err:
+                    with condition:
+                        state["error"] = err
+                        condition.notify_all()
+                    return
+                with condition:
+                    if state["latest"] is not None:
+                        # never delivered, replaced by a newer frame
+                        self._count(dropped=1)
+                        free.append(state["latest"][0])
+                    state["latest"] = (index, frame)
+                    condition.notify_all()
+                deadline += interval
+                delay = deadline - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.time()
+
+        thread = threading.Thread(target=run, name="pyadb-screencap")
+        thread.daemon = True
+        thread.start()
+        held = None
+        count = 0
+        try:
+            while max_frames is None or count < max_frames:
+                with condition:
+                    if held is not None:
+                        free.append(held)
+                        held = None
+                        condition.notify_all()
+                    while state["latest"] is None and state["error"] is None:
+                        condition.wait()
+                    if state["latest"] is None:
+                        raise state["error"]
+                    held, frame = state["latest"]
+                    state["latest"] = None
+                self._count(delivered=1)
+                count += 1
+                yield frame
+        finally:
+            with condition:
+                state["stop"] = True
+                condition.notify_all()
+            thread.join()
+
+    def stats(self):
+        """
+        Returns the frame counters, the achieved frames per second
+        (delivered since the first capture) and the average capture time
+        """
+        with self._lock:
+            seconds = time.time() - self.started if self.started else 0.0
+            return {
+                "captured": self.captured,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "fps": self.delivered / seconds if seconds else 0.0,
+                "capture_time": (self.capture_time / self.captured
+                                 if self.captured else 0.0),
+                }
+
+
+def screencap(adb, png=False, display=None):
+    """
+    Captures a single frame (in its own buffer) of the target device of
+    adb
+    """
+    return ScreenCapture(adb, png, display, buffers=1).capture()
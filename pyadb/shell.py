@@ -0,0 +1,767 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Persistent shell sessions.
+
+A ShellSession keeps a single "adb shell" open on the target device and
+writes commands to its stdin. Every command is followed by marker lines
+on stdout and stderr carrying a sequence number and the exit status, so
+the output of each command can be told apart while several commands are
+in flight.
+
+open_shell starts a single command and reads its stdout, stderr and exit
+status as they arrive. Through the adb server it uses the shell protocol
+v2 when the device supports it ("shell,v2,raw:<command>"), where every
+packet is an id byte and a little-endian 32 bit length:
+
+    0 stdin, 1 stdout, 2 stderr, 3 exit (one byte status), 4 close stdin
+
+run_batch sends a list of commands as a single script through one
+"adb exec-out" call and cuts its output back into one ShellResult per
+command, so a series of probes costs a single round trip.
+"""
+
+import abc
+import collections
+import os
+import random
+import string
+import struct
+import subprocess
+import threading
+
+from .adb import ADB, COPY_CHUNK_SIZE, Deadline
+from .transport import SocketBackend
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+
+class ShellResult(object):
+    """
+    Output of a single shell command
+    """
+
+    def __init__(self, command, stdout, stderr, exit_code):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+
+    def __repr__(self):
+        return "ShellResult(%r, exit_code=%r)" % (self.command,
+                                                   self.exit_code)
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def lines(self):
+        """
+        Returns stdout as a list of non-empty stripped lines, like
+        ADB.shell_command does
+        """
+        return [x.strip() for x in self.stdout.split('\n')
+                if len(x.strip()) > 0]
+
+
+def quote(arg):
+    """
+    Quotes arg for the device shell
+    """
+    return "'" + arg.replace("'", "'\\''") + "'"
+
+
+def make_marker():
+    return "__PYADB_%s__" % "".join(
+            random.choice(string.ascii_letters) for _ in range(12))
+
+
+class _StreamSplitter(threading.Thread):
+    """
+    Reads a shell stream and cuts it at every marker line, queueing
+    (sequence, data, exit_code) for each command
+    """
+
+    def __init__(self, stream, marker):
+        threading.Thread.__init__(self, name="pyadb-shell-reader")
+        self.daemon = True
+        self.results = queue.Queue()
+        self._stream = stream
+        self._marker = marker.encode('ascii')
+
+    def run(self):
+        chunks = []
+        try:
+            while True:
+                line = self._stream.readline()
+                if not line:
+                    break
+                if not line.startswith(self._marker):
+                    chunks.append(line)
+                    continue
+                fields = line.split()
+                exit_code = int(fields[2]) if len(fields) > 2 else None
+                data = b"".join(chunks)
+                # the marker is preceded by a newline of our own
+                if data.endswith(b"\n"):
+                    data = data[:-1]
+                self.results.put((int(fields[1]), data, exit_code))
+                chunks = []
+        except (IOError, OSError, ValueError):
+            pass
+        self.results.put(None)
+
+
+class ShellSession(object):
+    """
+    A long-lived shell on the target device of an ADB instance.
+
+    with ShellSession(adb) as shell:
+        result = shell.run("getprop ro.build.version.sdk")
+        results = shell.run_many(["id", "uname -a", "ls /sdcard"])
+
+    Each command runs in a subshell with stdin from /dev/null, so "cd" or
+    exported variables do not leak into the next command, and a syntax
+    error does not kill the session.
+
+    Through the SocketBackend the device shell has a single output
+    stream, so stderr is returned merged into stdout.
+
+    recv() gives up after timeout seconds, or at the deadline of the
+    calling thread's Deadline block, raising ADB.Timeout. The shell is
+    then killed (the output of the command would come in the way of the
+    next one) along with the commands not read yet, and the next command
+    starts a new shell.
+    """
+
+    def __init__(self, adb, timeout=None):
+        self._adb = adb
+        self._target = adb.get_target_device()
+        self.timeout = timeout
+        self._marker = make_marker()
+        self._sequence = 0
+        self._pending = collections.deque()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._proc = None
+        self._conn = None
+        self._stdin = None
+        self._stdout = None
+        self._stderr = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def is_open(self):
+        return self._stdout is not None
+
+    def open(self):
+        """
+        Starts the remote shell
+        """
+        if self.is_open:
+            return
+
+        backend = self._adb.get_backend()
+        if isinstance(backend, SocketBackend):
+            self._conn = backend.server.open_service(self._target, "exec:sh")
+            # the session outlives the Deadline block it was opened in
+            self._conn.unwatch()
+            self._stdin = self._conn.send
+            stdout = self._conn.socket.makefile('rb')
+        else:
+            if self._adb.get_adb_path() is None:
+                raise ADB.BadCall("ADB path not set")
+            cmd = self._adb._build_command_c(['shell'], self._target)
+            ADB.LOGGER.info("Opening shell session: %s", cmd)
+            try:
+                self._proc = subprocess.Popen(
+                        cmd,
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        shell=False)
+            except Exception as err:
+                ADB.LOGGER.exception("Unexpected exception")
+                raise ADB.InternalError(str(err))
+            self._stdin = self._write_proc
+            stdout = self._proc.stdout
+            self._stderr = _StreamSplitter(self._proc.stderr, self._marker)
+            self._stderr.start()
+
+        self._stdout = _StreamSplitter(stdout, self._marker)
+        self._stdout.start()
+
+    def close(self):
+        """
+        Terminates the remote shell
+        """
+        if not self.is_open:
+            return
+        try:
+            self._stdin(b"exit\n")
+        except ADB.AdbException:
+            pass
+        self._reset()
+
+    def _interrupter(self):
+        """
+        Returns a function stopping the current shell and waking recv() up,
+        even if a child of the shell keeps its output open
+        """
+        proc, conn = self._proc, self._conn
+        splitters = [splitter for splitter in (self._stdout, self._stderr)
+                     if splitter is not None]
+
+        def interrupt():
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+            if conn is not None:
+                conn.close()
+            for splitter in splitters:
+                splitter.results.put(None)
+        return interrupt
+
+    def _reset(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait()
+            except (IOError, OSError):
+                pass
+            self._proc = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._stdout = None
+        self._stderr = None
+        self._pending.clear()
+
+    def _write_proc(self, data):
+        try:
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+        except (IOError, OSError) as err:
+            raise ADB.InternalError("Shell session closed: %s" % err)
+
+    def send(self, cmd):
+        """
+        Queues a command without waiting for its result, returns its
+        sequence number. Results are read back in order with recv().
+        """
+        self.open()
+        with self._write_lock:
+            self._sequence += 1
+            sequence = self._sequence
+            script = (
+                    "(eval %s) </dev/null; __pyadb_rc=$?; "
+                    "echo; echo \"%s %d $__pyadb_rc\"" % (
+                        quote(cmd), self._marker, sequence))
+            if self._stderr is not None:
+                script += "; echo >&2; echo \"%s %d\" >&2" % (
+                        self._marker, sequence)
+            self._pending.append((sequence, cmd))
+            self._stdin((script + "\n").encode('utf-8'))
+        return sequence
+
+    def _next(self, splitter, cmd, deadline):
+        timeout = self.timeout
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining is not None and (timeout is None or
+                                          remaining < timeout):
+                timeout = remaining
+        try:
+            item = splitter.results.get(timeout=timeout)
+        except queue.Empty:
+            if deadline is not None and deadline.expired:
+                raise deadline.exception(cmd)
+            raise ADB.Timeout("Timeout waiting for shell output")
+        if item is None:
+            if deadline is not None and deadline.fired:
+                raise deadline.exception(cmd)
+            # keep the end-of-stream mark for later readers
+            splitter.results.put(None)
+            raise ADB.InternalError("Shell session terminated")
+        return item
+
+    def recv(self):
+        """
+        Returns the ShellResult of the oldest command sent
+        """
+        deadline = Deadline.current()
+        with self._read_lock:
+            if not self._pending:
+                raise ADB.BadCall("No command pending")
+            sequence, cmd = self._pending.popleft()
+
+            interrupt = self._interrupter()
+            unwatch = None
+            if deadline is not None:
+                unwatch = deadline.on_expiry(interrupt)
+            try:
+                out_sequence, stdout, exit_code = self._next(
+                        self._stdout, cmd, deadline)
+                stderr = b""
+                if self._stderr is not None:
+                    err_sequence, stderr, _ = self._next(
+                            self._stderr, cmd, deadline)
+                    if err_sequence != sequence:
+                        raise ADB.InternalError("Shell session out of sync")
+                if out_sequence != sequence:
+                    raise ADB.InternalError("Shell session out of sync")
+            except (ADB.Timeout, ADB.InternalError):
+                # what is left of the output would be read as the result
+                # of the next command
+                interrupt()
+                self._reset()
+                raise
+            finally:
+                if unwatch is not None:
+                    unwatch()
+
+        return ShellResult(cmd,
+                           stdout.decode('utf-8', 'replace'),
+                           stderr.decode('utf-8', 'replace'),
+                           exit_code)
+
+    def run(self, cmd):
+        """
+        Runs a command and returns its ShellResult
+        """
+        self.send(cmd)
+        return self.recv()
+
+    def run_many(self, cmds):
+        """
+        Sends all commands before reading any result, returns the list of
+        ShellResult in the same order
+        """
+        for cmd in cmds:
+            self.send(cmd)
+        return [self.recv() for _ in cmds]
+
+
+# where the batch script keeps the stderr of the command being run
+BATCH_STDERR = "${TMPDIR:-/data/local/tmp}/.pyadb-stderr-$$"
+# the script travels in the service string, limited to 64 KB by the host
+# protocol and to about 4 KB by older adbd
+MAX_BATCH_SCRIPT = 4000
+
+
+def _batch_line(index, cmd, marker):
+    return ("(eval %s) </dev/null 2>\"$__pyadb_err\"; __pyadb_rc=$?; "
+            "echo; echo \"%s %d $__pyadb_rc\"; "
+            "cat \"$__pyadb_err\" 2>/dev/null; echo; echo \"%s %d\""
+            % (quote(cmd), marker, index, marker, index))
+
+
+def batch_script(cmds, marker):
+    """
+    Returns the device script running cmds one after the other. After
+    each command the script prints its stdout, a "<marker> <n> <status>"
+    line, its stderr and a "<marker> <n>" line.
+    """
+    lines = ["__pyadb_err=%s" % BATCH_STDERR]
+    for index, cmd in enumerate(cmds):
+        lines.append(_batch_line(index, cmd, marker))
+    lines.append("rm -f \"$__pyadb_err\"")
+    return "\n".join(lines)
+
+
+def parse_batch(cmds, output, marker):
+    """
+    Cuts the output of batch_script into a list of ShellResult
+    """
+    marker = marker.encode('ascii')
+    results = []
+    chunks = []
+    stdout = exit_code = None
+    for line in output.splitlines(True):
+        if not line.startswith(marker):
+            chunks.append(line)
+            continue
+        fields = line.split()
+        data = b"".join(chunks)
+        # the marker is preceded by a newline of our own
+        if data.endswith(b"\n"):
+            data = data[:-1]
+        chunks = []
+        if len(fields) < 2 or fields[1] != str(len(results)).encode('ascii'):
+            raise ADB.InternalError("Shell batch output out of sync")
+        if stdout is None:
+            stdout = data
+            exit_code = int(fields[2]) if len(fields) > 2 else None
+            continue
+        results.append(ShellResult(cmds[len(results)],
+                                   stdout.decode('utf-8', 'replace'),
+                                   data.decode('utf-8', 'replace'),
+                                   exit_code))
+        stdout = exit_code = None
+    if len(results) != len(cmds):
+        raise ADB.InternalError(
+                "Shell batch interrupted after %d of %d commands"
+                % (len(results), len(cmds)))
+    return results
+
+
+def split_batch(cmds, marker, limit=MAX_BATCH_SCRIPT):
+    """
+    Yields lists of consecutive cmds whose batch_script fits in limit
+    bytes. A command too long by itself is yielded alone.
+    """
+    batch = []
+    size = len(batch_script([], marker).encode('utf-8'))
+    used = size
+    for cmd in cmds:
+        length = len(_batch_line(len(batch), cmd,
+                                 marker).encode('utf-8')) + 1
+        if batch and used + length > limit:
+            yield batch
+            batch = []
+            used = size
+            length = len(_batch_line(0, cmd, marker).encode('utf-8')) + 1
+        batch.append(cmd)
+        used += length
+    if batch:
+        yield batch
+
+
+def run_batch(adb, cmds):
+    """
+    Runs cmds on the target device of adb in one round trip, returns the
+    list of ShellResult (stdout, stderr and exit code of each command) in
+    the same order.
+
+    Every command runs in its own subshell with stdin from /dev/null, a
+    failing command does not stop the following ones. The script travels
+    in the service string, so batches larger than MAX_BATCH_SCRIPT bytes
+    are sent in several round trips.
+    """
+    marker = make_marker()
+    results = []
+    for batch in split_batch(list(cmds), marker):
+        output = adb.exec_out(batch_script(batch, marker))
+        results.extend(parse_batch(batch, bytes(output), marker))
+    return results
+
+
+# shell protocol v2 packet ids
+SHELL_STDIN = 0
+SHELL_STDOUT = 1
+SHELL_STDERR = 2
+SHELL_EXIT = 3
+SHELL_CLOSE_STDIN = 4
+
+SHELL_V2 = "shell_v2"
+
+_SHELL_PACKET = struct.Struct("<BI")
+
+
+class ShellProcess(abc.ABCMeta("_ShellProcessBase", (object,), {})):
+    """
+    A command running on the device.
+
+    with adb.open_shell("cat > /sdcard/notes.txt") as process:
+        process.write(b"...")
+        process.close_stdin()
+        for kind, data in process:
+            ...     # kind is SHELL_STDOUT or SHELL_STDERR
+    process.exit_code
+
+    Iterating yields the output as it arrives, exit_code is set once it
+    is exhausted. result() reads the rest and returns a ShellResult.
+    Started inside a Deadline block, the command is stopped at the
+    deadline and reading raises ADB.Timeout.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.exit_code = None
+        self._deadline = Deadline.current()
+
+    def _check_deadline(self):
+        if self._deadline is not None and self._deadline.fired:
+            raise self._deadline.exception(self.command)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self.packets()
+
+    @abc.abstractmethod
+    def packets(self):
+        """
+        Yields (SHELL_STDOUT or SHELL_STDERR, bytes) until the command ends
+        """
+
+    @abc.abstractmethod
+    def write(self, data):
+        """
+        Writes data to the stdin of the command
+        """
+
+    @abc.abstractmethod
+    def close_stdin(self):
+        """
+        Ends the stdin of the command
+        """
+
+    @abc.abstractmethod
+    def close(self):
+        """
+        Stops the command if it is still running
+        """
+
+    def result(self):
+        """
+        Waits for the command to end, returns its ShellResult
+        """
+        output = {SHELL_STDOUT: [], SHELL_STDERR: []}
+        try:
+            for kind, data in self.packets():
+                output[kind].append(data)
+        except ADB.Timeout as err:
+            err.output = b"".join(output[SHELL_STDOUT])
+            err.error = b"".join(output[SHELL_STDERR])
+            raise
+        finally:
+            self.close()
+        return ShellResult(
+                self.command,
+                b"".join(output[SHELL_STDOUT]).decode('utf-8', 'replace'),
+                b"".join(output[SHELL_STDERR]).decode('utf-8', 'replace'),
+                self.exit_code)
+
+
+class ShellV2Process(ShellProcess):
+    """
+    Command started with the shell protocol v2 through the adb server
+    """
+
+    def __init__(self, command, conn):
+        ShellProcess.__init__(self, command)
+        self._conn = conn
+
+    def packets(self):
+        while self._conn is not None and self.exit_code is None:
+            try:
+                kind, length = _SHELL_PACKET.unpack(
+                        self._conn.read_exactly(_SHELL_PACKET.size))
+                data = self._conn.read_exactly(length)
+            except ADB.InternalError as err:
+                self.close()
+                raise ADB.InternalError(
+                        "Shell ended without exit status: %s" % err)
+            if kind == SHELL_EXIT:
+                self.exit_code = bytearray(data)[0] if data else None
+                return
+            if kind in (SHELL_STDOUT, SHELL_STDERR):
+                yield kind, data
+
+    def _send(self, kind, data=b""):
+        if self._conn is None:
+            raise ADB.InternalError("Shell closed")
+        self._conn.send(_SHELL_PACKET.pack(kind, len(data)) + data)
+
+    def write(self, data):
+        self._send(SHELL_STDIN, data)
+
+    def close_stdin(self):
+        self._send(SHELL_CLOSE_STDIN)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class _LegacyShellProcess(ShellProcess):
+    """
+    Command started through "exec:" on devices without shell protocol v2.
+    The device sends a single stream: stderr comes merged into stdout and
+    the exit status is read from a marker line printed after the command.
+    Its stdin cannot signal EOF, half closing the socket ends the whole
+    stream: commands reading stdin must stop on the data they expect.
+    """
+
+    def __init__(self, command, conn, marker):
+        ShellProcess.__init__(self, command)
+        self._conn = conn
+        self._stdout = conn.socket.makefile('rb')
+        self._marker = marker.encode('ascii')
+
+    def packets(self):
+        previous = None
+        while self._conn is not None and self.exit_code is None:
+            line = self._stdout.readline(COPY_CHUNK_SIZE)
+            if not line:
+                self.close()
+                self._check_deadline()
+                raise ADB.InternalError("Shell ended without exit status")
+            if line.startswith(self._marker):
+                # the marker is preceded by a newline of our own
+                if previous and previous.endswith(b"\n"):
+                    previous = previous[:-1]
+                if previous:
+                    yield SHELL_STDOUT, previous
+                fields = line.split()
+                self.exit_code = int(fields[1]) if len(fields) > 1 else None
+                return
+            if previous is not None:
+                yield SHELL_STDOUT, previous
+            previous = line
+
+    def write(self, data):
+        if self._conn is None:
+            raise ADB.InternalError("Shell closed")
+        self._conn.send(data)
+
+    def close_stdin(self):
+        # shutting down the socket would end the output too
+        pass
+
+    def close(self):
+        if self._conn is not None:
+            self._stdout.close()
+            self._conn.close()
+            self._conn = None
+
+
+class _PipeShellProcess(ShellProcess):
+    """
+    Command started with the adb binary ("adb shell" uses the shell
+    protocol v2 by itself, the exit status is that of adb)
+    """
+
+    def __init__(self, command, proc):
+        ShellProcess.__init__(self, command)
+        self._proc = proc
+        self._unwatch = None
+        if self._deadline is not None:
+            self._unwatch = self._deadline.on_expiry(proc.kill)
+        self._output = queue.Queue()
+        self._readers = [
+                threading.Thread(target=self._read, name="pyadb-shell-reader",
+                                 args=(kind, pipe))
+                for kind, pipe in ((SHELL_STDOUT, proc.stdout),
+                                   (SHELL_STDERR, proc.stderr))]
+        for reader in self._readers:
+            reader.daemon = True
+            reader.start()
+
+    def _read(self, kind, pipe):
+        try:
+            while True:
+                data = os.read(pipe.fileno(), COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                self._output.put((kind, data))
+        except (IOError, OSError, ValueError):
+            pass
+        self._output.put((kind, None))
+
+    def packets(self):
+        running = len(self._readers)
+        while running and self._proc is not None:
+            kind, data = self._output.get()
+            if data is None:
+                running -= 1
+                continue
+            yield kind, data
+        self._check_deadline()
+        if self._proc is not None:
+            self.exit_code = self._proc.wait()
+
+    def write(self, data):
+        try:
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+        except (AttributeError, IOError, OSError) as err:
+            raise ADB.InternalError("Shell closed: %s" % err)
+
+    def close_stdin(self):
+        try:
+            self._proc.stdin.close()
+        except (AttributeError, IOError, OSError):
+            pass
+
+    def close(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        if proc.poll() is None:
+            proc.kill()
+        returncode = proc.wait()
+        if self.exit_code is None:
+            self.exit_code = returncode
+
+
+def open_shell(adb, cmd, stdin=True):
+    """
+    Starts cmd on the target device of adb, returns its ShellProcess.
+    With stdin False the command reads /dev/null on devices without
+    shell protocol v2, as their stdin cannot be closed.
+    """
+    target = adb.get_target_device()
+    backend = adb.get_backend()
+    if isinstance(backend, SocketBackend):
+        server = backend.server
+        if SHELL_V2 in server.features(target):
+            return ShellV2Process(
+                    cmd, server.open_service(target, "shell,v2,raw:%s" % cmd))
+        marker = make_marker()
+        script = ("(eval %s) %s2>&1; __pyadb_rc=$?; "
+                  "echo; echo \"%s $__pyadb_rc\"" % (
+                          quote(cmd), "" if stdin else "</dev/null ", marker))
+        return _LegacyShellProcess(
+                cmd, server.open_service(target, "exec:%s" % script), marker)
+
+    if adb.get_adb_path() is None:
+        raise ADB.BadCall("ADB path not set")
+    cmd_line = adb._build_command_c(['shell', cmd], target)
+    ADB.LOGGER.info("Opening shell: %s", cmd_line)
+    try:
+        proc = subprocess.Popen(cmd_line,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                shell=False)
+    except Exception as err:
+        ADB.LOGGER.exception("Unexpected exception")
+        raise ADB.InternalError(str(err))
+    return _PipeShellProcess(cmd, proc)
+
+
+def run_shell(adb, cmd, stdin=None):
+    """
+    Runs cmd on the target device of adb with stdin (bytes, nothing if
+    None) and returns its ShellResult
+    """
+    with open_shell(adb, cmd, stdin=bool(stdin)) as process:
+        if stdin:
+            process.write(stdin)
+        process.close_stdin()
+        return process.result()
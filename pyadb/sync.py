@@ -0,0 +1,345 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Client for the adb sync sub-protocol (what "adb push/pull" use).
+
+After the "sync:" service is opened on a device, every request is a
+four letter id followed by a little-endian 32 bit length and its data:
+
+    STAT <path>  ->  STAT <mode> <size> <mtime>
+    LIST <path>  ->  DENT <mode> <size> <mtime> <namelen> <name> ... DONE
+    RECV <path>  ->  DATA <len> <bytes> ... DONE | FAIL <len> <message>
+    SEND <path>,<mode> DATA ... DONE <mtime>  ->  OKAY | FAIL
+    QUIT
+
+A single SyncConnection can move any number of files.
+"""
+
+import os
+import stat
+import struct
+import time
+
+from .adb import ADB
+from .transport import get_server
+
+
+def replace_file(source, destination):
+    """
+    Renames source to destination, replacing destination if it exists
+    """
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+        return
+    # python 2: rename does not replace an existing file on windows
+    if os.name == "nt" and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+class SyncStat(object):
+    """
+    Remote file metadata as returned by STAT/LIST
+    """
+
+    def __init__(self, mode, size, mtime):
+        self.mode = mode
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        return "SyncStat(mode=%o, size=%d, mtime=%d)" % (
+                self.mode, self.size, self.mtime)
+
+    @property
+    def exists(self):
+        return self.mode != 0
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_link(self):
+        return stat.S_ISLNK(self.mode)
+
+
+class SyncEntry(SyncStat):
+    """
+    Directory entry returned by SyncConnection.listdir
+    """
+
+    def __init__(self, name, mode, size, mtime):
+        SyncStat.__init__(self, mode, size, mtime)
+        self.name = name
+
+    def __repr__(self):
+        return "SyncEntry(%r, mode=%o, size=%d, mtime=%d)" % (
+                self.name, self.mode, self.size, self.mtime)
+
+
+class TransferResult(object):
+    """
+    Outcome of a push or pull
+    """
+
+    def __init__(self, source, destination, size, seconds):
+        self.source = source
+        self.destination = destination
+        self.size = size
+        self.seconds = seconds
+
+    def __repr__(self):
+        return "TransferResult(%r, %r, size=%d)" % (
+                self.source, self.destination, self.size)
+
+    @property
+    def rate(self):
+        """
+        Bytes per second
+        """
+        if self.seconds <= 0:
+            return 0.0
+        return self.size / self.seconds
+
+    def summary(self):
+        """
+        Same wording as the adb tool
+        """
+        return "%s: 1 file transferred. %.1f MB/s (%d bytes in %.3fs)" % (
+                self.source, self.rate / 1000000.0, self.size, self.seconds)
+
+
+class SyncConnection(object):
+    """
+    Sync session with the target device of an ADB instance.
+
+    with SyncConnection.for_device(adb) as sync:
+        sync.stat("/sdcard/DCIM")
+        for entry in sync.listdir("/sdcard/DCIM"):
+            ...
+        sync.pull("/sdcard/a.jpg", "/tmp/a.jpg")
+        sync.push("/tmp/b.jpg", "/sdcard/b.jpg")
+
+    progress callbacks are called as progress(transferred, total).
+    """
+
+    # largest DATA packet accepted by adbd
+    MAX_DATA = 64 * 1024
+    MAX_PATH = 1024
+
+    def __init__(self, server, serial):
+        self._server = server
+        self._target = serial
+        self._conn = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @classmethod
+    def for_device(cls, adb):
+        """
+        Returns a SyncConnection to the target device of an ADB instance
+        """
+        return cls(get_server(adb), adb.get_target_device())
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        if self._conn is None:
+            self._conn = self._server.open_service(self._target, "sync:")
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.send(b"QUIT" + struct.pack("<I", 0))
+            except ADB.AdbException:
+                pass
+            self._conn.close()
+            self._conn = None
+
+    def _send_request(self, request, path):
+        if not isinstance(path, bytes):
+            path = path.encode('utf-8')
+        if len(path) > self.MAX_PATH:
+            raise ADB.BadCall("Remote path too long: %r" % path)
+        self.open()
+        self._conn.send(request + struct.pack("<I", len(path)) + path)
+
+    def _read_header(self):
+        header = self._conn.read_exactly(8)
+        return header[:4], struct.unpack("<I", header[4:])[0]
+
+    def _fail(self, length):
+        message = self._conn.read_exactly(length).decode('utf-8', 'replace')
+        raise ADB.ServerError(message)
+
+    def stat(self, path):
+        """
+        Returns SyncStat for path (mode 0 if it does not exist)
+        """
+        self._send_request(b"STAT", path)
+        reply = self._conn.read_exactly(16)
+        if reply[:4] != b"STAT":
+            raise ADB.InternalError("Unexpected sync reply %r" % reply[:4])
+        return SyncStat(*struct.unpack("<III", reply[4:]))
+
+    def exists(self, path):
+        return self.stat(path).exists
+
+    def listdir(self, path):
+        """
+        Returns the SyncEntry list of a remote directory, without . and ..
+        """
+        self._send_request(b"LIST", path)
+        entries = []
+        while True:
+            reply = self._conn.read_exactly(20)
+            if reply[:4] == b"DONE":
+                break
+            if reply[:4] != b"DENT":
+                raise ADB.InternalError("Unexpected sync reply %r"
+                                        % reply[:4])
+            mode, size, mtime, namelen = struct.unpack("<IIII", reply[4:])
+            name = self._conn.read_exactly(namelen).decode('utf-8',
+                                                            'replace')
+            if name in (".", ".."):
+                continue
+            entries.append(SyncEntry(name, mode, size, mtime))
+        return entries
+
+    def pull_stream(self, remote, output, progress=None, total=None):
+        """
+        Writes the contents of a remote file to a binary file object,
+        returns the number of bytes written
+        """
+        self._send_request(b"RECV", remote)
+        size = 0
+        while True:
+            kind, length = self._read_header()
+            if kind == b"DONE":
+                break
+            if kind == b"FAIL":
+                self._fail(length)
+            if kind != b"DATA":
+                raise ADB.InternalError("Unexpected sync reply %r" % kind)
+            remaining = length
+            while remaining > 0:
+                chunk = self._conn.recv(min(remaining, self.MAX_DATA))
+                if not chunk:
+                    raise ADB.InternalError("Connection closed during pull")
+                output.write(chunk)
+                remaining -= len(chunk)
+            size += length
+            self.bytes_received += length
+            if progress is not None:
+                progress(size, total)
+        return size
+
+    def pull(self, remote, local, progress=None):
+        """
+        Pulls a remote file into a local path (or into a local directory)
+        """
+        total = None
+        if progress is not None:
+            total = self.stat(remote).size
+        if os.path.isdir(local):
+            local = os.path.join(local, remote.rstrip('/').split('/')[-1])
+
+        started = time.time()
+        try:
+            with open(local, 'wb') as output:
+                size = self.pull_stream(remote, output, progress, total)
+        except ADB.ServerError:
+            os.remove(local)
+            raise
+        return TransferResult(remote, local, size, time.time() - started)
+
+    def push_stream(self, source, remote, mode=0o644, mtime=None,
+                    progress=None, total=None):
+        """
+        Sends a binary file object (or bytes) to a remote path, returns the
+        number of bytes sent
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = memoryview(source)
+            total = len(data)
+            chunks = (data[i:i + self.MAX_DATA]
+                      for i in range(0, len(data), self.MAX_DATA))
+        else:
+            chunks = iter(lambda: source.read(self.MAX_DATA), b"")
+
+        self._send_request(b"SEND", "%s,%d" % (
+                remote, stat.S_IFREG | (mode & 0o7777)))
+        size = 0
+        for chunk in chunks:
+            self._conn.send(b"DATA" + struct.pack("<I", len(chunk)))
+            self._conn.send(chunk)
+            size += len(chunk)
+            self.bytes_sent += len(chunk)
+            if progress is not None:
+                progress(size, total)
+
+        if mtime is None:
+            mtime = time.time()
+        self._conn.send(b"DONE" + struct.pack("<I", int(mtime)))
+
+        kind, length = self._read_header()
+        if kind == b"FAIL":
+            self._fail(length)
+        if kind != b"OKAY":
+            raise ADB.InternalError("Unexpected sync reply %r" % kind)
+        return size
+
+    def push(self, local, remote, progress=None):
+        """
+        Pushes a local file, keeping its permissions and mtime. If remote
+        is an existing directory the file is copied into it.
+        """
+        local_stat = os.stat(local)
+        if self.stat(remote).is_dir:
+            remote = remote.rstrip('/') + '/' + os.path.basename(local)
+
+        started = time.time()
+        with open(local, 'rb') as source:
+            size = self.push_stream(source, remote, local_stat.st_mode,
+                                    local_stat.st_mtime, progress,
+                                    local_stat.st_size)
+        return TransferResult(local, remote, size, time.time() - started)
+
+    def pull_many(self, files, progress=None):
+        """
+        Pulls (remote, local) pairs over this connection, returns the list
+        of TransferResult. progress is called as progress(remote, done,
+        total).
+        """
+        return [self.pull(remote, local, self._file_progress(remote,
+                                                             progress))
+                for remote, local in files]
+
+    def push_many(self, files, progress=None):
+        """
+        Pushes (local, remote) pairs over this connection, returns the list
+        of TransferResult. progress is called as progress(local, done,
+        total).
+        """
+        return [self.push(local, remote, self._file_progress(local,
+                                                             progress))
+                for local, remote in files]
+
+    @staticmethod
+    def _file_progress(name, progress):
+        if progress is None:
+            return None
+        return lambda done, total: progress(name, done, total)
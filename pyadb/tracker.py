@@ -0,0 +1,177 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Live view of the devices known to the adb server.
+
+"host:track-devices" keeps the connection open and the server sends the
+whole device list (length-prefixed "serial\\tstate" lines) every time
+something changes. DeviceTracker follows that stream from a background
+thread, so the current device states are always in memory.
+"""
+
+import threading
+import time
+
+from .adb import ADB
+from .transport import AdbServer
+
+
+class DeviceTracker(object):
+    """
+    Keeps {serial: state} up to date and calls callbacks on changes.
+
+    tracker = DeviceTracker()
+    tracker.add_callback(lambda serial, old, new: print(serial, old, new))
+    tracker.start()
+    ADB.set_device_tracker(tracker)  # get_devices() without spawning adb
+
+    Callbacks get (serial, old_state, new_state), None meaning the device
+    is not listed. They run on the tracker thread and must not block.
+    When the server connection drops no device is listed (callbacks see
+    them go to None) until the tracker, reconnecting every retry_interval
+    seconds, gets a new list.
+    """
+
+    def __init__(self, server=None, retry_interval=1.0):
+        self._server = server or AdbServer()
+        self.retry_interval = retry_interval
+        self._states = {}
+        self._callbacks = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._conn = None
+        self._stop = threading.Event()
+        self._synced = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, wait=True, timeout=None):
+        """
+        Starts tracking. When wait is True, returns once the first device
+        list was received (False if it did not arrive within timeout)
+        """
+        if not self.is_running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="pyadb-device-tracker")
+            self._thread.daemon = True
+            self._thread.start()
+        if wait:
+            return self._synced.wait(timeout)
+        return True
+
+    def stop(self):
+        self._stop.set()
+        conn = self._conn
+        if conn is not None:
+            conn.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._synced.clear()
+
+    def add_callback(self, callback):
+        with self._cond:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._cond:
+            self._callbacks.remove(callback)
+
+    def devices(self):
+        """
+        Returns a copy of {serial: state}
+        """
+        with self._cond:
+            return dict(self._states)
+
+    def serials(self, state=None):
+        """
+        Returns the listed serials, only those in state if given
+        """
+        with self._cond:
+            return [serial for serial, current in self._states.items()
+                    if state is None or current == state]
+
+    def state(self, serial):
+        """
+        Returns the state of a device, None if it is not listed
+        """
+        with self._cond:
+            return self._states.get(serial)
+
+    def wait_for(self, serial, state="device", timeout=None):
+        """
+        Blocks until serial reaches state, returns False on timeout
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            # no Condition.wait_for on python 2
+            while self._states.get(serial) != state:
+                if end is None:
+                    self._cond.wait()
+                    continue
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._conn = self._server.connect()
+                # the stream stays silent while nothing changes
+                self._conn.socket.settimeout(None)
+                self._conn.send_request("host:track-devices")
+                while not self._stop.is_set():
+                    self._update(self._conn.read_length_prefixed())
+            except ADB.AdbException as err:
+                if not self._stop.is_set():
+                    ADB.LOGGER.warning("Device tracking interrupted: %s", err)
+            finally:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+            if not self._stop.is_set():
+                # the states are unknown until the next list
+                self._synced.clear()
+                self._update(b"", synced=False)
+            self._stop.wait(self.retry_interval)
+
+    def _update(self, payload, synced=True):
+        states = {}
+        for line in payload.decode('utf-8', 'replace').splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                states[fields[0]] = fields[1]
+
+        with self._cond:
+            previous = self._states
+            self._states = states
+            callbacks = list(self._callbacks)
+            self._cond.notify_all()
+        if synced:
+            self._synced.set()
+
+        for serial in set(previous) | set(states):
+            old, new = previous.get(serial), states.get(serial)
+            if old == new:
+                continue
+            for callback in callbacks:
+                try:
+                    callback(serial, old, new)
+                except Exception:
+                    ADB.LOGGER.exception("Device tracker callback failed")
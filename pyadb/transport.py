@@ -0,0 +1,545 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Pure python client for the adb server host protocol.
+
+Every request sent to the adb server (tcp:5037 by default) is an ASCII
+string prefixed with its length as four hex digits. The server answers
+with "OKAY" or "FAIL" followed by a length-prefixed error message.
+Requests prefixed with "host:" or "host-serial:<serial>:" are handled by
+the server itself, while "host:transport:<serial>" switches the socket
+to the device so the next request opens a service on it (shell:, sync:,
+reboot:, ...).
+"""
+
+import os
+import socket
+import threading
+import time
+
+from .adb import ADB, CommandStream, Deadline
+
+
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 5037
+
+LOGCAT_SERVICE = "shell:export ANDROID_LOG_TAGS=\"\" ; exec logcat %s"
+
+
+def encode_request(service):
+    """
+    Returns the wire representation of a request: <hex length><service>
+    """
+    if not isinstance(service, bytes):
+        service = service.encode('utf-8')
+    if len(service) > 0xFFFF:
+        raise ADB.BadCall("Request too long (%d bytes)" % len(service))
+    return ("%04x" % len(service)).encode('ascii') + service
+
+
+def get_server(adb):
+    """
+    Returns the AdbServer used by an ADB instance (by the ADB class
+    defaults when adb is None): the one of its SocketBackend, or the
+    default local server the adb binary talks to
+    """
+    backend = (adb if adb is not None else ADB).get_backend()
+    if isinstance(backend, SocketBackend):
+        return backend.server
+    return AdbServer()
+
+
+def _copy_error(source, destination, err):
+    """
+    Error output of a failed pull/push, worded like the adb tool
+    """
+    if isinstance(err, EnvironmentError) and err.strerror:
+        err = err.strerror
+    return "adb: error: failed to copy '%s' to '%s': %s\n" % (
+            source, destination, err)
+
+
+class AdbConnection(object):
+    """
+    A single socket connected to the adb server
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, sock, deadline=None):
+        self._sock = sock
+        self._deadline = deadline
+        self._unwatch = None
+        if deadline is not None:
+            self._unwatch = deadline.on_expiry(self.close)
+
+    @property
+    def socket(self):
+        return self._sock
+
+    def _check_deadline(self, output=None):
+        # the connection was closed by its deadline
+        if self._deadline is not None and self._deadline.fired:
+            raise self._deadline.exception("adb server request", output)
+
+    def unwatch(self):
+        """
+        Keeps the connection open past the deadline it was opened in, for
+        connections outliving the block
+        """
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        self._deadline = None
+
+    def close(self):
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                # wakes up readers blocked on a makefile() of the socket
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, data):
+        try:
+            self._sock.sendall(data)
+        except AttributeError:
+            self._check_deadline()
+            raise ADB.InternalError("Connection to adb server closed")
+        except socket.error as err:
+            self._check_deadline()
+            raise ADB.InternalError("Error writing to adb server: %s" % err)
+
+    def recv(self, size=CHUNK_SIZE):
+        """
+        Reads up to size bytes, returns b'' once the server closed the
+        connection
+        """
+        try:
+            data = self._sock.recv(size)
+        except AttributeError:
+            self._check_deadline()
+            raise ADB.InternalError("Connection to adb server closed")
+        except socket.error as err:
+            self._check_deadline()
+            raise ADB.InternalError("Error reading from adb server: %s" % err)
+        if not data:
+            self._check_deadline()
+        return data
+
+    def read_exactly(self, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.recv(min(remaining, self.CHUNK_SIZE))
+            if not chunk:
+                raise ADB.InternalError(
+                        "Connection closed by adb server (%d bytes missing)"
+                        % remaining)
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def read_all(self):
+        """
+        Reads until the server closes the connection
+        """
+        chunks = []
+        while True:
+            try:
+                chunk = self.recv()
+            except ADB.Timeout as err:
+                err.output = b"".join(chunks)
+                raise
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def read_length_prefixed(self):
+        """
+        Reads a <hex length><data> block and returns data as bytes
+        """
+        length = self.read_exactly(4)
+        try:
+            length = int(length, 16)
+        except ValueError:
+            raise ADB.InternalError("Bad length from adb server: %r" % length)
+        return self.read_exactly(length)
+
+    def read_status(self):
+        """
+        Reads an OKAY/FAIL status, raises ServerError on FAIL
+        """
+        status = self.read_exactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = self.read_length_prefixed().decode('utf-8', 'replace')
+            raise ADB.ServerError(message)
+        raise ADB.InternalError("Unexpected status from adb server: %r"
+                                % status)
+
+    def send_request(self, service):
+        """
+        Sends a request and waits for the server to accept it
+        """
+        self.send(encode_request(service))
+        self.read_status()
+
+
+class AdbServer(object):
+    """
+    Entry point to the adb server running on host:port
+    """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT,
+                 timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+        self._features = {}
+
+    def __repr__(self):
+        return "AdbServer(%r, %r)" % (self.host, self.port)
+
+    def connect(self):
+        """
+        Opens a new connection to the adb server
+        """
+        deadline = Deadline.current()
+        timeout = self.timeout
+        if deadline is not None:
+            deadline.check("Connecting to adb server")
+            remaining = deadline.remaining()
+            if remaining is not None and (timeout is None or
+                                          remaining < timeout):
+                timeout = remaining
+        started = time.time()
+        try:
+            sock = socket.create_connection((self.host, self.port),
+                                            timeout=timeout)
+        except socket.error as err:
+            raise ADB.InternalError(
+                    "Cannot connect to adb server at %s:%s: %s"
+                    % (self.host, self.port, err))
+        finally:
+            self._local.connect_time = self.pop_connect_time() + (
+                    time.time() - started)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # the deadline closes the socket, no need for a socket timeout
+        sock.settimeout(self.timeout)
+        return AdbConnection(sock, deadline)
+
+    def pop_connect_time(self):
+        """
+        Returns the seconds spent connecting by this thread since the last
+        call
+        """
+        connect_time = getattr(self._local, "connect_time", 0.0)
+        self._local.connect_time = 0.0
+        return connect_time
+
+    def features(self, serial=None):
+        """
+        Returns the set of features (shell_v2, cmd, stat_v2, ...) supported
+        by both the adb server and the device, cached per device
+        """
+        features = self._features.get(serial)
+        if features is None:
+            if serial is None:
+                reply = self.host_request("host:features")
+            else:
+                reply = self.host_request("host-serial:%s:features" % serial)
+            features = frozenset(
+                    feature for feature in reply.strip().split(",") if feature)
+            self._features[serial] = features
+        return features
+
+    def is_running(self):
+        try:
+            self.connect().close()
+        except ADB.InternalError:
+            return False
+        return True
+
+    def host_request(self, service):
+        """
+        Sends a host request and returns its length-prefixed reply
+        """
+        with self.connect() as conn:
+            conn.send_request(service)
+            return conn.read_length_prefixed().decode('utf-8', 'replace')
+
+    def host_command(self, service, statuses=1):
+        """
+        Sends a host request whose reply is made of OKAY/FAIL statuses only
+        """
+        with self.connect() as conn:
+            conn.send_request(service)
+            for _ in range(statuses - 1):
+                conn.read_status()
+
+    def open_transport(self, serial=None):
+        """
+        Returns a connection switched to the given device (any device if
+        serial is None)
+        """
+        conn = self.connect()
+        try:
+            if serial is None:
+                conn.send_request("host:transport-any")
+            else:
+                conn.send_request("host:transport:%s" % serial)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def open_service(self, serial, service):
+        """
+        Opens a device service (shell:, sync:, exec:, ...) and returns the
+        connection streaming it
+        """
+        conn = self.open_transport(serial)
+        try:
+            conn.send_request(service)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def open_stream(self, serial, service):
+        """
+        Opens a device service and returns a CommandStream reading it
+        """
+        conn = self.open_service(serial, service)
+        return CommandStream(conn.socket.makefile('rb'), conn=conn)
+
+    def device_output(self, serial, service):
+        """
+        Opens a device service and returns everything it writes
+        """
+        with self.open_service(serial, service) as conn:
+            return conn.read_all()
+
+
+class SocketBackend(object):
+    """
+    ADB backend talking to the adb server over its socket instead of
+    spawning one adb client process per call.
+
+    Commands without a socket implementation (pull, push, install, ...)
+    fall back to the adb binary.
+    """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT,
+                 timeout=None, server=None):
+        self.server = server or AdbServer(host, port, timeout)
+        self._handlers = {
+            "version": self._version,
+            "devices": self._devices,
+            "start-server": self._start_server,
+            "kill-server": self._kill_server,
+            "get-state": self._get_state,
+            "get-serialno": self._get_serialno,
+            "wait-for-device": self._wait_for_device,
+            "shell": self._shell,
+            "reboot": self._reboot,
+            "root": self._simple_service("root:"),
+            "remount": self._simple_service("remount:"),
+            "usb": self._simple_service("usb:"),
+            "tcpip": self._tcpip,
+            "jdwp": self._jdwp,
+            "logcat": self._logcat,
+            "bugreport": self._bugreport,
+            "connect": self._connect,
+            "disconnect": self._disconnect,
+            "forward": self._forward,
+            "uninstall": self._uninstall,
+            "pull": self._pull,
+            "push": self._push,
+            }
+        # commands whose output can be streamed
+        self._stream_services = {
+            "shell": "shell:%s",
+            "exec-out": "exec:%s",
+            "exec-in": "exec:%s",
+            "logcat": LOGCAT_SERVICE,
+            }
+
+    def __repr__(self):
+        return "SocketBackend(%r)" % self.server
+
+    def run(self, cmd, target=None):
+        """
+        Runs an adb command line over the socket.
+
+        Returns (output, error) like ADB.run_cmd_c with output as raw bytes,
+        or None when the command must go through the adb binary. Handlers
+        return the output, or (output, error) when the command failed.
+        """
+        cmd = cmd.split() if not isinstance(cmd, list) else cmd
+        if not cmd:
+            return None
+        handler = self._handlers.get(cmd[0])
+        if handler is None:
+            return None
+
+        try:
+            output = handler(target, *[str(arg) for arg in cmd[1:]])
+        except ADB.ServerError as err:
+            return b"", "error: %s\n" % err
+
+        if output is None:
+            return None
+        error = ""
+        if isinstance(output, tuple):
+            output, error = output
+        if not isinstance(output, bytes):
+            output = output.encode('utf-8')
+        return output, error
+
+    def pop_connect_time(self):
+        return self.server.pop_connect_time()
+
+    def open(self, cmd, target=None):
+        """
+        Starts an adb command line over the socket and returns a
+        CommandStream on its output, or None when the command must go
+        through the adb binary.
+        """
+        cmd = cmd.split() if not isinstance(cmd, list) else cmd
+        if not cmd or cmd[0] not in self._stream_services:
+            return None
+        return self.server.open_stream(
+                target,
+                self._stream_services[cmd[0]] % " ".join(
+                    str(arg) for arg in cmd[1:]))
+
+    def _version(self, target):
+        version = int(self.server.host_request("host:version"), 16)
+        return "Android Debug Bridge version 1.0.%d\n" % version
+
+    def _devices(self, target):
+        return "List of devices attached\n%s\n" % self.server.host_request(
+                "host:devices")
+
+    def _start_server(self, target):
+        if not self.server.is_running():
+            # let the adb binary spawn the daemon
+            return None
+        return b""
+
+    def _kill_server(self, target):
+        self.server.host_command("host:kill")
+        return b""
+
+    def _get_state(self, target):
+        return self.server.host_request("host-serial:%s:get-state" % target)
+
+    def _get_serialno(self, target):
+        return self.server.host_request(
+                "host-serial:%s:get-serialno" % target)
+
+    def _wait_for_device(self, target):
+        # OKAY once the request is accepted, OKAY again once the device
+        # is there: only a Deadline bounds the wait, not the socket timeout
+        if target is None:
+            service = "host:wait-for-any-device"
+        else:
+            service = "host-serial:%s:wait-for-any-device" % target
+        with self.server.connect() as conn:
+            conn.socket.settimeout(None)
+            conn.send_request(service)
+            conn.read_status()
+        return b""
+
+    def _shell(self, target, *args):
+        return self.server.device_output(target, "shell:%s" % " ".join(args))
+
+    def _reboot(self, target, mode=""):
+        return self.server.device_output(target, "reboot:%s" % mode)
+
+    def _simple_service(self, service):
+        def handler(target):
+            return self.server.device_output(target, service)
+        return handler
+
+    def _tcpip(self, target, port):
+        return self.server.device_output(target, "tcpip:%s" % port)
+
+    def _jdwp(self, target):
+        # the service sends the full list of pids each time it changes,
+        # keep the last one
+        pids = b""
+        with self.server.open_service(target, "jdwp") as conn:
+            while True:
+                try:
+                    pids = conn.read_length_prefixed()
+                except ADB.InternalError:
+                    break
+        return pids
+
+    def _logcat(self, target, *args):
+        return self.server.device_output(
+                target, LOGCAT_SERVICE % " ".join(args))
+
+    def _bugreport(self, target):
+        return self.server.device_output(target, "shell:bugreport")
+
+    def _connect(self, target, address):
+        return self.server.host_request("host:connect:%s" % address)
+
+    def _disconnect(self, target, address):
+        return self.server.host_request("host:disconnect:%s" % address)
+
+    def _forward(self, target, local, remote):
+        self.server.host_command(
+                "host-serial:%s:forward:%s;%s" % (target, local, remote),
+                statuses=2)
+        return b""
+
+    def _uninstall(self, target, *args):
+        return self.server.device_output(
+                target, "shell:pm uninstall %s" % " ".join(args))
+
+    def _pull(self, target, remote, local):
+        from .sync import SyncConnection
+        with SyncConnection(self.server, target) as sync:
+            remote_stat = sync.stat(remote)
+            if not remote_stat.exists:
+                return b"", ("adb: error: failed to stat remote object "
+                             "'%s': No such file or directory\n" % remote)
+            if not remote_stat.is_file:
+                # directories and special files: let adb handle them
+                return None
+            try:
+                return sync.pull(remote, local).summary() + "\n"
+            except (ADB.ServerError, IOError, OSError) as err:
+                return b"", _copy_error(remote, local, err)
+
+    def _push(self, target, local, remote):
+        from .sync import SyncConnection
+        if not os.path.isfile(local):
+            return None
+        with SyncConnection(self.server, target) as sync:
+            try:
+                return sync.push(local, remote).summary() + "\n"
+            except (ADB.ServerError, IOError, OSError) as err:
+                return b"", _copy_error(local, remote, err)
@@ -0,0 +1,505 @@
+# Author: Chema Garcia (aka sch3m4)
+# Contact: chema@safetybits.net | @sch3m4 | http://safetybits.net/contact
+# Homepage: http://safetybits.net
+# Project Site: http://github.com/sch3m4/pyadb
+
+"""
+Remote directory trees.
+
+pull_tree mirrors a remote directory locally. The metadata of the whole
+tree is fetched with a single find/stat command and compared with a
+manifest saved next to the local copy by the previous run, so only new
+or modified files are transferred, over a few parallel sync connections.
+
+RemoteTree keeps an index of the metadata of a device's files, filled
+lazily one sync LIST per directory, or a whole subtree at once with a
+single find/stat pass.
+"""
+
+import json
+import os
+import posixpath
+import threading
+import time
+from concurrent import futures
+
+from .adb import ADB
+from .shell import make_marker, quote
+from .sync import SyncConnection, SyncStat, replace_file
+from .transport import get_server
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+
+MANIFEST_NAME = ".pyadb-manifest.json"
+
+
+class RemoteFile(object):
+    """
+    Metadata of a remote regular file, path relative to the tree root
+    """
+
+    __slots__ = ("path", "size", "mtime", "mode")
+
+    def __init__(self, path, size, mtime, mode):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+
+    def __repr__(self):
+        return "RemoteFile(%r, size=%d, mtime=%d)" % (
+                self.path, self.size, self.mtime)
+
+    def key(self):
+        return [self.size, self.mtime, self.mode]
+
+
+class PullTreeResult(object):
+    """
+    What pull_tree did: transferred (TransferResult list), unchanged
+    (relative paths), removed (local paths deleted), errors
+    ({relative path: exception}) and listing_errors (messages of find)
+    """
+
+    def __init__(self):
+        self.transferred = []
+        self.unchanged = []
+        self.removed = []
+        self.errors = {}
+        self.listing_errors = []
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return ("PullTreeResult(transferred=%d, unchanged=%d, removed=%d, "
+                "errors=%d)" % (len(self.transferred), len(self.unchanged),
+                                len(self.removed), len(self.errors)))
+
+    @property
+    def bytes_transferred(self):
+        return sum(result.size for result in self.transferred)
+
+
+def _list_tree(adb, remote):
+    """
+    Returns the RemoteFile list of every regular file under remote and
+    the error messages of find (missing root, unreadable directory, ...)
+    """
+    prefix = remote.rstrip('/') + '/'
+    marker = make_marker()
+    # the trailing "/" makes find follow a symlinked root (/sdcard)
+    output = adb.exec_out(
+            "find %s -type f -exec stat -c '%%s %%Y %%a %%n' {} + 2>&1; "
+            "echo \"%s $?\"" % (quote(prefix), marker))
+
+    files = []
+    errors = []
+    status = None
+    for line in bytes(output).decode('utf-8', 'replace').split('\n'):
+        if not line:
+            continue
+        if line.startswith(marker):
+            status = line[len(marker):].strip()
+            continue
+        fields = line.split(' ', 3)
+        if len(fields) == 4:
+            name = _normpath(fields[3])
+            if name.startswith(prefix):
+                try:
+                    files.append(RemoteFile(
+                            name[len(prefix):], int(fields[0]),
+                            int(fields[1]), int(fields[2], 8)))
+                    continue
+                except ValueError:
+                    pass
+        errors.append(line)
+    if status != "0" and not errors:
+        errors.append("find exited with status %s" % status)
+    return files, errors
+
+
+def list_tree(adb, remote):
+    """
+    Returns the RemoteFile list of every regular file under remote, in one
+    adb round trip. Errors of find are logged.
+    adb exec-out find <remote>/ -type f -exec stat -c '%s %Y %a %n' {} +
+    """
+    files, errors = _list_tree(adb, remote)
+    for error in errors:
+        ADB.LOGGER.warning("Listing %s: %s", remote, error)
+    return files
+
+
+def load_manifest(path):
+    try:
+        with open(path) as manifest:
+            return json.load(manifest)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, entries):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as manifest:
+        json.dump(entries, manifest, sort_keys=True)
+    replace_file(tmp, path)
+
+
+def pull_tree(adb, remote, local, manifest=None, workers=4, delete=False,
+              progress=None):
+    """
+    Mirrors the remote directory into local, transferring only the files
+    that are new or changed since the last call.
+
+    manifest is the JSON file recording what was pulled (default:
+    <local>/.pyadb-manifest.json). workers sync connections pull files in
+    parallel. With delete, local files that vanished from the device are
+    removed, unless the listing is empty or incomplete (missing root,
+    find errors): nothing is deleted then. progress is called as progress(relative_path, TransferResult)
+    after each file.
+    """
+    started = time.time()
+    result = PullTreeResult()
+    if manifest is None:
+        manifest = os.path.join(local, MANIFEST_NAME)
+    if not os.path.isdir(local):
+        os.makedirs(local)
+
+    previous = load_manifest(manifest)
+    current = {}
+    todo = queue.Queue()
+    remote_root = remote.rstrip('/')
+
+    files, result.listing_errors = _list_tree(adb, remote)
+    for error in result.listing_errors:
+        ADB.LOGGER.warning("Listing %s: %s", remote, error)
+    for remote_file in files:
+        local_path = os.path.join(local, *remote_file.path.split('/'))
+        if previous.get(remote_file.path) == remote_file.key() and \
+                os.path.isfile(local_path):
+            current[remote_file.path] = remote_file.key()
+            result.unchanged.append(remote_file.path)
+        else:
+            todo.put((remote_file, local_path))
+    if result.listing_errors:
+        # what was not listed is still known, for a later run to delete
+        for path, key in previous.items():
+            current.setdefault(path, key)
+
+    lock = threading.Lock()
+    server = get_server(adb)
+    serial = adb.get_target_device()
+
+    def worker():
+        with SyncConnection(server, serial) as sync:
+            while True:
+                try:
+                    remote_file, local_path = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    directory = os.path.dirname(local_path)
+                    with lock:
+                        if not os.path.isdir(directory):
+                            os.makedirs(directory)
+                    transfer = sync.pull(
+                            remote_root + '/' + remote_file.path, local_path)
+                    os.utime(local_path, (remote_file.mtime,
+                                          remote_file.mtime))
+                except (ADB.AdbException, IOError, OSError) as err:
+                    with lock:
+                        result.errors[remote_file.path] = err
+                    continue
+                with lock:
+                    current[remote_file.path] = remote_file.key()
+                    result.transferred.append(transfer)
+                if progress is not None:
+                    progress(remote_file.path, transfer)
+
+    count = min(workers, todo.qsize())
+    if count:
+        executor = futures.ThreadPoolExecutor(max_workers=count)
+        try:
+            for future in [executor.submit(worker) for _ in range(count)]:
+                # raises if a sync connection could not be opened
+                future.result()
+        finally:
+            executor.shutdown()
+
+    if delete:
+        delete = _can_delete(server, serial, remote, files,
+                             result.listing_errors)
+    if delete:
+        for path in set(previous) - set(current) - set(result.errors):
+            local_path = os.path.join(local, *path.split('/'))
+            if os.path.isfile(local_path):
+                os.remove(local_path)
+                result.removed.append(local_path)
+
+    save_manifest(manifest, current)
+    result.seconds = time.time() - started
+    return result
+
+
+def _can_delete(server, serial, remote, files, errors):
+    """
+    Tells whether a listing can be trusted to remove the local files
+    missing from it
+    """
+    reason = None
+    if errors:
+        reason = "the listing failed"
+    elif not files:
+        reason = "the listing is empty"
+    else:
+        with SyncConnection(server, serial) as sync:
+            if not sync.exists(remote.rstrip('/') or '/'):
+                reason = "it does not exist"
+    if reason is not None:
+        ADB.LOGGER.warning("Not deleting local files missing from %s: %s",
+                           remote, reason)
+        return False
+    return True
+
+
+def _normpath(path):
+    path = posixpath.normpath("/" + path)
+    # normpath keeps a leading "//"
+    return "/" + path.lstrip("/")
+
+
+class RemoteTree(object):
+    """
+    Cached index of the files of the target device of adb.
+
+    tree = RemoteTree(adb)
+    tree.listdir("/sdcard")            # one sync LIST, then cached
+    tree.stat("/sdcard/DCIM")          # answered by the listing above
+    for dirpath, dirnames, filenames in tree.walk("/sdcard"):
+        ...                            # one find/stat pass for it all
+
+    Directories are listed when first accessed (lazy expansion), walk()
+    and expand() load a whole subtree in one round trip. Listings older
+    than max_age seconds (None: kept until invalidated) are reloaded,
+    invalidate() drops what is known under a path changed on the device.
+    """
+
+    def __init__(self, adb, max_age=None):
+        self._adb = adb
+        self._server = get_server(adb)
+        self._serial = adb.get_target_device()
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._stats = {}
+        # directory -> (time listed, names)
+        self._listings = {}
+        self._sync = None
+        self.lists = 0
+        self.expansions = 0
+
+    def __repr__(self):
+        return "RemoteTree(%r, %d entries)" % (self._serial, len(self._stats))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._sync is not None:
+                self._sync.close()
+                self._sync = None
+
+    def _sync_call(self, method, path):
+        if self._sync is None:
+            self._sync = SyncConnection(self._server, self._serial)
+        try:
+            return getattr(self._sync, method)(path)
+        except Exception:
+            self.close()
+            raise
+
+    def _listed(self, path):
+        listing = self._listings.get(path)
+        return listing is not None and (
+                self.max_age is None or
+                time.time() - listing[0] <= self.max_age)
+
+    def _drop(self, path):
+        """
+        Forgets path and everything under it
+        """
+        prefix = path.rstrip("/") + "/"
+        for index in (self._stats, self._listings):
+            for key in [key for key in index
+                        if key == path or key.startswith(prefix)]:
+                del index[key]
+
+    def _list(self, path):
+        entries = self._sync_call("listdir", path)
+        self.lists += 1
+        names = [entry.name for entry in entries]
+        previous = self._listings.get(path)
+        if previous is not None:
+            for name in set(previous[1]) - set(names):
+                self._drop(posixpath.join(path, name))
+        for entry in entries:
+            self._stats[posixpath.join(path, entry.name)] = SyncStat(
+                    entry.mode, entry.size, entry.mtime)
+        self._listings[path] = (time.time(), names)
+
+    def listdir(self, path):
+        """
+        Returns the names in a remote directory (empty if it does not
+        exist), listing it unless it is already known
+        """
+        path = _normpath(path)
+        with self._lock:
+            if not self._listed(path):
+                self._list(path)
+            return list(self._listings[path][1])
+
+    def stat(self, path):
+        """
+        Returns the SyncStat of a remote path (mode 0 if it does not
+        exist), listing its parent directory unless it is already known
+        """
+        path = _normpath(path)
+        with self._lock:
+            if path == "/":
+                if path not in self._stats:
+                    self._stats[path] = self._sync_call("stat", path)
+                return self._stats[path]
+            parent = posixpath.dirname(path)
+            if not self._listed(parent):
+                self._list(parent)
+            return self._stats.get(path) or SyncStat(0, 0, 0)
+
+    def exists(self, path):
+        return self.stat(path).exists
+
+    def isdir(self, path):
+        return self.stat(path).is_dir
+
+    def expand(self, path):
+        """
+        Loads the metadata of the whole subtree under path with a single
+        find/stat command
+        adb exec-out find <path>/ -exec stat -c '%f %s %Y %n' {} +
+        """
+        root = _normpath(path)
+        output = self._adb.exec_out(
+                "find %s -exec stat -c '%%f %%s %%Y %%n' {} + 2>/dev/null"
+                % quote(root.rstrip("/") + "/"))
+        now = time.time()
+        stats = {}
+        children = {}
+        for line in bytes(output).decode('utf-8', 'replace').split('\n'):
+            fields = line.split(' ', 3)
+            if len(fields) < 4:
+                continue
+            try:
+                entry = SyncStat(int(fields[0], 16), int(fields[1]),
+                                 int(fields[2]))
+            except ValueError:
+                ADB.LOGGER.warning("Unexpected stat output: %r", line)
+                continue
+            name = _normpath(fields[3])
+            stats[name] = entry
+            if name != root:
+                children.setdefault(posixpath.dirname(name), []).append(
+                        posixpath.basename(name))
+
+        with self._lock:
+            self.expansions += 1
+            self._drop(root)
+            self._stats.update(stats)
+            # the root may be a symlink to the directory (/sdcard)
+            for name, entry in stats.items():
+                if entry.is_dir or name == root:
+                    self._listings[name] = (now, children.get(name, []))
+
+    def _subdirs(self, path):
+        listing = self._listings.get(path)
+        if listing is None:
+            return []
+        children = [posixpath.join(path, name) for name in listing[1]]
+        return [child for child in children
+                if child in self._stats and self._stats[child].is_dir]
+
+    def walk(self, path, topdown=True):
+        """
+        Yields (dirpath, dirnames, filenames) like os.walk. A subtree not
+        known yet is expanded first, in one round trip. Like os.walk,
+        nothing is yielded for a path that is missing or not a directory.
+        """
+        path = _normpath(path)
+        with self._lock:
+            if not self._listed(path) or not all(
+                    self._listed(child) for child in self._subdirs(path)):
+                self.expand(path)
+            listing = self._listings.get(path)
+            if listing is None:
+                return
+            dirnames = [posixpath.basename(child)
+                        for child in self._subdirs(path)]
+            names = list(listing[1])
+        filenames = [name for name in names if name not in dirnames]
+        if topdown:
+            yield path, dirnames, filenames
+        for name in dirnames:
+            for item in self.walk(posixpath.join(path, name), topdown):
+                yield item
+        if not topdown:
+            yield path, dirnames, filenames
+
+    def invalidate(self, path=None):
+        """
+        Forgets what is known under path (everything if None), and the
+        listing of its parent
+        """
+        with self._lock:
+            if path is None:
+                self._stats.clear()
+                self._listings.clear()
+                return
+            path = _normpath(path)
+            self._drop(path)
+            self._listings.pop(posixpath.dirname(path), None)
+
+
+_trees = {}
+_trees_lock = threading.Lock()
+
+
+def remote_tree(adb, max_age=60.0):
+    """
+    Returns the RemoteTree shared by every caller for the target device
+    of adb
+    """
+    server = get_server(adb)
+    key = (server.host, server.port, adb.get_target_device())
+    with _trees_lock:
+        tree = _trees.get(key)
+        if tree is None:
+            tree = _trees[key] = RemoteTree(adb, max_age)
+    return tree
+
+
+def listdir(adb, path):
+    """
+    Returns the names in a remote directory, through remote_tree(adb)
+    """
+    return remote_tree(adb).listdir(path)
+
+
+def stat(adb, path):
+    """
+    Returns the SyncStat of a remote path, through remote_tree(adb)
+    """
+    return remote_tree(adb).stat(path)